@@ -0,0 +1,193 @@
+"""Защита конвейера ответа (3 вызова LLM на вопрос) от перегрузки:
+- RateLimiter — token bucket на пользователя: серия сообщений одного студента не занимает весь GigaChat;
+- RequestCoalescer — повтор того же текста от того же пользователя (двойное нажатие, пересылка), пока первый
+  запрос в работе или только что завершён, не запускает конвейер заново, а ждёт первый;
+- AdmissionController — общий лимит одновременных вопросов, который уменьшается, когда растёт время
+  ответа GigaChat (AIMD: вдвое вниз, по одному вверх); лишние вопросы ждут в очереди или получают отказ.
+
+Всё состояние — в памяти процесса. В режиме webhook чат всегда попадает в один воркер, поэтому лимиты
+на пользователя корректны; общий лимит действует на каждый воркер отдельно."""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Optional, Tuple
+import config
+from gigachat_client import is_throttled, latency_ewma
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket на пользователя: burst вопросов сразу, дальше per_minute в минуту.
+    Бакеты — LRU не больше max_entries (давно молчавшие пользователи вытесняются с полным бакетом)."""
+
+    def __init__(self, per_minute: float = None, burst: int = None, max_entries: int = None):
+        self.rate = (config.RATE_LIMIT_PER_MINUTE if per_minute is None else per_minute) / 60.0
+        self.burst = config.RATE_LIMIT_BURST if burst is None else burst
+        self.max_entries = config.STATE_MAX_ENTRIES if max_entries is None else max_entries
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()  # user → [токены, время, предупреждён]
+        self.rejected = 0
+
+    def acquire(self, user_id: Hashable) -> Tuple[bool, float, bool]:
+        """(разрешено, через сколько секунд появится токен, первый ли это отказ подряд — стоит ли отвечать)."""
+        if self.burst <= 0 or self.rate <= 0:
+            return True, 0.0, False
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = [float(self.burst), now, False]
+            self._buckets[user_id] = bucket
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, 0.0, False
+        self.rejected += 1
+        first = not bucket[2]
+        bucket[2] = True
+        return False, (1 - bucket[0]) / self.rate, first
+
+    def stats(self) -> Dict[str, Any]:
+        return {"users": len(self._buckets), "rejected": self.rejected}
+
+
+class RequestCoalescer:
+    """Повторы одного запроса: пока первый в работе и ещё window секунд после — повтор получает его future
+    (уже завершённый — ответ на первый запрос отправлен, повтору достаточно сослаться на него)."""
+
+    def __init__(self, window: float = None):
+        self.window = config.DEDUPE_WINDOW if window is None else window
+        self._entries: Dict[Hashable, list] = {}  # ключ → [future, время завершения или None]
+        self.coalesced = 0
+
+    def _purge(self, now: float) -> None:
+        for key in [k for k, (_f, done_at) in self._entries.items() if done_at is not None and now - done_at > self.window]:
+            del self._entries[key]
+
+    def attach(self, key: Hashable) -> Optional[asyncio.Future]:
+        """Future первого такого же запроса или None (тогда запрос — первый: begin/finish)."""
+        self._purge(time.monotonic())
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self.coalesced += 1
+        return entry[0]
+
+    def begin(self, key: Hashable) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = [future, None]
+        return future
+
+    def finish(self, key: Hashable) -> None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        if not entry[0].done():
+            entry[0].set_result(None)
+        entry[1] = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "coalesced": self.coalesced}
+
+
+class AdmissionController:
+    """Общий лимит одновременных вопросов с подстройкой по времени ответа GigaChat (AIMD)."""
+
+    def __init__(
+        self,
+        max_concurrent: int = None,
+        latency_target: float = None,
+        queue_timeout: float = None,
+        max_queue: int = None,
+    ):
+        self.max_concurrent = max(config.ADMISSION_MAX_CONCURRENT if max_concurrent is None else max_concurrent, 1)
+        self.latency_target = config.ADMISSION_LATENCY_TARGET if latency_target is None else latency_target
+        self.queue_timeout = config.ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.max_queue = config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.limit = self.max_concurrent
+        self.active = 0
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    def _overloaded(self) -> bool:
+        latency = latency_ewma()
+        return is_throttled() or (self.latency_target > 0 and latency is not None and latency > self.latency_target)
+
+    def _adjust(self) -> None:
+        """Вдвое вниз при перегрузке (не чаще раза в latency_target секунд — ждём, пока среднее отреагирует),
+        по одному вверх, когда GigaChat снова отвечает быстро."""
+        now = time.monotonic()
+        if self._overloaded():
+            if self.limit > 1 and now - self._last_decrease >= max(self.latency_target, 1.0):
+                self.limit = max(1, self.limit // 2)
+                self._last_decrease = now
+                logger.warning("GigaChat отвечает медленно (%.1f с): допуск снижен до %d", latency_ewma() or 0, self.limit)
+        elif self.limit < self.max_concurrent:
+            self.limit += 1
+
+    def _wake(self) -> None:
+        while self._waiters and self.active < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(True)
+
+    async def acquire(self) -> bool:
+        """True — слот получен (потом обязательно release()), False — отказ из-за перегрузки."""
+        self._adjust()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except BaseException:
+            # Отменили ожидающего: слот, выданный в этот момент, возвращаем
+            if future.done():
+                self.release()
+            else:
+                self._drop_waiter(future)
+            raise
+        if not future.done():
+            self._drop_waiter(future)
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def _drop_waiter(self, future: asyncio.Future) -> None:
+        future.cancel()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        self.active -= 1
+        self._adjust()
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "latency_ewma": latency_ewma(),
+        }
@@ -1,9 +1,13 @@
 """Блок 1: Нормализация запроса (LLM)"""
-import json
+import logging
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import config
-from gigachat_client import get_client
+from gigachat_client import GigaChatUnavailable, get_client
+from prompts import NORMALIZE
+from structured_output import NormalizationOutput, StructuredOutputError, complete_structured
+
+logger = logging.getLogger(__name__)
 
 # Ключевые слова оскорблений: проверка до и после LLM. Поиск по подстроке в нижнем регистре (без \b — надёжно для кириллицы).
 ABUSE_KEYWORDS = (
@@ -16,6 +20,16 @@ ABUSE_KEYWORDS = (
 )
 
 
+# Маркеры cheat для дешёвой локальной проверки (без LLM) — только фразы, которые нельзя прочитать иначе.
+# Отдельные слова («списать», «тест», «рецепт», «президент») встречаются и в вопросах по курсу
+# («списать амортизацию», «президента компании») — такие случаи проверяет короткий промпт Judge.
+# Отсутствие маркера ничего не говорит о типе.
+CHEAT_KEYWORDS = (
+    "реши за меня", "напиши за меня", "сделай за меня", "реши тест за", "пройди тест за",
+    "ответы на экзамен", "ответы на тест", "ответы к тест", "скинь решение", "скинь ответы",
+)
+
+
 def _has_abuse_keywords(text: str) -> bool:
     """Проверка по ключевым словам (подстрока в нижнем регистре). Работает надёжно для кириллицы."""
     if not (text or text.strip()):
@@ -24,71 +38,44 @@ def _has_abuse_keywords(text: str) -> bool:
     return any(kw in t for kw in ABUSE_KEYWORDS)
 
 
-SYSTEM_PROMPT = f"""Ты - система нормализации запросов для курса {config.COURSE_NAME}.
-
-Твоя задача:
-1. Переформулировать запрос студента в чистый поисковый запрос (убрать опечатки, сленг, привести к формальному виду)
-2. Классифицировать запрос по типу
-
-Критически важно:
-- Любое оскорбление (тупой, дурак, даун, отстой, иди в бан, бесполезный и т.п.) в адрес бота или помощника — ВСЕГДА type: "abuse", никогда "question".
-- Вопрос не по материалам курса — ВСЕГДА type: "off_topic". "question" — ТОЛЬКО если вопрос явно про темы, термины, модули и задания курса.
-- Темы из других областей (физика, квантовая механика, телепортация, погода, политика, кулинария, криптовалюты, кино, общие факты не из курса) — ВСЕГДА off_topic, даже если сформулированы как «в менеджменте» или «в контексте курса».
-
-Типы запросов:
-- "question" - только реальный вопрос по содержанию курса (темы, термины, модули, задания курса)
-- "abuse" - оскорбление или неуважительное обращение
-- "off_topic" - вопрос не по теме курса (в т.ч. научные/бытовые темы, не входящие в программу курса)
-- "cheat" - попытка получить ответ на экзамен/тест или обмануть систему
-
-Формат ответа - строго JSON:
-{{
-    "type": "question" | "abuse" | "off_topic" | "cheat",
-    "normalized_query": "очищенный поисковый запрос"
-}}
-
-Примеры:
-Вход: "как работает раг?"
-Выход: {{"type": "question", "normalized_query": "как работает RAG"}}
-
-Вход: "ты тупой"
-Выход: {{"type": "abuse", "normalized_query": "оскорбление"}}
-
-Вход: "какая погода сегодня?"
-Выход: {{"type": "off_topic", "normalized_query": "вопрос не по теме курса"}}
+def classify_by_keywords(text: str):
+    """Локальная классификация по однозначным маркерам: "abuse" | "cheat" или None, если маркеров нет.
+    off_topic локально не определяется: тематические слова слишком часто встречаются в вопросах по курсу."""
+    if _has_abuse_keywords(text or ""):
+        return "abuse"
+    t = (text or "").lower()
+    if any(kw in t for kw in CHEAT_KEYWORDS):
+        return "cheat"
+    return None
 
-Вход: "дай ответы на экзамен"
-Выход: {{"type": "cheat", "normalized_query": "попытка получить ответы на экзамен"}}
-
-Вопросы НЕ по теме курса (всегда off_topic): погода, политика, кулинария, криптовалюты, физика, квантовая телепортация, телепортация, общие факты не из курса.
-Вход: "Кто президент России?"
-Выход: {{"type": "off_topic", "normalized_query": "вопрос не по теме курса"}}
-
-Вход: "Как приготовить борщ?"
-Выход: {{"type": "off_topic", "normalized_query": "вопрос не по теме курса"}}
-
-Просьбы решить задание/тест/домашку за студента (cheat): "подскажи ответ на задание", "реши за меня", "скинь решение".
-Вход: "Подскажи ответ на задание 5" → {{"type": "cheat", "normalized_query": "попытка получить ответ на задание"}}
-
-ВАЖНО: Отвечай ТОЛЬКО валидным JSON, без дополнительного текста.
-"""
 
 RESPONSE_TEMPLATES = {
     "abuse": "Пожалуйста, будьте вежливы. Я здесь, чтобы помочь вам с вопросами по курсу.",
-    "off_topic": f"Этот вопрос не относится к курсу {config.COURSE_NAME}. Пожалуйста, задайте вопрос по материалам курса.",
+    "off_topic": "Этот вопрос не относится к курсу {course_name}. Пожалуйста, задайте вопрос по материалам курса.",
     "cheat": "Я не могу помочь с получением ответов на экзамены или тесты. Если у вас есть вопросы по материалам курса, я буду рад помочь."
 }
 
+# Шаблоны как регулярные выражения: название курса в отправленном ответе — любое (у каждого курса своё)
+_TEMPLATE_PATTERNS = {
+    qtype: re.compile(re.escape(text).replace(re.escape("{course_name}"), ".+?") + r"\Z", re.DOTALL)
+    for qtype, text in RESPONSE_TEMPLATES.items()
+}
+
 
-async def normalize_query(user_query: str) -> Dict[str, Any]:
+async def normalize_query(user_query: str, course: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Нормализует запрос пользователя и классифицирует его.
+    course — курс из courses.py (название и темы в промпте); None — COURSE_NAME из config.
     
     Returns:
         {
             "type": str,
             "normalized_query": str,
-            "original_query": str
+            "original_query": str,
+            "prompt_version": str,  # версия промпта (prompts.py); "local" — по ключевым словам, без LLM
+            "fallback": str  # только при откате: "parse_error" — ответ не разобран и после ремонта,
+                             # "unavailable" — GigaChat не ответил или выключатель разомкнут (gigachat_client),
+                             # "llm_error" — другая ошибка вызова; тип тогда по локальным маркерам, иначе question
         }
     """
     # Сначала проверка по ключевым словам оскорблений — без вызова LLM, гарантированно abuse
@@ -97,56 +84,62 @@ async def normalize_query(user_query: str) -> Dict[str, Any]:
             "type": "abuse",
             "normalized_query": "оскорбление",
             "original_query": user_query or "",
+            "prompt_version": "local",
         }
 
     try:
         client = await get_client()
-
-        user_message = user_query
-        
-        response_text = await client.chat_completion(
-            system_prompt=SYSTEM_PROMPT,
-            user_message=user_message,
+        # Ответ проверяется схемой (тип — одно из четырёх значений); не разобран — один повтор с ремонтом
+        parsed = await complete_structured(
+            client,
+            NormalizationOutput,
+            NORMALIZE.name,
+            system_prompt=NORMALIZE.system(course),
+            user_message=NORMALIZE.user(query=user_query),
             max_tokens=200,
             temperature=0.3,
-            response_format="json_object"
+            prompt_version=NORMALIZE.version,
         )
-        
-        # Парсим JSON ответ
-        # GigaChat может вернуть JSON в тексте, попробуем извлечь
-        try:
-            result = json.loads(response_text)
-        except json.JSONDecodeError:
-            # Если не JSON, попробуем найти JSON в тексте
-            import re
-            json_match = re.search(r'\{[^}]+\}', response_text)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                raise
-        
-        result["original_query"] = user_query
-
-        # Повторная проверка по ключевым словам (если LLM вернул question) — всегда abuse
-        if _has_abuse_keywords(user_query or ""):
-            result["type"] = "abuse"
-            result["normalized_query"] = result.get("normalized_query") or "оскорбление"
-
-        # Валидация типа
-        if result.get("type") not in ["question", "abuse", "off_topic", "cheat"]:
-            result["type"] = "question"
-
-        return result
-        
+    except StructuredOutputError as e:
+        logger.warning("Нормализация: ответ не разобран (%s) — тип по локальным маркерам", e)
+        return local_normalization(user_query, "parse_error")
+    except GigaChatUnavailable as e:
+        logger.info("Нормализация без LLM (%s) — тип по локальным маркерам", e)
+        return local_normalization(user_query, "unavailable")
     except Exception as e:
-        # Fallback: если ошибка, считаем вопросом
-        return {
-            "type": "question",
-            "normalized_query": user_query,
-            "original_query": user_query
-        }
+        logger.warning("Нормализация: вызов GigaChat не удался (%s) — тип по локальным маркерам", e)
+        return local_normalization(user_query, "llm_error")
+
+    return {
+        "type": parsed.type,
+        "normalized_query": parsed.normalized_query.strip() or user_query,
+        "original_query": user_query,
+        "prompt_version": NORMALIZE.version,
+    }
+
+
+def local_normalization(user_query: str, reason: str) -> Dict[str, Any]:
+    """Откат без ответа модели: cheat по однозначным маркерам, иначе question (вопрос не по курсу
+    до генерации отсекает порог уверенности поиска RETRIEVAL_GATE_MAX_DISTANCE). Причина — в поле fallback и в логе."""
+    return {
+        "type": classify_by_keywords(user_query) or "question",
+        "normalized_query": user_query,
+        "original_query": user_query,
+        "prompt_version": NORMALIZE.version,
+        "fallback": reason,
+    }
+
+
+def get_response_template(query_type: str, course_name: Optional[str] = None) -> str:
+    """Возвращает шаблонный ответ для типов, не требующих RAG"""
+    template = RESPONSE_TEMPLATES.get(query_type, "Извините, не могу обработать этот запрос.")
+    return template.format(course_name=course_name or config.COURSE_NAME)
 
 
-def get_response_template(query_type: str) -> str:
-    """Возвращает шаблонный ответ для типов, не требующих RAG"""
-    return RESPONSE_TEMPLATES.get(query_type, "Извините, не могу обработать этот запрос.")
+def template_type(answer: str) -> Optional[str]:
+    """Тип шаблонного ответа по его тексту (с названием любого курса); None — ответ не шаблонный."""
+    answer = (answer or "").strip()
+    for qtype, pattern in _TEMPLATE_PATTERNS.items():
+        if pattern.match(answer):
+            return qtype
+    return None
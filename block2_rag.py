@@ -1,117 +1,583 @@
 """Блок 2: RAG - поиск по базе знаний.
-Поддержка гибридного поиска: векторная близость + совпадение ключевых слов (точные термины из запроса)."""
+Поддержка гибридного поиска: векторная близость + совпадение ключевых слов (точные термины из запроса).
+
+Тяжёлые библиотеки (langchain, chromadb, torch) и модель эмбеддингов загружаются лениво — при первом
+поиске или индексации, а не при импорте модуля. Бот прогревает индекс в фоне (warm_up), пока уже
+принимает сообщения; is_ready() говорит, можно ли искать без ожидания загрузки, index_state() — чем
+закончилась загрузка (пустая база и ошибка отличаются от «ещё грузится»).
+
+У каждого курса (courses.py) свой индекс — KnowledgeIndex со своей vector_db; модель эмбеддингов общая.
+Функции модуля без course_id работают с курсом по умолчанию."""
+import contextlib
+import hashlib
+import json
+import logging
 import os
 import re
-from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    TextLoader,
-)
-from langchain.schema import Document
+import threading
+import time
+from typing import List, Dict, Any, Optional
 import config
+from chunker import CHUNKER_VERSION, iter_structured_chunks
+from courses import get_course
+from embedding_cache import QueryEmbeddingCache
+from kb_loader import PARSER_VERSION, file_hash, iter_knowledge_base, list_kb_files
+from lexical import LEMMAS_FIELD, decode_lemmas, encode_lemmas, lemma_set, lemmatizer_name, query_lemmas, stem
 
-# Инициализация эмбеддингов
-embeddings = HuggingFaceEmbeddings(
-    model_name=config.EMBEDDING_MODEL,
-    model_kwargs={'device': 'cpu'}
-)
-
-# Сплиттер: сначала по абзацам/предложениям, потом по словам, чтобы не резать термины
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=config.CHUNK_SIZE,
-    chunk_overlap=config.CHUNK_OVERLAP,
-    length_function=len,
-    separators=["\n\n", "\n", ". ", ", ", " ", ""],
-)
-
-vector_store = None
-
-
-def _normalize_text_for_indexing(text: str) -> str:
-    """Нормализация текста перед разбиением: убираем лишние пробелы/переносы, чтобы не портить чанки."""
-    if not text or not text.strip():
-        return text
-    # Убираем нулевые байты и лишние пробелы/переносы
-    t = text.replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
-    t = re.sub(r"\n{3,}", "\n\n", t)
-    t = re.sub(r"[ \t]+", " ", t)
-    return t.strip()
-
-
-def load_knowledge_base():
-    """Загружает материалы курса в векторную базу"""
-    global vector_store
-    
-    if not os.path.exists(config.KNOWLEDGE_BASE_PATH):
-        os.makedirs(config.KNOWLEDGE_BASE_PATH)
-        print(f"Создана папка {config.KNOWLEDGE_BASE_PATH}. Добавьте туда материалы курса (PDF, TXT, MD, DOCX)")
-        return None
-    
-    documents = []
-    base_path = os.path.abspath(config.KNOWLEDGE_BASE_PATH)
-
-    # Обход всех файлов в knowledge_base и во вложенных папках (PDF, TXT, MD, DOCX)
-    for root, _dirs, files in os.walk(base_path):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            rel_path = os.path.relpath(filepath, base_path)
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, переиндексацию запускать из одного процесса
+    fcntl = None
+
+_embeddings = None
+_text_splitter = None
+
+logger = logging.getLogger(__name__)
+
+# Состояние индекса: loading — ещё грузится (или повтор после ошибки), ready — можно искать,
+# empty — в базе знаний нет документов, failed — загрузка не удалась после всех повторов
+INDEX_LOADING, INDEX_READY, INDEX_EMPTY, INDEX_FAILED = "loading", "ready", "empty", "failed"
+
+
+def _get_embeddings():
+    """Модель эмбеддингов: создаётся при первом обращении (импорт torch/sentence-transformers — здесь).
+    EMBEDDING_BACKEND=onnx — та же модель через ONNX Runtime (embeddings_onnx.py), без torch.
+    Векторы запросов кэшируются (embedding_cache.py), если QUERY_EMBEDDING_CACHE_SIZE > 0."""
+    global _embeddings
+    if _embeddings is None:
+        if config.EMBEDDING_BACKEND == "onnx":
+            from embeddings_onnx import OnnxEmbeddings
+            embeddings = OnnxEmbeddings()
+        else:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            embeddings = HuggingFaceEmbeddings(
+                model_name=config.EMBEDDING_MODEL,
+                model_kwargs={'device': 'cpu'}
+            )
+        if config.QUERY_EMBEDDING_CACHE_SIZE > 0:
+            embeddings = QueryEmbeddingCache(embeddings, f"{config.EMBEDDING_MODEL}|{_embedding_backend()}")
+        _embeddings = embeddings
+    return _embeddings
+
+
+def embed_query(text: str) -> List[float]:
+    """Вектор запроса той же моделью, что и поиск (через кэш эмбеддингов запросов)."""
+    return _get_embeddings().embed_query(text)
+
+
+def query_embedding_cache_stats() -> Dict[str, Any]:
+    """Статистика кэша эмбеддингов запросов ({} — кэш выключен или модель ещё не загружена)."""
+    return _embeddings.stats() if isinstance(_embeddings, QueryEmbeddingCache) else {}
+
+
+def _get_text_splitter():
+    """Сплиттер: сначала по абзацам/предложениям, потом по словам, чтобы не резать термины."""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=config.CHUNK_SIZE,
+            chunk_overlap=config.CHUNK_OVERLAP,
+            length_function=len,
+            separators=["\n\n", "\n", ". ", ", ", " ", ""],
+        )
+    return _text_splitter
+
+
+def _iter_chunks(documents, parents: Dict[str, Dict[str, Any]] = None):
+    """Документ за документом → чанки (генератор: в памяти только текущая страница).
+    CHUNKER=structure: дочерние чанки chunker.py, их разделы складываются в parents.
+    В метаданные каждого чанка записываются его леммы (lexical.py) — для переранжирования без сканирования текста."""
+    for chunk in _split_chunks(documents, parents):
+        chunk.metadata[LEMMAS_FIELD] = encode_lemmas(chunk.page_content)
+        yield chunk
+
+
+def _split_chunks(documents, parents: Dict[str, Dict[str, Any]] = None):
+    from langchain.schema import Document
+    if config.CHUNKER == "structure":
+        for child in iter_structured_chunks(documents, parents if parents is not None else {}):
+            yield Document(page_content=child["text"], metadata=child["metadata"])
+        return
+    splitter = _get_text_splitter()
+    for d in documents:
+        for chunk in splitter.split_documents([Document(page_content=d["text"], metadata=d["metadata"])]):
+            yield chunk
+
+
+def _batched(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _peak_rss_mb() -> float:
+    """Пиковый RSS процесса в МБ (0, если платформа не поддерживает resource)."""
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        return 0.0
+
+
+def _current_rss_mb() -> float:
+    """Текущий RSS процесса в МБ (Linux: /proc/self/statm; иначе — пиковый)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _peak_rss_mb()
+
+
+# Имя коллекции по умолчанию в langchain Chroma — индексы, собранные до манифеста
+COLLECTION_NAME = "langchain"
+# Манифест индекса: активная коллекция, хэши проиндексированных файлов, параметры чанкинга
+MANIFEST_FILE = "kb_manifest.json"
+PARENTS_FILE = "parents_{collection}.json"  # разделы (CHUNKER=structure) — рядом с коллекцией, версия та же
+
+
+def _drop_collection(client, name: str) -> None:
+    try:
+        client.delete_collection(name)
+    except ValueError:
+        pass  # коллекции нет
+
+
+def _store_is_empty(store) -> bool:
+    return not store.get(limit=1, include=[])["ids"]
+
+
+@contextlib.contextmanager
+def _process_lock(path: str):
+    """Межпроцессная блокировка файла: переиндексацию одной vector_db ведёт один процесс
+    (в режиме webhook /reindex и наблюдатель могут сработать в разных воркерах)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _embedding_backend() -> str:
+    if config.EMBEDDING_BACKEND == "onnx":
+        return f"onnx:{os.path.basename(config.EMBEDDING_ONNX_PATH)}"
+    return "torch"
+
+
+def _index_settings() -> Dict[str, Any]:
+    """Параметры, от которых зависят чанки и эмбеддинги: при их изменении индекс пересобирается целиком."""
+    return {
+        "embedding_model": config.EMBEDDING_MODEL,
+        "embedding_backend": _embedding_backend(),
+        "chunker": config.CHUNKER,
+        "chunk_size": config.CHUNK_SIZE,
+        "chunk_overlap": config.CHUNK_OVERLAP,
+        "child_chunk_size": config.CHILD_CHUNK_SIZE,
+        "parent_chunk_size": config.PARENT_CHUNK_SIZE,
+        "chunker_version": CHUNKER_VERSION,
+        "parser_version": PARSER_VERSION,
+        "lemmatizer": lemmatizer_name(),
+    }
+
+
+def _kb_signature(base_path: str) -> Dict[str, tuple]:
+    """Дешёвый отпечаток базы знаний для наблюдателя: (размер, mtime) файлов, без чтения содержимого."""
+    signature = {}
+    for filepath, rel_path in list_kb_files(base_path):
+        try:
+            st = os.stat(filepath)
+            signature[rel_path] = (st.st_size, st.st_mtime)
+        except OSError:
+            continue
+    return signature
+
+
+class KnowledgeIndex:
+    """Индекс одного курса: папка материалов, Chroma в своей vector_db, состояние загрузки.
+    Модель эмбеддингов и сплиттер — общие для всех курсов (_get_embeddings, _get_text_splitter)."""
+
+    def __init__(self, course_id: str, knowledge_base_path: str, vector_db_path: str):
+        self.course_id = course_id
+        self.knowledge_base_path = knowledge_base_path
+        self.vector_db_path = vector_db_path
+        self.vector_store = None
+        self.parents: Dict[str, Dict[str, Any]] = {}  # parent_id → раздел {"text", "metadata"}
+        self.state = INDEX_LOADING
+        self.ready = threading.Event()
+        self.memory_mb = None  # прирост RSS при загрузке индекса (для отчёта по курсам)
+        self._load_lock = threading.Lock()
+        self._reindex_lock = threading.Lock()
+        self._warm_thread = None
+        self._collection = None  # коллекция, по которой ищет этот процесс
+        self._manifest_mtime = None
+
+    def _chroma_client(self):
+        import chromadb
+        os.makedirs(self.vector_db_path, exist_ok=True)
+        return chromadb.PersistentClient(path=self.vector_db_path)
+
+    def _open_store(self, client, collection_name: str = COLLECTION_NAME):
+        from langchain_community.vectorstores import Chroma
+        return Chroma(client=client, collection_name=collection_name, embedding_function=_get_embeddings())
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.vector_db_path, MANIFEST_FILE)
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """Манифест индекса ({} — индекс собран без манифеста или ещё не собирался)."""
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        path = self._manifest_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)  # атомарно: читатель видит старый или новый манифест целиком
+
+    def _parents_path(self, collection: str) -> str:
+        return os.path.join(self.vector_db_path, PARENTS_FILE.format(collection=collection))
+
+    def _load_parents(self, collection: str) -> Dict[str, Dict[str, Any]]:
+        """Разделы коллекции ({} — индекс собран CHUNKER=recursive или до появления разделов)."""
+        try:
+            with open(self._parents_path(collection), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_parents(self, collection: str, parents: Dict[str, Dict[str, Any]]) -> None:
+        path = self._parents_path(collection)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(parents, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _manifest_changed(self) -> bool:
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        self._manifest_mtime = mtime
+        return True
+
+    def _follow_manifest(self) -> None:
+        """Переключается на коллекцию из манифеста, если её переиндексировал другой процесс
+        (webhook-воркеры делят одну vector_db). Проверка — один stat() на запрос."""
+        if not self._manifest_changed():
+            return
+        collection = self.read_manifest().get("collection")
+        if not collection or collection == self._collection:
+            return
+        try:
+            self.parents = self._load_parents(collection)
+            self.vector_store = self._open_store(self._chroma_client(), collection)
+            self._collection = collection
+            logger.info("Курс %s: переключение на коллекцию %s", self.course_id, collection)
+        except Exception as e:
+            logger.warning("Курс %s: не удалось открыть коллекцию %s: %s", self.course_id, collection, e)
+
+    def _copy_unchanged(self, client, source_name: str, target_name: str, skip_sources: set) -> int:
+        """Переносит чанки неизменённых файлов из рабочей коллекции в теневую вместе с эмбеддингами (без переэмбеддинга)."""
+        try:
+            source = client.get_collection(source_name, embedding_function=None)
+        except ValueError:
+            return 0
+        target = client.get_collection(target_name, embedding_function=None)
+        copied = 0
+        offset = 0
+        while True:
+            page = source.get(
+                limit=config.INDEX_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"]
+            )
+            if not page["ids"]:
+                return copied
+            offset += len(page["ids"])
+            keep = [i for i, m in enumerate(page["metadatas"]) if (m or {}).get("source") not in skip_sources]
+            if keep:
+                target.add(
+                    ids=[page["ids"][i] for i in keep],
+                    embeddings=[page["embeddings"][i] for i in keep],
+                    documents=[page["documents"][i] for i in keep],
+                    metadatas=[page["metadatas"][i] for i in keep],
+                )
+                copied += len(keep)
+
+    def reindex(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Инкрементальная переиндексация без остановки бота.
+
+        Сравнивает хэши файлов базы знаний с манифестом, разбирает и эмбеддит только новые и изменённые
+        файлы и собирает теневую коллекцию: чанки неизменённых файлов копируются из рабочей с готовыми
+        эмбеддингами. Затем манифест атомарно переключается на теневую коллекцию, а поиск начинает
+        идти по ней. Запросы, уже начавшие поиск по старой коллекции, дорабатывают по ней: она удаляется
+        только при следующей переиндексации. Недостроенная после сбоя коллекция в манифест не попадает
+        и тоже удаляется при следующей переиндексации.
+
+        full=True (или смена модели эмбеддингов / параметров чанкинга) — пересобрать всё.
+
+        Returns:
+            {"changed": N, "removed": N, "copied_chunks": N, "new_chunks": N, "chunks": N, "seconds": t, "skipped": bool}
+        """
+        started = time.perf_counter()
+        with self._reindex_lock, _process_lock(os.path.join(self.vector_db_path, ".reindex.lock")):
+            base_path = os.path.abspath(self.knowledge_base_path)
+            manifest = self.read_manifest()
+            if manifest.get("settings") != _index_settings():
+                full = True
+            old_files = {} if full else manifest.get("files", {})
+            old_collection = manifest.get("collection", COLLECTION_NAME)
+
+            current = {}
+            for filepath, rel_path in list_kb_files(base_path):
+                try:
+                    current[rel_path] = file_hash(filepath)
+                except OSError as e:
+                    print(f"Ошибка при чтении {rel_path}: {e}")
+            changed = {rel for rel, digest in current.items() if old_files.get(rel) != digest}
+            removed = set(old_files) - set(current)
+            result = {"changed": len(changed), "removed": len(removed), "copied_chunks": 0, "new_chunks": 0}
+            if not full and not changed and not removed and manifest:
+                result.update(chunks=manifest.get("chunks", 0), seconds=time.perf_counter() - started, skipped=True)
+                return result
+
+            client = self._chroma_client()
+            # Остатки прерванных сборок и коллекции, которые уже никто не читает
+            for collection in client.list_collections():
+                if collection.name != old_collection:
+                    _drop_collection(client, collection.name)
+            for name in os.listdir(self.vector_db_path):
+                if name.startswith("parents_") and name != os.path.basename(self._parents_path(old_collection)):
+                    with contextlib.suppress(OSError):
+                        os.remove(os.path.join(self.vector_db_path, name))
+
+            shadow_name = f"kb_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+            shadow = self._open_store(client, shadow_name)
+            parents = {}
+            if not full:
+                result["copied_chunks"] = self._copy_unchanged(client, old_collection, shadow_name, changed | removed)
+                parents = {
+                    pid: p for pid, p in self._load_parents(old_collection).items()
+                    if p["metadata"].get("source") not in changed | removed
+                }
+
+            stats = {}
+            docs = iter_knowledge_base(base_path, files=changed, stats=stats)
+            for batch in _batched(_iter_chunks(docs, parents), config.INDEX_BATCH_SIZE):
+                shadow.add_documents(batch)
+                result["new_chunks"] += len(batch)
+
+            total = result["copied_chunks"] + result["new_chunks"]
+            result.update(chunks=total, seconds=time.perf_counter() - started, skipped=False)
+            if not total:
+                _drop_collection(client, shadow_name)
+                print(f"Не найдено документов в {self.knowledge_base_path}")
+                return result
+
+            # Файлы с ошибкой разбора в манифест не пишем — их попробуем снова при следующей переиндексации
+            files = {rel: d for rel, d in current.items() if rel not in changed or rel in stats.get("parsed", ())}
+            if parents:
+                self._write_parents(shadow_name, parents)  # до манифеста: другие воркеры читают их вместе
+            self._write_manifest({
+                "collection": shadow_name,
+                "settings": _index_settings(),
+                "files": files,
+                "chunks": total,
+                "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+            self.parents = parents
+            self.vector_store = shadow  # присваивание атомарно: новые запросы ищут уже по теневой коллекции
+            self._collection = shadow_name
+            self.state = INDEX_READY
+            self.ready.set()
+        print(
+            f"Переиндексация [{self.course_id}]: изменено {result['changed']}, удалено {result['removed']} файлов; "
+            f"скопировано {result['copied_chunks']}, новых {result['new_chunks']} чанков за {result['seconds']:.1f} с "
+            f"(пиковый RSS {_peak_rss_mb():.0f} МБ)"
+        )
+        return result
+
+    def load_knowledge_base(self):
+        """Полная сборка индекса курса через reindex(full=True).
+        Конвейер потоковый: разбор файлов → нормализация → чанки → эмбеддинги → запись в Chroma
+        пачками по INDEX_BATCH_SIZE, без списков всех документов и чанков в памяти.
+        Рабочая коллекция заменяется, только если получился хотя бы один чанк."""
+        if not os.path.exists(self.knowledge_base_path):
+            os.makedirs(self.knowledge_base_path)
+            print(f"Создана папка {self.knowledge_base_path}. Добавьте туда материалы курса (PDF, TXT, MD, DOCX)")
+            return None
+        if not self.reindex(full=True)["chunks"]:
+            return None
+        print("Векторная база создана и сохранена")
+        return self.vector_store
+
+    def get_vector_store(self):
+        """Векторная база: открывает сохранённую (коллекцию из манифеста) или строит заново.
+        Потокобезопасно, один раз; дальше её подменяет только reindex().
+        Пустая рабочая коллекция (например, база создана, но индексация ни разу не завершилась) пересобирается."""
+        with self._load_lock:
+            if self.vector_store is None and self.state not in (INDEX_EMPTY, INDEX_FAILED):
+                rss_before = _current_rss_mb()
+                manifest = self.read_manifest()
+                # Индекс собран с другой моделью эмбеддингов или чанкингом — пересобираем
+                outdated = bool(manifest) and manifest.get("settings") != _index_settings()
+                if os.path.exists(self.vector_db_path) and not outdated:
+                    try:
+                        collection = manifest.get("collection", COLLECTION_NAME)
+                        self.parents = self._load_parents(collection)
+                        store = self._open_store(self._chroma_client(), collection)
+                        self.vector_store = None if _store_is_empty(store) else store
+                        self._collection = collection
+                        self._manifest_changed()
+                    except Exception:
+                        self.vector_store = None
+                if self.vector_store is None:
+                    self.vector_store = self.load_knowledge_base()
+                if self.vector_store is None:
+                    self.state = INDEX_EMPTY  # документов нет — не пересобираем на каждом запросе
+                self.memory_mb = _current_rss_mb() - rss_before
+                logger.info("Курс %s: индекс открыт, +%.0f МБ RSS", self.course_id, self.memory_mb)
+            elif self.vector_store is not None:
+                self._follow_manifest()
+            if self.vector_store is not None:
+                self.state = INDEX_READY
+                self.ready.set()
+        return self.vector_store
+
+    def warm_up(self, retries: int = None, backoff: float = None):
+        """Прогрев: загрузка модели эмбеддингов и индекса + пробный запрос (первый encode тоже небыстрый).
+        При ошибке повторяет до retries раз с паузой backoff, 2×backoff, ...; после последней неудачи
+        индекс помечается failed и исключение пробрасывается."""
+        retries = config.WARMUP_RETRIES if retries is None else retries
+        delay = config.WARMUP_BACKOFF if backoff is None else backoff
+        for attempt in range(retries + 1):
             try:
-                if filename.lower().endswith('.pdf'):
-                    loader = PyPDFLoader(filepath)
-                    docs = loader.load()
-                    for d in docs:
-                        if d.page_content and d.page_content.strip():
-                            d.page_content = _normalize_text_for_indexing(d.page_content)
-                            if d.page_content:
-                                d.metadata["source"] = rel_path
-                                documents.append(d)
-                elif filename.lower().endswith('.txt'):
-                    loader = TextLoader(filepath, encoding='utf-8')
-                    docs = loader.load()
-                    for d in docs:
-                        if d.page_content and d.page_content.strip():
-                            d.page_content = _normalize_text_for_indexing(d.page_content)
-                            if d.page_content:
-                                d.metadata["source"] = rel_path
-                                documents.append(d)
-                elif filename.lower().endswith('.md'):
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        text = _normalize_text_for_indexing(f.read())
-                    if text:
-                        documents.append(Document(page_content=text, metadata={"source": rel_path}))
-                elif filename.lower().endswith('.docx'):
-                    from docx import Document as DocxDocument
-                    doc = DocxDocument(filepath)
-                    text = _normalize_text_for_indexing('\n'.join([p.text for p in doc.paragraphs if p.text]))
-                    if text:
-                        documents.append(Document(page_content=text, metadata={"source": rel_path}))
+                store = self.get_vector_store()
+                if store is not None:
+                    store.similarity_search_with_score("прогрев", k=1)
+                return store
             except Exception as e:
-                print(f"Ошибка при загрузке {rel_path}: {e}")
+                if attempt >= retries:
+                    self.state = INDEX_FAILED
+                    raise
+                logger.warning("Загрузка индекса %s не удалась (%s), повтор через %.0f с", self.course_id, e, delay)
+                time.sleep(delay)
+                delay *= 2
+
+    def ensure_warming(self) -> None:
+        """Запускает фоновый прогрев, если он ещё не запускался (ленивая загрузка курса).
+        Бот при этом продолжает принимать сообщения; повторы после ошибок — внутри warm_up."""
+        if self._warm_thread is not None or self.state != INDEX_LOADING:
+            return
+
+        def run():
+            started = time.perf_counter()
+            try:
+                if self.warm_up() is None:
+                    logger.warning("База знаний курса %s пуста: на вопросы будет ответ «не найдено»", self.course_id)
+                else:
+                    logger.info("База знаний курса %s готова за %.1f с", self.course_id, time.perf_counter() - started)
+            except Exception as e:
+                logger.error("Ошибка загрузки базы знаний %s (повторы исчерпаны): %s", self.course_id, e, exc_info=True)
+
+        self._warm_thread = threading.Thread(target=run, daemon=True)
+        self._warm_thread.start()
+
+
+# Индексы курсов: создаются при первом обращении, грузятся лениво
+_indexes: Dict[str, KnowledgeIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(course_id: str = None) -> KnowledgeIndex:
+    """Индекс курса (None — курс по умолчанию)."""
+    course = get_course(course_id)
+    with _indexes_lock:
+        index = _indexes.get(course["id"])
+        if index is None:
+            index = KnowledgeIndex(course["id"], course["knowledge_base_path"], course["vector_db_path"])
+            _indexes[course["id"]] = index
+    return index
+
+
+def memory_report() -> List[Dict[str, Any]]:
+    """Загруженные индексы курсов: состояние и прирост RSS при загрузке (первый курс включает модель эмбеддингов)."""
+    return [
+        {"course": i.course_id, "state": i.state, "memory_mb": i.memory_mb}
+        for i in list(_indexes.values())
+    ]
+
+
+# Функции модуля — для курса по умолчанию (или course_id), как до появления нескольких курсов
+
+def reindex(full: bool = False, course_id: str = None) -> Dict[str, Any]:
+    return get_index(course_id).reindex(full)
+
+
+def load_knowledge_base(course_id: str = None):
+    """Загружает материалы курса в векторную базу (полная пересборка)."""
+    return get_index(course_id).load_knowledge_base()
+
+
+def get_vector_store(course_id: str = None):
+    return get_index(course_id).get_vector_store()
+
+
+def read_manifest(course_id: str = None) -> Dict[str, Any]:
+    return get_index(course_id).read_manifest()
+
+
+def warm_up(retries: int = None, backoff: float = None, course_id: str = None):
+    return get_index(course_id).warm_up(retries, backoff)
+
+
+def is_ready(course_id: str = None) -> bool:
+    """Индекс загружен — поиск не будет ждать загрузки модели и базы."""
+    return get_index(course_id).ready.is_set()
+
+
+def index_state(course_id: str = None) -> str:
+    """loading / ready / empty / failed — см. INDEX_* выше."""
+    return get_index(course_id).state
+
+
+def watch_knowledge_base(interval: float = None, stop: threading.Event = None) -> None:
+    """Наблюдатель: раз в interval секунд (KB_WATCH_INTERVAL) проверяет папки материалов загруженных курсов
+    и при изменениях запускает reindex(). Блокирующий цикл — запускать в отдельном потоке."""
+    interval = interval or config.KB_WATCH_INTERVAL
+    stop = stop or threading.Event()
+    last: Dict[str, Dict[str, tuple]] = {}
+    while not stop.wait(interval):
+        for index in list(_indexes.values()):
+            if index.state not in (INDEX_READY, INDEX_EMPTY):
+                continue  # индекс ещё грузится или не загрузился — проверим позже
+            signature = _kb_signature(os.path.abspath(index.knowledge_base_path))
+            if index.course_id not in last:
+                last[index.course_id] = signature
                 continue
-    
-    if not documents:
-        print(f"Не найдено документов в {config.KNOWLEDGE_BASE_PATH}")
-        return None
-    
-    # Разбивка на чанки
-    chunks = text_splitter.split_documents(documents)
-    print(f"Загружено {len(documents)} документов, создано {len(chunks)} чанков")
-    
-    # Создание векторной базы
-    os.makedirs(config.VECTOR_DB_PATH, exist_ok=True)
-    vector_store = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=config.VECTOR_DB_PATH
-    )
-    # В Chroma 0.4.x автоматическое сохранение, persist() больше не нужен
-    # vector_store.persist()  # Удалено - вызывает предупреждение
-    
-    print("Векторная база создана и сохранена")
-    return vector_store
+            if signature == last[index.course_id]:
+                continue
+            try:
+                index.reindex()
+                last[index.course_id] = signature
+            except Exception as e:
+                logger.error("Ошибка переиндексации %s: %s", index.course_id, e, exc_info=True)
 
 
 def _extract_query_terms(query: str) -> List[str]:
@@ -123,36 +589,30 @@ def _extract_query_terms(query: str) -> List[str]:
     return [w for w in words if 2 <= len(w) <= 50]
 
 
-def _keyword_score(chunk_text: str, terms: List[str]) -> int:
-    """Считает, сколько терминов запроса встречаются в чанке (без учёта регистра)."""
-    if not terms:
+def _keyword_score(metadata: Dict[str, Any], content: str, lemmas: List[str]) -> int:
+    """Сколько лемм запроса есть среди лемм чанка: множество из метаданных (посчитано при индексации),
+    у чанков индекса без лемм — по тексту."""
+    if not lemmas:
         return 0
-    lower = chunk_text.lower()
-    return sum(1 for t in terms if t in lower)
+    stored = metadata.get(LEMMAS_FIELD)
+    chunk_lemmas = decode_lemmas(stored) if stored is not None else lemma_set(content)
+    return sum(1 for t in lemmas if t in chunk_lemmas)
 
 
-def search_relevant_chunks(query: str, top_k: int = None) -> List[Dict[str, Any]]:
+def search_relevant_chunks(query: str, top_k: int = None, course_id: str = None) -> List[Dict[str, Any]]:
     """
     Гибридный поиск: семантика (эмбеддинги) + совпадение ключевых слов.
     Так находятся и точные термины из базы (ESG, названия и т.д.), и смыслово близкие фрагменты.
     
+    Индекс CHUNKER=structure: ищутся дочерние чанки, а возвращаются их разделы — без повторов (несколько
+    найденных кусков одного раздела дают один раздел с лучшими score и keyword_hits), не больше top_k
+    разделов и RAG_CONTEXT_MAX_CHARS символов. Чанк без раздела (старый индекс) возвращается как есть.
+
     Returns:
         List of dicts with keys: content, score, metadata
     """
-    global vector_store
-
-    if vector_store is None:
-        if os.path.exists(config.VECTOR_DB_PATH):
-            try:
-                vector_store = Chroma(
-                    persist_directory=config.VECTOR_DB_PATH,
-                    embedding_function=embeddings,
-                )
-            except Exception:
-                vector_store = load_knowledge_base()
-        else:
-            vector_store = load_knowledge_base()
-
+    index = get_index(course_id)
+    vector_store = index.get_vector_store()
     if vector_store is None:
         return []
 
@@ -162,18 +622,18 @@ def search_relevant_chunks(query: str, top_k: int = None) -> List[Dict[str, Any]
     # 1) Берём больше кандидатов по векторной близости
     results = vector_store.similarity_search_with_score(query, k=min(n_candidates, 50))
 
-    terms = _extract_query_terms(query)
+    terms = query_lemmas(query)
     chunks_with_meta = []
 
     for doc, score in results:
         content = doc.page_content
         # Chroma: меньше score = ближе (L2). Нормализуем в "похожесть": чем меньше distance, тем лучше
         vector_score = float(score)
-        kw = _keyword_score(content, terms)
+        kw = _keyword_score(doc.metadata, content, terms)
         chunks_with_meta.append({
             "content": content,
             "score": vector_score,
-            "metadata": doc.metadata,
+            "metadata": {k: v for k, v in doc.metadata.items() if k != LEMMAS_FIELD},
             "keyword_hits": kw,
             "terms": terms,
         })
@@ -184,17 +644,101 @@ def search_relevant_chunks(query: str, top_k: int = None) -> List[Dict[str, Any]
 
     chunks_with_meta.sort(key=rank_key, reverse=True)
 
-    # 3) Возвращаем top_k, убираем служебные поля для совместимости
-    out = []
-    for c in chunks_with_meta[:top_k]:
-        out.append({
-            "content": c["content"],
+    # 3) Возвращаем top_k, убираем служебные поля для совместимости (keyword_hits нужен выборке Judge)
+    parents = index.parents
+    if not parents:
+        out = []
+        for c in chunks_with_meta[:top_k]:
+            out.append({
+                "content": c["content"],
+                "score": c["score"],
+                "metadata": c["metadata"],
+                "keyword_hits": c["keyword_hits"],
+            })
+        return out
+    return _expand_to_parents(chunks_with_meta, parents, top_k)
+
+
+def _expand_to_parents(chunks: List[Dict[str, Any]], parents: Dict[str, Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    """Дочерние чанки (уже в порядке ранжирования) → их разделы без повторов, в пределах top_k и RAG_CONTEXT_MAX_CHARS.
+    Раздел, не влезающий в остаток бюджета, пропускается (следующий, более короткий, может влезть);
+    первый раздел берётся всегда."""
+    out, seen = [], {}
+    budget = config.RAG_CONTEXT_MAX_CHARS
+    for c in chunks:
+        parent_id = c["metadata"].get("parent_id")
+        parent = parents.get(parent_id) if parent_id else None
+        if parent_id in seen:
+            # Ещё один кусок того же раздела: раздел уже взят, уточняем его distance
+            seen[parent_id]["score"] = min(seen[parent_id]["score"], c["score"])
+            continue
+        content = parent["text"] if parent else c["content"]
+        if out and (len(out) >= top_k or budget - len(content) < 0):
+            continue
+        item = {
+            "content": content,
             "score": c["score"],
-            "metadata": c["metadata"],
-        })
+            "metadata": dict(parent["metadata"], parent_id=parent_id) if parent else c["metadata"],
+            "keyword_hits": c["keyword_hits"],
+        }
+        out.append(item)
+        budget -= len(content)
+        if parent_id:
+            seen[parent_id] = item
     return out
 
 
+# Служебные слова вопросов: не учитываются в лексическом покрытии
+STOP_WORDS = frozenset((
+    "что", "такое", "как", "кто", "где", "когда", "зачем", "почему", "сколько", "какой", "какая", "какое",
+    "какие", "каков", "чем", "про", "это", "для", "или", "ли", "не", "по", "из", "от", "до", "за", "об",
+    "при", "над", "под", "без", "мне", "меня", "ты", "вы", "можно", "нужно", "расскажи", "объясни",
+    "опиши", "подскажи", "скажи", "the", "what", "is", "how",
+))
+
+
+def retrieval_confidence(query: str, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Признаки уверенности поиска: distance лучшего по вектору чанка (меньше — ближе) и лексическое
+    покрытие — доля значимых слов запроса (без служебных, по основе), встречающихся в найденных чанках.
+
+    Returns:
+        {"distance": float | None (чанков нет), "coverage": 0..1, "terms": число значимых слов}
+    """
+    terms = [t for t in _extract_query_terms(query) if t not in STOP_WORDS]
+    text = " ".join(c["content"] for c in chunks).lower()
+    covered = sum(1 for t in terms if stem(t) in text)
+    return {
+        "distance": min((c["score"] for c in chunks), default=None),
+        "coverage": covered / len(terms) if terms else 0.0,
+        "terms": len(terms),
+    }
+
+
+def is_hopeless(confidence: Dict[str, Any], max_distance: float = None, min_coverage: float = None) -> bool:
+    """Ответа в материалах заведомо нет: чанков нет или одновременно distance выше max_distance и покрытие
+    ниже min_coverage (пороги RETRIEVAL_GATE_*, подбор — evaluate_blocks.py, раздел «Порог уверенности поиска»).
+    max_distance <= 0 — проверка по порогам выключена."""
+    max_distance = config.RETRIEVAL_GATE_MAX_DISTANCE if max_distance is None else max_distance
+    min_coverage = config.RETRIEVAL_GATE_MIN_COVERAGE if min_coverage is None else min_coverage
+    if confidence["distance"] is None:
+        return True
+    if max_distance <= 0:
+        return False
+    return confidence["distance"] > max_distance and confidence["coverage"] < min_coverage
+
+
+def retrieval_is_confident(chunks: List[Dict[str, Any]]) -> bool:
+    """Уверенный поиск (для режима combined): у top-1 есть совпадения терминов запроса и,
+    если задан COMBINED_MAX_DISTANCE, distance не выше порога."""
+    if not chunks:
+        return False
+    top = chunks[0]
+    if not top.get("keyword_hits"):
+        return False
+    return config.COMBINED_MAX_DISTANCE <= 0 or top["score"] <= config.COMBINED_MAX_DISTANCE
+
+
 def get_context_from_chunks(chunks: List[Dict[str, Any]]) -> str:
     """Формирует контекст из чанков для промпта"""
     context_parts = []
@@ -204,3 +748,35 @@ def get_context_from_chunks(chunks: List[Dict[str, Any]]) -> str:
     
     return "\n".join(context_parts)
 
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_refs(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ссылки на фрагменты контекста для логов вместо их текста: источник, раздел (parent_id) и хэш текста."""
+    refs = []
+    for chunk in chunks or []:
+        metadata = chunk.get("metadata", {})
+        ref = {"source": metadata.get("source"), "hash": _content_hash(chunk["content"])}
+        if metadata.get("parent_id"):
+            ref["parent_id"] = metadata["parent_id"]
+        refs.append(ref)
+    return refs
+
+
+def context_from_refs(refs: List[Dict[str, Any]], course_id: str = None) -> Optional[str]:
+    """Контекст по ссылкам chunk_refs из разделов текущего индекса курса (без модели эмбеддингов).
+    None — фрагмент не восстановить: нет parent_id (CHUNKER=recursive) или раздел с тех пор изменился."""
+    if not refs:
+        return ""
+    index = get_index(course_id)
+    parents = index.parents or index._load_parents(index.read_manifest().get("collection", COLLECTION_NAME))
+    chunks = []
+    for ref in refs:
+        parent = parents.get(ref.get("parent_id") or "")
+        if parent is None or _content_hash(parent["text"]) != ref.get("hash"):
+            return None
+        chunks.append({"content": parent["text"], "metadata": {"source": ref.get("source")}})
+    return get_context_from_chunks(chunks)
+
@@ -1,58 +1,165 @@
 """Блок 3: Генерация ответа (LLM)"""
+import logging
+import re
+from typing import Dict, Any, List, Optional
 import config
-from gigachat_client import get_client
+from block1_normalization import classify_by_keywords
+from block2_rag import get_context_from_chunks, retrieval_is_confident
+from extractive import extract_answer, is_confident
+from gigachat_client import GigaChatUnavailable, get_client
+from prompts import COMBINED, GENERATE
+from structured_output import CombinedOutput, complete_structured
 
-SYSTEM_PROMPT = f"""Ты - AI-куратор курса {config.COURSE_NAME}. Твоя задача - отвечать на вопросы студентов строго на основе предоставленного контекста из материалов курса.
+logger = logging.getLogger(__name__)
 
-ВАЖНЫЕ ПРАВИЛА:
-1. Отвечай ТОЛЬКО на основе предоставленного контекста. НИКОГДА не выдумывай информацию.
-2. Если в контексте нет ответа на вопрос - выведи: "В предоставленных материалах курса нет информации по этому вопросу." и сразу закрой чат
-3. Указывай модуль/источник информации, если он указан в контексте.
-4. Будь дружелюбным и понятным.
-5. Если вопрос неясен - уточни, что именно интересует студента.
+# Признаки ответа-отказа («в материалах нет информации»): по ним Judge получает полный контекст,
+# чтобы проверить, что ответа в материалах действительно нет
+REFUSAL_PHRASES = ("нет информации", "не найдено информации", "не нашёл", "не нашла", "нет данных", "нет сведений")
 
-Формат ответа:
-- Начни с прямого ответа на вопрос
-- Укажи модуль/источник, если известен
-- Будь конкретным и структурированным
 
-НИКОГДА не выдумывай факты, которые не упомянуты в контексте!
-"""
+def is_refusal_answer(answer: str) -> bool:
+    """Ответ — отказ по отсутствию информации в материалах курса."""
+    lower = (answer or "").lower()
+    return any(phrase in lower for phrase in REFUSAL_PHRASES)
 
 
-async def generate_answer(question: str, context: str) -> str:
+async def generate_answer(question: str, context: str, course: Optional[Dict[str, Any]] = None) -> str:
     """
     Генерирует ответ на основе вопроса и контекста из RAG.
     
     Args:
         question: Нормализованный вопрос студента
         context: Контекст из релевантных чанков
+        course: Курс из courses.py (название и темы в промпте); None — COURSE_NAME из config
         
     Returns:
         Ответ для студента
+
+    Raises:
+        GigaChatUnavailable: GigaChat не ответил — вызывающий отвечает без LLM (extractive_answer)
     """
     if not context.strip():
         return "Извините, в базе знаний не найдено информации по вашему вопросу. Попробуйте переформулировать вопрос или обратитесь к куратору."
     
-    user_message = f"""Контекст из материалов курса:
-
-{context}
-
-Вопрос студента: {question}
-
-Ответь на вопрос, используя ТОЛЬКО информацию из контекста выше."""
-    
     try:
         client = await get_client()
         
         answer = await client.chat_completion(
-            system_prompt=SYSTEM_PROMPT,
-            user_message=user_message,
+            system_prompt=GENERATE.system(course),
+            user_message=GENERATE.user(context=context, question=question),
             max_tokens=config.MAX_TOKENS,
-            temperature=config.TEMPERATURE_GENERATION
+            temperature=config.TEMPERATURE_GENERATION,
+            prompt_version=GENERATE.version,
         )
         
         return answer.strip()
         
+    except GigaChatUnavailable:
+        raise
     except Exception as e:
         return f"Произошла ошибка при генерации ответа: {str(e)}"
+
+
+# --- Деградированный режим: GigaChat недоступен, ответ собирается из найденных фрагментов ---
+
+DEGRADED_NOTICE = (
+    "⚠️ Сервис генерации ответов сейчас недоступен, поэтому привожу фрагменты материалов курса, "
+    "подходящие к вашему вопросу. Если они не помогли — повторите вопрос позже или обратитесь к куратору."
+)
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _clip(text: str, max_chars: int) -> str:
+    """Обрезка по границе предложения (если предложение одно и длинное — по слову)."""
+    if len(text) <= max_chars:
+        return text
+    clipped = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        if len(clipped) + len(sentence) + 1 > max_chars:
+            break
+        clipped = f"{clipped} {sentence}" if clipped else sentence
+    return clipped or text[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+def extractive_answer(chunks: List[Dict[str, Any]], question: Optional[str] = None) -> str:
+    """Ответ без LLM под пометкой о деградации: уверенно подобранные предложения (extractive.py), если задан
+    вопрос, иначе начало DEGRADED_ANSWER_CHUNKS лучших фрагментов с источником."""
+    if question:
+        try:
+            extract = extract_answer(question, chunks)
+        except Exception as e:
+            logger.warning("Извлекающий ответ не построен: %s", e)
+            extract = None
+        if is_confident(extract):
+            return DEGRADED_NOTICE + "\n\n" + extract["answer"]
+    parts = []
+    for chunk in chunks[: config.DEGRADED_ANSWER_CHUNKS]:
+        text = " ".join(line.lstrip("# ").strip() for line in chunk["content"].splitlines() if line.strip())
+        if not text:
+            continue
+        source = chunk.get("metadata", {}).get("source", "материалы курса")
+        parts.append(f"📄 {source}:\n{_clip(text, config.DEGRADED_ANSWER_MAX_CHARS)}")
+    if not parts:
+        return "Извините, в базе знаний не найдено информации по вашему вопросу. Попробуйте переформулировать вопрос или обратитесь к куратору."
+    return DEGRADED_NOTICE + "\n\n" + "\n\n".join(parts)
+
+
+# --- Режим «одним вызовом» (PIPELINE_MODE=combined): классификация, нормализация и ответ в одном запросе ---
+
+async def normalize_and_answer(
+    user_query: str, context: str, course: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Один вызов вместо двух (Блок 1 + Блок 3): контекст найден по исходному тексту студента.
+
+    Returns:
+        {"type", "normalized_query", "answer", "original_query", "prompt_version"} или None, если ответ не разобран —
+        тогда вызывающий идёт обычным путём (normalize_query → поиск → generate_answer).
+        GigaChatUnavailable пробрасывается: обычный путь тоже упрётся в недоступный GigaChat.
+    """
+    try:
+        client = await get_client()
+        result = await complete_structured(
+            client,
+            CombinedOutput,
+            COMBINED.name,
+            system_prompt=COMBINED.system(course),
+            user_message=COMBINED.user(context=context, query=user_query),
+            max_tokens=config.MAX_TOKENS + 100,  # ответ + тип и поисковый запрос
+            temperature=config.TEMPERATURE_GENERATION,
+            prompt_version=COMBINED.version,
+        )
+    except GigaChatUnavailable:
+        raise  # откат к двум вызовам бессмыслен — вызывающий отвечает без LLM
+    except Exception:
+        return None
+    answer = result.answer.strip()
+    if result.type == "question" and not answer:
+        return None
+    return {
+        "type": result.type,
+        "normalized_query": result.normalized_query.strip() or user_query,
+        "answer": answer,
+        "original_query": user_query,
+        "prompt_version": COMBINED.version,
+    }
+
+
+async def combined_answer(
+    user_query: str, chunks: List[Dict[str, Any]], course: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Ответ одним вызовом по чанкам, найденным по исходному тексту (режим PIPELINE_MODE=combined).
+
+    Returns:
+        результат normalize_and_answer + "context" или None — откат к обычному пути: явные маркеры abuse/cheat,
+        неуверенный поиск, неразобранный ответ или тип не question (шаблон выберет обычная нормализация).
+    """
+    if classify_by_keywords(user_query) is not None or not retrieval_is_confident(chunks):
+        return None
+    context = get_context_from_chunks(chunks)
+    result = await normalize_and_answer(user_query, context, course=course)
+    if result is None or result["type"] != "question":
+        return None
+    return {**result, "context": context}
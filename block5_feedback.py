@@ -1,6 +1,7 @@
 """Блок 5: Обратная связь + эскалация (тул по ТЗ v15).
 Кнопки только для type=question. На каждый ответ с кнопками создаётся запись с request_id;
 при нажатии «Полезно»/«Не помогло» запись в логе обновляется по request_id."""
+import hashlib
 import json
 import logging
 import os
@@ -62,9 +63,14 @@ def create_feedback_entry(
     answer: str,
     query_type: str,
     judge_verdict: Optional[Dict] = None,
+    prompt_version: Optional[str] = None,
+    course_id: Optional[str] = None,
+    sources: Optional[Dict[str, str]] = None,
 ) -> None:
     """Создаёт запись в логе обратной связи при отправке ответа с кнопками (rating=null).
-    Позже при нажатии кнопки запись обновляется через update_feedback_rating."""
+    Позже при нажатии кнопки запись обновляется через update_feedback_rating.
+    prompt_version — версия промпта ответа (prompts.py): оценки студентов сравниваются по версиям.
+    course_id и sources (файлы материалов ответа → хэш из манифеста индекса) — для сборки FAQ (faq.py)."""
     safe_verdict = _safe_judge_verdict(judge_verdict)
     log_entry = {
         "request_id": request_id,
@@ -73,6 +79,9 @@ def create_feedback_entry(
         "question": str(question)[:2000],
         "answer": str(answer)[:5000],
         "query_type": query_type,
+        "prompt_version": prompt_version,
+        "course": course_id,
+        "sources": sources or {},
         "judge_verdict": safe_verdict,
         "rating": None,
     }
@@ -173,15 +182,34 @@ def read_feedback_log(last_n: int = 10) -> list:
 
 
 def log_judge_only(
-    user_id: int, question: str, answer: str, judge_verdict: Dict, request_id: Optional[str] = None
+    user_id: int,
+    question: str,
+    answer: str,
+    judge_verdict: Dict,
+    request_id: Optional[str] = None,
+    context: Optional[str] = None,
+    query_type: Optional[str] = None,
+    prompt_version: Optional[str] = None,
+    chunks: Optional[list] = None,
+    course_id: Optional[str] = None,
 ):
-    """Логирует оценку Judge. request_id — для связи с записью в feedback_log при нажатии кнопки."""
+    """Логирует оценку Judge. request_id — для связи с записью в feedback_log при нажатии кнопки.
+    Текст контекста RAG в лог не пишется (он растил лог на размер контекста на каждый ответ): только
+    ссылки на фрагменты chunks (block2_rag.chunk_refs: источник, раздел, хэш текста), хэш контекста и курс —
+    по ним judge_batch.py восстанавливает контекст из индекса для переоценки.
+    prompt_version — версия промпта оцениваемого ответа (answer_prompt_version; версия промпта самого
+    Judge — в judge_verdict.prompt_version)."""
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "request_id": request_id,
         "user_id": user_id,
         "question": question,
+        "query_type": query_type,
+        "course": course_id,
+        "chunks": chunks or [],
+        "context_hash": hashlib.sha1(context.encode("utf-8")).hexdigest()[:16] if context else None,
         "answer": answer,
+        "answer_prompt_version": prompt_version,
         "judge_verdict": judge_verdict,
         "user_feedback": None,
     }
@@ -1,6 +1,7 @@
 """Главный файл Telegram бота - интеграция всех блоков"""
 import asyncio
 import logging
+import threading
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -11,10 +12,16 @@ from telegram.ext import (
     filters
 )
 import config
-from block1_normalization import normalize_query, get_response_template
-from block2_rag import search_relevant_chunks, get_context_from_chunks, load_knowledge_base
-from block3_generation import generate_answer
-from block4_judge import judge_answer
+from block1_normalization import normalize_query, get_response_template, local_normalization, classify_by_keywords
+from block2_rag import (
+    search_relevant_chunks, get_context_from_chunks, get_index, memory_report, INDEX_LOADING, INDEX_READY, INDEX_EMPTY,
+    INDEX_FAILED, watch_knowledge_base, retrieval_confidence, is_hopeless, chunk_refs,
+)
+from block3_generation import generate_answer, combined_answer, extractive_answer
+from prompts import GENERATE
+from extractive import EXTRACTIVE_VERSION, definition_term, extract_answer, is_confident
+from faq import answer_sources, faq_lookup, watch_feedback
+from block4_judge import judge_answer, judge_sampling_decision
 from block5_feedback import (
     log_feedback,
     log_escalation,
@@ -25,7 +32,10 @@ from block5_feedback import (
     update_feedback_rating,
     generate_request_id,
 )
-from gigachat_client import close_client
+from gigachat_client import GigaChatUnavailable, close_client, llm_available
+from courses import course_for_chat, select_course, list_courses
+from state_store import get_state_store
+from admission import AdmissionController, RateLimiter, RequestCoalescer
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,11 +44,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальное хранилище для контекста диалога
-user_contexts = {}
+# Контекст последнего ответа пользователя (для фидбэка и эскалации) — в хранилище состояния
+# (state_store.py: LRU в памяти, SQLite или Redis; с TTL и ограничением числа записей)
+def _context_key(user_id) -> str:
+    return f"user:{user_id}"
+
+# Ссылки на фоновые задачи (Judge по «Не помогло»), чтобы их не собрал сборщик мусора
+_background_tasks = set()
+
+# Защита от перегрузки (admission.py): частота вопросов пользователя, повторы, общий допуск в конвейер
+_rate_limiter = RateLimiter()
+_coalescer = RequestCoalescer()
+_admission = AdmissionController()
 
 
 NON_TEXT_REPLY = "Пожалуйста, напишите текстом. Я могу отвечать только на текстовые сообщения."
+WARMUP_REPLY = "⏳ Я только что запустился и загружаю материалы курса. Повторите вопрос через минуту, пожалуйста."
+NO_RESULTS_REPLY = "Извините, в базе знаний не найдено информации по вашему вопросу. Попробуйте переформулировать вопрос или обратитесь к куратору."
+INDEX_ERROR_REPLY = "⚠️ Материалы курса сейчас недоступны из-за технической ошибки. Попробуйте позже или обратитесь к куратору."
+RATE_LIMIT_REPLY = "⏳ Слишком много сообщений подряд. Подождите {seconds} с и задайте вопрос снова."
+ANSWERED_ABOVE_REPLY = "☝️ На этот вопрос я только что ответил — ответ выше. Если он не помог, переформулируйте вопрос или нажмите «❌ Не помогло»."
+OVERLOAD_REPLY = "⏳ Сейчас очень много вопросов, я не успеваю ответить. Повторите, пожалуйста, через пару минут."
+EXTRACTIVE_PREVIEW_SUFFIX = "⏳ Это выдержка из материалов курса — готовлю полный ответ…"
+
+
+async def _judge_sampled(
+    user_id: int,
+    question: str,
+    context_text: str,
+    answer: str,
+    query_type: str,
+    chunks=None,
+    request_id=None,
+    negative_feedback: bool = False,
+    prompt_version=None,
+    course_name=None,
+    refs=None,
+    course_id=None,
+):
+    """Блок 4 по политике выборки: оценивает и логирует, если ответ попал в выборку. Иначе возвращает None.
+    prompt_version — версия промпта, которым получен ответ (prompts.py), пишется в judge_log;
+    course_name — название курса шаблонного ответа (быстрая проверка шаблона в Judge);
+    refs — ссылки на фрагменты контекста (chunk_refs) для judge_log, если chunks уже нет (оценка по «Не помогло»)."""
+    decision = judge_sampling_decision(query_type, chunks=chunks, negative_feedback=negative_feedback)
+    if not decision["judge"]:
+        if decision["reason"] in ("throttled", "budget"):
+            # Не случайный пропуск: в judge_log недопредставлены часы перегрузки
+            logger.warning("Judge отброшен для user %s: %s", user_id, decision["reason"])
+        else:
+            logger.info("Judge пропущен для user %s: %s", user_id, decision["reason"])
+        return None
+    judge_result = await judge_answer(question, context_text, answer, query_type=query_type, course_name=course_name)
+    judge_result["sample_weight"] = decision["weight"]
+    judge_result["sample_reason"] = decision["reason"]
+    log_judge_only(
+        user_id, question, answer, judge_result,
+        request_id=request_id, context=context_text, query_type=query_type, prompt_version=prompt_version,
+        chunks=refs if refs is not None else chunk_refs(chunks), course_id=course_id,
+    )
+    return judge_result
+
+
+async def _late_judge(user_id: int, request_id: str, context_data: dict):
+    """Judge по «Не помогло» для ответа вне выборки; результат — в контекст пользователя
+    (если пользователь тем временем не задал новый вопрос — сверяем request_id)."""
+    fields = {"judge_pending": False}
+    try:
+        fields["judge_verdict"] = await _judge_sampled(
+            user_id,
+            context_data.get("question", ""),
+            context_data.get("context", ""),
+            context_data.get("answer", ""),
+            "question",
+            request_id=request_id,
+            negative_feedback=True,
+            prompt_version=context_data.get("prompt_version"),
+            refs=context_data.get("chunks", []),
+            course_id=context_data.get("course"),
+        )
+    except Exception as e:
+        logger.error("Ошибка фоновой оценки Judge для user %s: %s", user_id, e, exc_info=True)
+    finally:
+        get_state_store().update(_context_key(user_id), fields, expect={"request_id": request_id})
 
 
 async def handle_non_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -50,17 +137,29 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.effective_user.id
     
+    # Deep-link https://t.me/<бот>?start=<id курса> приходит как /start <id курса>
+    if context.args:
+        course = select_course(update.effective_chat.id, context.args[0])
+        if course is not None:
+            get_index(course["id"]).ensure_warming()
+            await update.message.reply_text(
+                f"Привет! Я AI-куратор курса {course['name']}.\n\n"
+                "Задайте мне вопрос по материалам курса, и я постараюсь помочь!"
+            )
+            return
+
     # Если это куратор - сохраняем его chat_id
     if config.CURATOR_CHAT_ID and str(user_id) == str(config.CURATOR_CHAT_ID):
         await update.message.reply_text(
             "Вы зарегистрированы как куратор. Вы будете получать уведомления об эскалациях.\n\n"
             "Чтобы ответить студенту через бота, используйте:\n"
             "/reply <user_id> <текст ответа>\n"
-            "Пример: /reply 987654321 Посмотрите главу 3, раздел 2 — там ответ на ваш вопрос."
+            "Пример: /reply 987654321 Посмотрите главу 3, раздел 2 — там ответ на ваш вопрос.\n\n"
+            "После добавления материалов в knowledge_base/: /reindex (или /reindex full — пересобрать всё)."
         )
     else:
         await update.message.reply_text(
-            f"Привет! Я AI-куратор курса {config.COURSE_NAME}.\n\n"
+            f"Привет! Я AI-куратор курса {course_for_chat(update.effective_chat.id)['name']}.\n\n"
             "Задайте мне вопрос по материалам курса, и я постараюсь помочь!"
         )
 
@@ -76,6 +175,56 @@ async def my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode="Markdown")
 
 
+async def reindex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для куратора: /reindex [id курса] [full] — доиндексировать новые и изменённые файлы курса
+    без перезапуска (full — пересобрать индекс целиком). Без id — курс этого чата.
+    Бот продолжает отвечать по старому индексу, пока строится новый."""
+    user_id = update.effective_user.id
+    if not config.CURATOR_CHAT_ID or str(user_id) != str(config.CURATOR_CHAT_ID):
+        await update.message.reply_text("Команда доступна только куратору.")
+        return
+    args = [a.lower() for a in (context.args or [])]
+    full = "full" in args
+    course_ids = {c["id"].lower(): c["id"] for c in list_courses()}
+    named = [course_ids[a] for a in args if a in course_ids]
+    course_id = named[0] if named else course_for_chat(update.effective_chat.id)["id"]
+    await update.message.reply_text(f"⏳ Переиндексация курса {course_id} запущена" + (" (полная)" if full else "") + "...")
+    try:
+        result = await asyncio.to_thread(get_index(course_id).reindex, full)
+    except Exception as e:
+        logger.error("Ошибка переиндексации: %s", e, exc_info=True)
+        await update.message.reply_text(f"❌ Ошибка переиндексации: {e}")
+        return
+    if result.get("skipped"):
+        text = "✅ Изменений в материалах нет, индекс актуален."
+    elif not result["chunks"]:
+        text = "⚠️ Документов не найдено — бот продолжает работать по прежнему индексу."
+    else:
+        text = (
+            f"✅ Индекс обновлён за {result['seconds']:.0f} с: изменено файлов {result['changed']}, "
+            f"удалено {result['removed']}; новых чанков {result['new_chunks']}, всего {result['chunks']}."
+        )
+    await update.message.reply_text(text)
+
+
+async def courses_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для куратора: /courses — курсы, состояние их индексов и прирост памяти на каждый загруженный."""
+    user_id = update.effective_user.id
+    if not config.CURATOR_CHAT_ID or str(user_id) != str(config.CURATOR_CHAT_ID):
+        await update.message.reply_text("Команда доступна только куратору.")
+        return
+    loaded = {r["course"]: r for r in memory_report()}
+    lines = []
+    for course in list_courses():
+        r = loaded.get(course["id"])
+        if r is None:
+            lines.append(f"• {course['id']} — {course['name']}: не загружен")
+        else:
+            memory = f", +{r['memory_mb']:.0f} МБ" if r["memory_mb"] is not None else ""
+            lines.append(f"• {course['id']} — {course['name']}: {r['state']}{memory}")
+    await update.message.reply_text("Курсы:\n" + "\n".join(lines))
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений - главная цепочка"""
     user_id = update.effective_user.id
@@ -89,81 +238,232 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     logger.info("User %s исходный текст (до нормализации): %s", user_id, original_question)
+    course = course_for_chat(update.effective_chat.id)
+
+    # Тот же текст, пока первый запрос в работе, — ждём его ответа; только что ответили — ссылаемся на ответ выше
+    dedupe_key = (user_id, course["id"], " ".join(original_question.lower().split()))
+    duplicate = _coalescer.attach(dedupe_key)
+    if duplicate is not None:
+        if duplicate.done():
+            logger.info("User %s: повтор вопроса, на который уже ответили", user_id)
+            await update.message.reply_text(ANSWERED_ABOVE_REPLY)
+            return
+        logger.info("User %s: повтор того же вопроса, ждём первый запрос", user_id)
+        await duplicate
+        return
 
-    # Показываем, что бот думает
-    thinking_msg = await update.message.reply_text("🤔 Думаю...")
-    
+    allowed, retry_after, first_rejection = _rate_limiter.acquire(user_id)
+    if not allowed:
+        logger.warning("User %s: превышена частота вопросов", user_id)
+        if first_rejection:  # на остальные сообщения серии не отвечаем — не множим спам
+            await update.message.reply_text(RATE_LIMIT_REPLY.format(seconds=max(int(retry_after + 0.999), 1)))
+        return
+
+    _coalescer.begin(dedupe_key)
     try:
-        # БЛОК 1: Нормализация запроса
-        normalization_result = await normalize_query(original_question)
-        query_type = normalization_result["type"]
-        normalized_query = normalization_result["normalized_query"]
+        # Показываем, что бот думает
+        thinking_msg = await update.message.reply_text("🤔 Думаю...")
+        if not await _admission.acquire():
+            logger.warning("User %s: вопрос отклонён из-за перегрузки (%s)", user_id, _admission.stats())
+            await thinking_msg.edit_text(OVERLOAD_REPLY)
+            return
+        try:
+            await _answer_question(update, thinking_msg, user_id, original_question, course)
+        finally:
+            _admission.release()
+    finally:
+        _coalescer.finish(dedupe_key)
+
 
-        logger.info(f"User {user_id}: type={query_type}, normalized={normalized_query}")
+def _extract_answer(question: str, chunks: list):
+    """extractive.extract_answer без падения конвейера: ошибка модели эмбеддингов — просто без выдержки."""
+    try:
+        return extract_answer(question, chunks)
+    except Exception as e:
+        logger.warning("Извлекающий ответ не построен: %s", e)
+        return None
+
+
+def _faq_answer(question: str, course_id: str):
+    """faq.faq_lookup без падения конвейера: ошибка чтения FAQ или модели эмбеддингов — обычный путь."""
+    try:
+        return faq_lookup(question, course_id)
+    except Exception as e:
+        logger.warning("Поиск в FAQ не удался: %s", e)
+        return None
 
+
+def _log_normalization(user_id: int, original_question: str, normalized_query: str, query_type: str, prompt_version: str):
+    """Дублирование результата Блока 1 в Google Таблицу и Excel (если настроены)."""
+    try:
+        from logs_to_sheets import duplicate_normalization_to_sheets
+        from datetime import datetime
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "user_id": user_id,
+            "original_text": original_question,
+            "normalized_query": normalized_query,
+            "type": query_type,
+            "prompt_version": prompt_version,
+        }
+        duplicate_normalization_to_sheets(entry)
         try:
-            from logs_to_sheets import duplicate_normalization_to_sheets
-            from datetime import datetime
-            entry = {
-                "timestamp": datetime.now().isoformat(),
-                "user_id": user_id,
-                "original_text": original_question,
-                "normalized_query": normalized_query,
-                "type": query_type,
-            }
-            duplicate_normalization_to_sheets(entry)
-            try:
-                from logs_to_excel import duplicate_normalization_to_excel
-                duplicate_normalization_to_excel(entry)
-            except Exception:
-                pass
+            from logs_to_excel import duplicate_normalization_to_excel
+            duplicate_normalization_to_excel(entry)
         except Exception:
             pass
-        
-        # abuse / off_topic / cheat — шаблонный ответ, Блок 4 (Judge) проверяет корректность типа, Блок 5 не показываем.
-        if query_type != "question":
-            template_response = get_response_template(query_type)
-            judge_result = await judge_answer(
-                original_question,
-                context="",
-                answer=template_response,
-                query_type=query_type,
-            )
-            logger.info(f"Judge (шаблон) user {user_id}: question_type_correct={judge_result.get('question_type_correct')}")
-            log_judge_only(user_id, original_question, template_response, judge_result, request_id=None)
-            await thinking_msg.edit_text(template_response)
-            return
+    except Exception:
+        pass
 
-        # БЛОК 2: RAG - поиск релевантных чанков
-        chunks = search_relevant_chunks(normalized_query)
-        
-        if not chunks:
-            response = "Извините, в базе знаний не найдено информации по вашему вопросу. Попробуйте переформулировать вопрос или обратитесь к куратору."
-            judge_result = await judge_answer(original_question, "", response, query_type="question")
-            log_judge_only(user_id, original_question, response, judge_result, request_id=None)
-            await thinking_msg.edit_text(response)
-            return
-        
-        context_text = get_context_from_chunks(chunks)
-        
-        # БЛОК 3: Генерация ответа
-        answer = await generate_answer(normalized_query, context_text)
-        
-        # БЛОК 4: Judge для вопроса по курсу (полная оценка)
-        judge_result = await judge_answer(original_question, context_text, answer, query_type=query_type)
-        logger.info(f"Judge verdict for user {user_id}: {judge_result.get('overall_score', 'N/A')}")
+
+async def _answer_question(update: Update, thinking_msg, user_id: int, original_question: str, course: dict):
+    """Конвейер ответа: Блок 1 → Блок 2 → Блок 3 → Блок 4, кнопки Блока 5
+    (в режиме combined — поиск → один вызов вместо Блоков 1 и 3, с откатом к обычному пути).
+    GigaChat недоступен (выключатель разомкнут или вызов не удался) — деградированный режим без ожидания LLM:
+    тип по локальным маркерам, ответ фрагментами материалов (extractive_answer), без Judge.
+    Вопрос, близкий к частому вопросу из FAQ (faq.py), получает готовый ответ до всего конвейера, без Judge."""
+    try:
+        # Индексы курсов грузятся лениво: первый вопрос по курсу запускает прогрев
+        index = get_index(course["id"])
+        index.ensure_warming()
+        degraded = not llm_available()
+        chunks = []
+
+        # FAQ: готовый ответ, отмеченный студентами «Полезно», пока материалы, на которые он опирается, не менялись
+        faq = None
+        if config.FAQ_ENABLED and index.state == INDEX_READY and not classify_by_keywords(original_question):
+            faq = _faq_answer(original_question, course["id"])
+
+        # Режим combined: поиск по исходному тексту и один вызов LLM; None — обычный путь
+        combined = None
+        if faq is None and config.PIPELINE_MODE == "combined" and index.state == INDEX_READY and not degraded:
+            chunks = search_relevant_chunks(original_question, course_id=course["id"])
+            try:
+                combined = await combined_answer(original_question, chunks, course=course)
+            except GigaChatUnavailable:
+                degraded = True
+        if faq is not None:
+            query_type, normalized_query = "question", original_question
+            answer, prompt_version, context_text = faq["answer"], faq["prompt_version"], ""
+            logger.info(
+                "User %s: ответ из FAQ (%s, близость %.2f к «%s»)",
+                user_id, prompt_version, faq["similarity"], faq["question"],
+            )
+        elif combined is not None:
+            query_type, normalized_query = "question", combined["normalized_query"]
+            context_text, answer = combined["context"], combined["answer"]
+            prompt_version = combined["prompt_version"]
+            logger.info(f"User {user_id}: type={query_type}, normalized={normalized_query} (один вызов, промпт {prompt_version})")
+            _log_normalization(user_id, original_question, normalized_query, query_type, prompt_version)
+        else:
+            # БЛОК 1: Нормализация запроса (без LLM, если GigaChat уже недоступен)
+            if degraded:
+                normalization_result = local_normalization(original_question, "unavailable")
+            else:
+                normalization_result = await normalize_query(original_question, course=course)
+                degraded = normalization_result.get("fallback") == "unavailable"
+            query_type = normalization_result["type"]
+            normalized_query = normalization_result["normalized_query"]
+            prompt_version = normalization_result.get("prompt_version")
+
+            logger.info(f"User {user_id}: type={query_type}, normalized={normalized_query} (промпт {prompt_version})")
+            _log_normalization(user_id, original_question, normalized_query, query_type, prompt_version)
+
+            # abuse / off_topic / cheat — шаблонный ответ, Блок 4 (Judge) проверяет корректность типа, Блок 5 не показываем.
+            if query_type != "question":
+                template_response = get_response_template(query_type, course_name=course["name"])
+                await thinking_msg.edit_text(template_response)
+                if degraded:
+                    return
+                judge_result = await _judge_sampled(
+                    user_id, original_question, "", template_response, query_type,
+                    prompt_version=prompt_version, course_name=course["name"], course_id=course["id"],
+                )
+                if judge_result:
+                    logger.info(f"Judge (шаблон) user {user_id}: question_type_correct={judge_result.get('question_type_correct')}")
+                return
+
+            # Индекс ещё прогревается — не держим студента на «Думаю...», пока грузится модель;
+            # загрузка не удалась после всех повторов — сразу говорим об ошибке.
+            state = index.state
+            if state == INDEX_LOADING:
+                await thinking_msg.edit_text(WARMUP_REPLY)
+                return
+            if state == INDEX_FAILED:
+                await thinking_msg.edit_text(INDEX_ERROR_REPLY)
+                return
+
+            # БЛОК 2: RAG - поиск релевантных чанков (пустая база — сразу ответ «не найдено»)
+            chunks = [] if state == INDEX_EMPTY else search_relevant_chunks(normalized_query, course_id=course["id"])
+
+            # Ничего не нашли или поиск заведомо мимо (далеко по вектору и почти без слов запроса) —
+            # стандартный отказ без генерации; Judge получает найденное, чтобы проверить отсечение
+            if not chunks or is_hopeless(retrieval_confidence(normalized_query, chunks)):
+                response = NO_RESULTS_REPLY
+                await thinking_msg.edit_text(response)
+                if chunks:
+                    logger.info("User %s: поиск неуверенный, генерация пропущена", user_id)
+                if degraded:
+                    return
+                await _judge_sampled(
+                    user_id, original_question, get_context_from_chunks(chunks), response, "question", chunks=chunks,
+                    prompt_version=prompt_version, course_id=course["id"],
+                )
+                return
+
+            context_text = get_context_from_chunks(chunks)
+
+            # Вопрос «что такое X»: лучшие предложения материалов без LLM (extractive.py) — уверенные при
+            # EXTRACTIVE_MODE=answer заменяют генерацию, иначе показываются первым сообщением, пока она идёт
+            extract = None
+            if config.EXTRACTIVE_MODE != "off" and not degraded and (
+                definition_term(normalized_query) or definition_term(original_question)
+            ):
+                extract = _extract_answer(normalized_query, chunks)
+            if extract is not None and config.EXTRACTIVE_MODE == "answer" and is_confident(extract):
+                answer, prompt_version = extract["answer"], EXTRACTIVE_VERSION
+                logger.info("User %s: извлекающий ответ без LLM (близость %.2f)", user_id, extract["similarity"])
+            elif not degraded:
+                if extract is not None:
+                    await thinking_msg.edit_text(f"{extract['answer']}\n\n{EXTRACTIVE_PREVIEW_SUFFIX}")
+                # БЛОК 3: Генерация ответа; GigaChat недоступен — сразу фрагменты материалов вместо ожидания
+                try:
+                    answer = await generate_answer(normalized_query, context_text, course=course)
+                    prompt_version = GENERATE.version
+                except GigaChatUnavailable:
+                    degraded = True
+            if degraded:
+                answer = extractive_answer(chunks, normalized_query)
+                prompt_version = "degraded"
+                logger.warning("User %s: GigaChat недоступен — ответ фрагментами материалов, без Judge", user_id)
 
         request_id = generate_request_id()
         logger.info("User %s: request_id=%s (для фидбэка/поиска в feedback_log)", user_id, request_id)
-        user_contexts[user_id] = {
+
+        # БЛОК 4: Judge для вопроса по курсу (полная оценка, по политике выборки; без LLM — пропуск)
+        judge_result = None if degraded or faq is not None else await _judge_sampled(
+            user_id, original_question, context_text, answer, query_type,
+            chunks=chunks, request_id=request_id, prompt_version=prompt_version, course_id=course["id"],
+        )
+        if judge_result:
+            logger.info(f"Judge verdict for user {user_id}: {judge_result.get('overall_score', 'N/A')}")
+
+        get_state_store().set(_context_key(user_id), {
             "request_id": request_id,
             "question": original_question,
+            "context": context_text,
+            "chunks": chunk_refs(chunks),
             "answer": answer,
             "judge_verdict": judge_result,
+            "judge_pending": False,
             "username": getattr(update.effective_user, "username", None),
-        }
-        log_judge_only(user_id, original_question, answer, judge_result, request_id=request_id)
-        create_feedback_entry(request_id, user_id, original_question, answer, "question", judge_result)
+            "course": course["id"],
+            "prompt_version": prompt_version,
+        })
+        create_feedback_entry(
+            request_id, user_id, original_question, answer, "question", judge_result, prompt_version=prompt_version,
+            course_id=course["id"], sources=faq["sources"] if faq is not None else answer_sources(chunks, course["id"]),
+        )
 
         # БЛОК 5: кнопки только для type=question
         keyboard = [
@@ -191,7 +491,7 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await query.answer()
 
-    context_data = user_contexts.get(user_id, {})
+    context_data = get_state_store().get(_context_key(user_id)) or {}
     if not context_data:
         logger.warning("Нет контекста для user_id=%s (бот перезапускали или другой инстанс). Фидбэк всё равно запишем.", user_id)
 
@@ -225,6 +525,21 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         logger.info("Feedback: user %s нажал «Не помогло» request_id=%s", user_id, request_id)
 
+        # Отрицательный фидбэк на ответ, не попавший в выборку Judge, — оцениваем в фоне,
+        # кнопки куратора показываем сразу
+        if (
+            context_data
+            and context_data.get("judge_verdict") is None
+            and context_data.get("request_id") == request_id
+            # повторное нажатие (в том числе на другой реплике) не запускает второй Judge
+            and get_state_store().update(
+                _context_key(user_id), {"judge_pending": True}, expect={"request_id": request_id, "judge_pending": False}
+            )
+        ):
+            task = asyncio.create_task(_late_judge(user_id, request_id, context_data))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
         keyboard = [
             [
                 InlineKeyboardButton("🔔 Вызвать куратора", callback_data=f"escalate_{user_id}"),
@@ -248,7 +563,7 @@ async def handle_escalation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     
     if data.startswith("escalate_"):
-        context_data = user_contexts.get(user_id, {})
+        context_data = get_state_store().get(_context_key(user_id)) or {}
         
         # Логируем эскалацию
         escalation_log = log_escalation(
@@ -331,28 +646,61 @@ async def reply_to_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def main():
-    """Запуск бота"""
-    if not config.TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не установлен в .env файле!")
-        return
-    
-    # Загружаем базу знаний при старте
-    logger.info("Загрузка базы знаний...")
-    load_knowledge_base()
-    
-    # Создаем приложение
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+def start_background(watch: bool = True):
+    """Фоновые задачи процесса бота: прогрев индекса курса по умолчанию, наблюдатель за knowledge_base/
+    и пересборка FAQ по новым оценкам (FAQ_REBUILD_INTERVAL)."""
+    # База знаний грузится в фоне: бот сразу начинает принимать обновления
+    # (шаблонные ответы работают без RAG, на вопросы до готовности индекса — WARMUP_REPLY)
+    # (индексы остальных курсов — при первом вопросе по ним)
+    logger.info("Загрузка базы знаний в фоне...")
+    get_index().ensure_warming()
+    if watch and config.KB_WATCH_INTERVAL > 0:
+        # Новые и изменённые файлы в knowledge_base/ доиндексируются без перезапуска
+        threading.Thread(target=watch_knowledge_base, daemon=True).start()
+    if watch and config.FAQ_ENABLED and config.FAQ_REBUILD_INTERVAL > 0:
+        # FAQ дополняется новыми оценками из feedback_log.json без перезапуска
+        threading.Thread(target=watch_feedback, daemon=True).start()
+
+
+def build_application() -> Application:
+    """Приложение python-telegram-bot со всеми обработчиками (общее для polling и webhook-воркеров)."""
+    builder = Application.builder().token(config.TELEGRAM_BOT_TOKEN)
+    if config.TELEGRAM_API_BASE_URL:
+        # Локальная подмена Bot API (scripts/fake_telegram.py) вместо api.telegram.org
+        builder = builder.base_url(config.TELEGRAM_API_BASE_URL)
+    if config.POLLING_CONCURRENT_UPDATES > 1:
+        # Иначе PTB обрабатывает обновления строго по одному: допуск в конвейер и ожидание повторов простаивают
+        builder = builder.concurrent_updates(config.POLLING_CONCURRENT_UPDATES)
+    application = builder.build()
     
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("my_id", my_id))
     application.add_handler(CommandHandler("reply", reply_to_student))
+    application.add_handler(CommandHandler("reindex", reindex_command))
+    application.add_handler(CommandHandler("courses", courses_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     # Любое сообщение без текста (фото, стикер, голос, видео и т.д.) — просим писать текстом
     application.add_handler(MessageHandler(~filters.TEXT & ~filters.COMMAND, handle_non_text))
     application.add_handler(CallbackQueryHandler(handle_feedback, pattern="^feedback_"))
     application.add_handler(CallbackQueryHandler(handle_escalation, pattern="^(escalate_|close_)"))
+    return application
+
+
+def main():
+    """Запуск бота"""
+    if not config.TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не установлен в .env файле!")
+        return
+
+    if config.BOT_MODE == "webhook":
+        # HTTP-приём обновлений и BOT_WORKERS процессов-обработчиков (webhook_server.py)
+        from webhook_server import run_webhook
+        run_webhook()
+        return
+    
+    start_background()
+    application = build_application()
     
     # Запускаем бота
     logger.info("Бот запущен. Лог фидбэка: %s", get_feedback_log_path())
@@ -371,4 +719,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,194 @@
+"""Чанкинг с учётом структуры документа (для Блока 2, CHUNKER=structure).
+
+Вместо окна фиксированной длины с перекрытием текст страницы разбирается на единицы: заголовки
+(«# …» из DOCX/MD, «1.2 Название», «Модуль 3 …», строки капсом), пункты списков и абзацы. Длинные
+абзацы режутся по предложениям, список — между пунктами, так что таблица-список или фраза не рвутся
+посередине, а перекрытие не нужно.
+
+Два уровня:
+- раздел (родитель) — заголовок и его текст, не длиннее PARENT_CHUNK_SIZE; уходит в промпт;
+- дочерние чанки — куски раздела не длиннее CHILD_CHUNK_SIZE с заголовком раздела в начале; только они
+  эмбеддятся и ищутся. Найденные дочерние чанки заменяются своими разделами (по parent_id) без повторов.
+
+Граница страницы PDF — граница раздела; заголовок переходит на следующую страницу того же файла
+(кроме серии заголовков подряд — оглавления). Подряд идущие заголовки склеиваются не больше двух
+(«Модуль 2. Отчётность») и не длиннее MAX_HEADING_LEN, иначе остаётся последний; заголовок в начале
+дочернего чанка входит в CHILD_CHUNK_SIZE."""
+import hashlib
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import config
+
+SECTION_WORDS = r"(?:Глава|Модуль|Тема|Раздел|Лекция|Часть|Приложение|Занятие|Урок)"
+HEADING_RE = re.compile(
+    rf"^(?:#{{1,6}}\s+\S.*|{SECTION_WORDS}\s+[\dIVXА-ЯA-Z][\w.]*\b.*|\d+\.\d+(?:\.\d+)*\.?\s+\S.*|\d{1,2}\s+[А-ЯЁA-Z][^.!?\d]*)$"
+)
+LIST_RE = re.compile(r"^(?:[-•●▪◦–—*]|\d{1,2}[.)]|[a-zа-я][)])\s+")
+SENTENCE_RE = re.compile(r"(?<=[.!?…;])\s+(?=[«\"(\[]?[А-ЯЁA-Z0-9])")
+
+MAX_HEADING_LEN = 120
+# Версия алгоритма разбиения (в настройках индекса): при изменении индекс пересобирается целиком
+CHUNKER_VERSION = 2
+
+
+def is_heading(line: str) -> bool:
+    """Строка похожа на заголовок: разметка «#», нумерация раздела, «Модуль N …» или короткая строка капсом."""
+    if not line or len(line) > MAX_HEADING_LEN:
+        return False
+    if HEADING_RE.match(line):
+        return True
+    letters = [ch for ch in line if ch.isalpha()]
+    return len(letters) >= 3 and line.isupper() and len(line) <= 80
+
+
+def split_units(text: str) -> List[Tuple[str, str]]:
+    """Текст страницы → [(вид, текст)]: heading | item (пункт списка) | para (абзац).
+    Строки абзаца (PDF переносит строки посреди предложения) склеиваются, перенос слова с дефисом убирается."""
+    units: List[Tuple[str, str]] = []
+    kind, lines = None, []
+
+    def close():
+        nonlocal kind, lines
+        if lines:
+            joined = ""
+            for line in lines:
+                if joined.endswith("-") and line[:1].islower():
+                    joined = joined[:-1] + line
+                else:
+                    joined = f"{joined} {line}" if joined else line
+            units.append((kind, joined))
+        kind, lines = None, []
+
+    for raw in text.split("\n"):
+        line = raw.strip()
+        if not line:
+            close()
+        elif is_heading(line):
+            close()
+            units.append(("heading", line.lstrip("#").strip()))
+        elif LIST_RE.match(line):
+            close()
+            kind, lines = "item", [line]
+        else:
+            if kind is None:
+                kind = "para"
+            lines.append(line)
+    close()
+    return units
+
+
+def _split_long(text: str, max_len: int) -> List[str]:
+    """Кусок длиннее max_len → по предложениям, слишком длинное предложение — по словам."""
+    if len(text) <= max_len:
+        return [text]
+    pieces, current = [], ""
+    for sentence in SENTENCE_RE.split(text):
+        parts = [sentence]
+        if len(sentence) > max_len:
+            parts, words = [], ""
+            for word in sentence.split():
+                if words and len(words) + 1 + len(word) > max_len:
+                    parts.append(words)
+                    words = word
+                else:
+                    words = f"{words} {word}" if words else word
+            if words:
+                parts.append(words)
+        for part in parts:
+            if current and len(current) + 1 + len(part) > max_len:
+                pieces.append(current)
+                current = part
+            else:
+                current = f"{current} {part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _pack(pieces: List[str], max_len: int) -> List[List[str]]:
+    """Жадно собирает куски в группы не длиннее max_len (кусок не делится)."""
+    groups, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + 1 + len(piece) > max_len:
+            groups.append(current)
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        groups.append(current)
+    return groups
+
+
+class StructureChunker:
+    """Разбивает страницы одного прохода индексации на разделы и дочерние чанки.
+    Помнит последний заголовок каждого файла: раздел, продолжающийся на следующей странице, сохраняет заголовок."""
+
+    def __init__(self, child_size: int = None, parent_size: int = None):
+        self.child_size = child_size or config.CHILD_CHUNK_SIZE
+        self.parent_size = max(parent_size or config.PARENT_CHUNK_SIZE, self.child_size)
+        self._headings: Dict[str, str] = {}
+
+    def split(self, text: str, metadata: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """
+        Returns:
+            (дочерние чанки [{"text", "metadata"}], разделы {parent_id: {"text", "metadata"}});
+            metadata дочернего чанка — метаданные страницы + parent_id и heading.
+        """
+        source = str(metadata.get("source", ""))
+        heading = self._headings.get(source, "")
+        sections: List[Tuple[str, List[str]]] = []
+        body: List[str] = []
+        run = 0  # заголовков подряд перед текущей единицей
+        for kind, unit in split_units(text):
+            if kind == "heading":
+                if body:
+                    sections.append((heading, body))
+                    body = []
+                # Два заголовка подряд («Модуль 2» / «Отчётность») — один заголовок; дальше серия
+                # (оглавление) — только последний, чтобы заголовок не разрастался
+                joined = f"{heading}. {unit}"
+                heading = joined if run == 1 and len(joined) <= MAX_HEADING_LEN else unit
+                run += 1
+                continue
+            run = 0
+            body.append(unit)
+        if body:
+            sections.append((heading, body))
+        # Серия заголовков в конце страницы — оглавление, а не начало раздела на следующей странице
+        self._headings[source] = heading if run <= 2 else ""
+
+        children, parents = [], {}
+        page = metadata.get("page", "")
+        prefix = hashlib.sha1(source.encode("utf-8")).hexdigest()[:10]
+        n = 0
+        for section_heading, units in sections:
+            # Заголовок в начале дочернего чанка входит в его размер (длинный — обрезается до половины)
+            child_heading = section_heading
+            if len(child_heading) > self.child_size // 2:
+                child_heading = child_heading[: self.child_size // 2 - 1].rstrip() + "…"
+            child_budget = self.child_size - (len(child_heading) + 1 if child_heading else 0)
+            pieces = [piece for unit in units for piece in _split_long(unit, child_budget)]
+            budget = self.parent_size - len(section_heading) - 1
+            for parent_pieces in _pack(pieces, max(budget, self.child_size)):
+                parent_id = f"{prefix}:{page}:{n}"
+                n += 1
+                parent_text = "\n".join(([section_heading] if section_heading else []) + parent_pieces)
+                parents[parent_id] = {"text": parent_text, "metadata": dict(metadata, heading=section_heading)}
+                for group in _pack(parent_pieces, child_budget):
+                    child_text = " ".join(group)
+                    children.append({
+                        "text": f"{child_heading}\n{child_text}" if child_heading else child_text,
+                        "metadata": dict(metadata, parent_id=parent_id, heading=section_heading),
+                    })
+        return children, parents
+
+
+def iter_structured_chunks(
+    documents: Iterator[Dict[str, Any]], parents: Dict[str, Dict[str, Any]], chunker: Optional[StructureChunker] = None
+) -> Iterator[Dict[str, Any]]:
+    """Страницы kb_loader → дочерние чанки (генератор); разделы складываются в parents."""
+    chunker = chunker or StructureChunker()
+    for doc in documents:
+        children, doc_parents = chunker.split(doc["text"], doc["metadata"])
+        parents.update(doc_parents)
+        yield from children
@@ -7,31 +7,178 @@ load_dotenv()
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CURATOR_CHAT_ID = os.getenv("CURATOR_CHAT_ID")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")  # пусто — api.telegram.org; для локальной подмены Bot API
+
+# Режим работы: polling (один процесс) | webhook (HTTP-приём + BOT_WORKERS процессов, см. webhook_server.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "2"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес; если задан — регистрируется в Telegram при запуске
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # проверяется заголовок X-Telegram-Bot-Api-Secret-Token
 
 # GigaChat
 GIGACHAT_AUTH_KEY = os.getenv("GIGACHAT_AUTH_KEY")  # Authorization key от Сбера
 
 # Course
 COURSE_NAME = os.getenv("COURSE_NAME", "ОбучAI")
+# Реестр курсов (несколько курсов в одном процессе, см. courses.py); нет файла — один курс из COURSE_NAME
+COURSES_FILE = os.getenv("COURSES_FILE", "./courses.json")
+# Выбранный чатом курс (/start <id>): хранится бессрочно, в отличие от состояния диалогов (STATE_TTL)
+CHAT_COURSES_FILE = os.getenv("CHAT_COURSES_FILE", "./chat_courses.json")
 
 # Paths
 KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "./knowledge_base")
 LOGS_PATH = os.getenv("LOGS_PATH", "./logs")
 VECTOR_DB_PATH = "./vector_db"
+PARSED_CACHE_PATH = os.getenv("PARSED_CACHE_PATH", "./parsed_cache")  # текст PDF/DOCX по хэшу файла
+
+# Индексация: разбор файлов и страниц PDF в пуле процессов
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))  # страниц PDF на одну задачу пула
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))  # чанков на один вызов эмбеддинга и запись в Chroma
+WARMUP_RETRIES = int(os.getenv("WARMUP_RETRIES", "3"))  # повторы фоновой загрузки индекса после ошибки
+WARMUP_BACKOFF = float(os.getenv("WARMUP_BACKOFF", "10"))  # пауза перед первым повтором, с; дальше удваивается
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "0"))  # проверка knowledge_base/ на изменения раз в N с (0 — выкл., только /reindex)
+
+# Состояние диалогов (state_store.py): memory | sqlite | redis
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_TTL = float(os.getenv("STATE_TTL", "86400"))  # сколько хранить контекст последнего ответа, с
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))  # не больше записей (вытесняются давно не использованные)
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "./state.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-# RAG Settings (при изменении удалите папку vector_db/ и перезапустите бота)
+# RAG Settings (при изменении CHUNK_SIZE/CHUNK_OVERLAP индекс пересобирается целиком при следующем запуске или /reindex)
 # Можно переопределить в .env: CHUNK_SIZE, CHUNK_OVERLAP, RAG_TOP_K, RAG_TOP_K_CANDIDATES
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))   # размер чанка в символах; больше — больше контекста, реже режем термины
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))  # перекрытие чанков, чтобы не резать фразу по границе
+# Чанкинг: structure — по заголовкам, пунктам списков и предложениям (chunker.py): в индексе маленькие дочерние
+# чанки CHILD_CHUNK_SIZE, в промпт уходит их раздел до PARENT_CHUNK_SIZE; recursive — прежнее окно
+# CHUNK_SIZE/CHUNK_OVERLAP. Смена любого из параметров — полная пересборка индекса
+CHUNKER = os.getenv("CHUNKER", "structure")
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "400"))
+PARENT_CHUNK_SIZE = int(os.getenv("PARENT_CHUNK_SIZE", "1800"))
+RAG_CONTEXT_MAX_CHARS = int(os.getenv("RAG_CONTEXT_MAX_CHARS", "6000"))  # не больше символов разделов в промпте (structure)
 TOP_K = int(os.getenv("RAG_TOP_K", "6"))   # сколько чанков отдаём в промпт; больше — больше контекста, дороже по токенам
 TOP_K_CANDIDATES = int(os.getenv("RAG_TOP_K_CANDIDATES", "24"))  # кандидатов по вектору до переранжирования; больше — выше шанс найти нужный фрагмент
 
+# Отсечение заведомо безнадёжных вопросов до генерации: distance лучшего чанка выше RETRIEVAL_GATE_MAX_DISTANCE
+# и доля слов запроса, найденных в чанках, ниже RETRIEVAL_GATE_MIN_COVERAGE — сразу стандартный отказ.
+# 0 — выключено. Пороги и precision/recall на корзинках: python evaluate_blocks.py (Блок 2)
+RETRIEVAL_GATE_MAX_DISTANCE = float(os.getenv("RETRIEVAL_GATE_MAX_DISTANCE", "0"))
+RETRIEVAL_GATE_MIN_COVERAGE = float(os.getenv("RETRIEVAL_GATE_MIN_COVERAGE", "0.5"))
+
+# Конвейер ответа: two_call — нормализация (LLM) → поиск → генерация (LLM); combined — поиск по исходному тексту
+# и один вызов {type, normalized_query, answer}. combined откатывается к two_call, если тип не question
+# или поиск неуверенный (у top-1 нет терминов запроса или distance выше COMBINED_MAX_DISTANCE; 0 — без порога)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "two_call")
+COMBINED_MAX_DISTANCE = float(os.getenv("COMBINED_MAX_DISTANCE", "0"))
+
 # LLM Settings
+GIGACHAT_MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat:latest")
+GIGACHAT_THROTTLE_COOLDOWN = float(os.getenv("GIGACHAT_THROTTLE_COOLDOWN", "30"))  # пауза после 429, если нет Retry-After
+GIGACHAT_SESSION_CACHE = os.getenv("GIGACHAT_SESSION_CACHE", "1") == "1"  # X-Session-ID по версии промпта и курсу (кэш префикса у GigaChat)
+# Адреса GigaChat (подмена на локальную заглушку с отказами: scripts/fake_gigachat.py) и предел ожидания ответа
+GIGACHAT_AUTH_URL = os.getenv("GIGACHAT_AUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+GIGACHAT_API_URL = os.getenv("GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru/api/v1")
+GIGACHAT_TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", "30"))  # с на запрос, включая чтение ответа
+# Автоматический выключатель: после GIGACHAT_BREAKER_FAILURES отказов подряд (таймаут, сеть, 5xx) запросы
+# к GigaChat не отправляются GIGACHAT_BREAKER_OPEN_SECONDS с — бот сразу работает в деградированном режиме
+# (классификация по маркерам, ответ фрагментами материалов, без Judge); затем один пробный запрос
+GIGACHAT_BREAKER_FAILURES = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "3"))
+GIGACHAT_BREAKER_OPEN_SECONDS = float(os.getenv("GIGACHAT_BREAKER_OPEN_SECONDS", "30"))
+DEGRADED_ANSWER_CHUNKS = int(os.getenv("DEGRADED_ANSWER_CHUNKS", "2"))  # фрагментов в ответе без LLM
+DEGRADED_ANSWER_MAX_CHARS = int(os.getenv("DEGRADED_ANSWER_MAX_CHARS", "700"))  # символов на фрагмент
+# Извлекающий ответ без LLM (extractive.py) для вопросов «что такое X»: off; preview — лучшие предложения
+# материалов первым сообщением, пока готовится ответ LLM; answer — при уверенном результате вместо LLM
+EXTRACTIVE_MODE = os.getenv("EXTRACTIVE_MODE", "preview")
+EXTRACTIVE_TOP_CHUNKS = int(os.getenv("EXTRACTIVE_TOP_CHUNKS", "3"))  # из скольких лучших чанков брать предложения
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "2"))
+EXTRACTIVE_MARGIN = float(os.getenv("EXTRACTIVE_MARGIN", "0.05"))  # второе предложение — не хуже лучшего на столько
+EXTRACTIVE_MIN_SIMILARITY = float(os.getenv("EXTRACTIVE_MIN_SIMILARITY", "0.6"))  # косинус для режима answer
+EXTRACTIVE_CACHE_SIZE = int(os.getenv("EXTRACTIVE_CACHE_SIZE", "4096"))  # векторов предложений в памяти
+# FAQ из оценённых ответов (faq.py): вопрос, близкий к кластеру частых вопросов, получает готовый ответ без LLM.
+# Сборка — python faq.py или фоновый поток раз в FAQ_REBUILD_INTERVAL с (0 — выкл.)
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "1") == "1"
+FAQ_REBUILD_INTERVAL = float(os.getenv("FAQ_REBUILD_INTERVAL", "0"))
+FAQ_CLUSTER_THRESHOLD = float(os.getenv("FAQ_CLUSTER_THRESHOLD", "0.85"))  # косинус вопроса с центром кластера
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.9"))  # косинус нового вопроса для ответа из FAQ
+FAQ_MIN_HELPFUL = int(os.getenv("FAQ_MIN_HELPFUL", "2"))  # «Полезно» в кластере, чтобы он попал в FAQ
+FAQ_MIN_HELPFUL_SHARE = float(os.getenv("FAQ_MIN_HELPFUL_SHARE", "0.75"))  # доля «Полезно» среди оценок кластера
+FAQ_MIN_JUDGE_SCORE = float(os.getenv("FAQ_MIN_JUDGE_SCORE", "4.0"))  # балл Judge ответа, если он оценивался
+# Ответы в JSON (нормализация, combined, Judge): если JSON не разобран или не прошёл проверку схемы —
+# один повтор с промптом ремонта (structured_output.py); 0 — сразу откат
+STRUCTURED_OUTPUT_REPAIR = os.getenv("STRUCTURED_OUTPUT_REPAIR", "1") == "1"
+STRUCTURED_OUTPUT_REPAIR_MAX_CHARS = int(os.getenv("STRUCTURED_OUTPUT_REPAIR_MAX_CHARS", "4000"))  # ответ модели в промпте ремонта
+# Планировщик запросов к GigaChat (llm_scheduler.py): всего одновременно и по классам
+# (interactive — нормализация и генерация, judge — оценка); прождавший дольше LLM_STARVATION_AFTER с идёт вне очереди
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "6"))
+LLM_CLASS_LIMITS = {
+    k.strip(): int(v)
+    for k, v in (item.split(":", 1) for item in os.getenv("LLM_CLASS_LIMITS", "interactive:6,judge:2").split(",") if ":" in item)
+}
+LLM_STARVATION_AFTER = float(os.getenv("LLM_STARVATION_AFTER", "20"))
 TEMPERATURE_GENERATION = 0.3
 MAX_TOKENS = 700
 
+# Оценка (evaluate_blocks.py): параллельные вызовы LLM и дисковый кэш ответов
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))  # сколько запросов к GigaChat одновременно
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache")  # кэш по (хэш промпта, модель, параметры)
+
+# Вход Judge: full — весь контекст и полный промпт; compact — только фрагменты, на которые опирается ответ,
+# не длиннее JUDGE_CONTEXT_MAX_CHARS, и сжатый промпт (сверка с full: python judge_batch.py --compare)
+JUDGE_INPUT_MODE = os.getenv("JUDGE_INPUT_MODE", "full")
+JUDGE_CONTEXT_MAX_CHARS = int(os.getenv("JUDGE_CONTEXT_MAX_CHARS", "2500"))
+JUDGE_CONTEXT_MIN_OVERLAP = float(os.getenv("JUDGE_CONTEXT_MIN_OVERLAP", "0.15"))  # доля слов ответа, встречающихся во фрагменте
+
+# Judge для шаблонных ответов (abuse/off_topic/cheat): сначала локальная проверка по маркерам,
+# затем короткий промпт; полный Judge — только при расхождении
+JUDGE_TEMPLATE_FASTPATH = os.getenv("JUDGE_TEMPLATE_FASTPATH", "1") == "1"
+JUDGE_TEMPLATE_CACHE_SIZE = int(os.getenv("JUDGE_TEMPLATE_CACHE_SIZE", "2048"))
+
+# Выборочная оценка Judge. Доля оценки по умолчанию и по типам запроса ("question:0.3,abuse:0.05").
+# Всегда оцениваются: слабый поиск (нет совпадений терминов в top-1 или distance выше порога) и «Не помогло».
+# Оценки хранят sample_weight = 1/доля — агрегаты по логам перевзвешиваются и остаются несмещёнными.
+JUDGE_SAMPLE_RATE = float(os.getenv("JUDGE_SAMPLE_RATE", "1.0"))
+JUDGE_SAMPLE_RATES = {
+    k.strip(): float(v)
+    for k, v in (item.split(":", 1) for item in os.getenv("JUDGE_SAMPLE_RATES", "").split(",") if ":" in item)
+}
+JUDGE_ALWAYS_MAX_DISTANCE = float(os.getenv("JUDGE_ALWAYS_MAX_DISTANCE", "0"))  # 0 — не использовать порог distance
+JUDGE_MAX_PER_MINUTE = int(os.getenv("JUDGE_MAX_PER_MINUTE", "0"))  # бюджет вызовов Judge; 0 — без ограничения
+
+# Защита от перегрузки (admission.py). Ограничение частоты вопросов одного пользователя (token bucket):
+# RATE_LIMIT_BURST вопросов подряд, дальше RATE_LIMIT_PER_MINUTE в минуту; 0 — без ограничения
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "10"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# Тот же текст от того же пользователя: пока первый в работе — ждёт его ответа; в течение N с после ответа —
+# короткое «ответ выше» вместо повторного прогона конвейера
+DEDUPE_WINDOW = float(os.getenv("DEDUPE_WINDOW", "30"))
+# Обновления, обрабатываемые одновременно в режиме polling (без этого — строго по одному, и допуск в конвейер
+# и ожидание повторов не срабатывают); 1 — по одному. В режиме webhook параллельность задают воркеры
+POLLING_CONCURRENT_UPDATES = int(os.getenv("POLLING_CONCURRENT_UPDATES", "16"))
+# Допуск вопросов в конвейер: не больше ADMISSION_MAX_CONCURRENT одновременно; если среднее время ответа
+# GigaChat выше ADMISSION_LATENCY_TARGET (или пришёл 429), лимит уменьшается вдвое и растёт обратно по одному.
+# Не получившие слот ждут до ADMISSION_QUEUE_TIMEOUT с (в очереди не больше ADMISSION_MAX_QUEUE), иначе — отказ
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "8"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "50"))
+
 # Embeddings
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# torch — sentence-transformers (по умолчанию); onnx — ONNX Runtime без torch (embeddings_onnx.py), модель
+# EMBEDDING_ONNX_PATH готовит scripts/export_onnx.py (model.onnx — fp32, model_int8.onnx — квантованная).
+# Смена бэкенда или файла модели — полная пересборка индекса; сверка с torch: python scripts/bench_embeddings.py
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "./models/embeddings_onnx/model_int8.onnx")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # потоков ONNX Runtime на запрос; 0 — по числу ядер
+# Кэш эмбеддингов запросов (embedding_cache.py): LRU на QUERY_EMBEDDING_CACHE_SIZE текстов (0 — выключен).
+# QUERY_EMBEDDING_CACHE_PATH — папка для снимка кэша между запусками (пусто — только в памяти)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH", "")
+QUERY_EMBEDDING_CACHE_SAVE_EVERY = int(os.getenv("QUERY_EMBEDDING_CACHE_SAVE_EVERY", "200"))
 
 # Дублирование логов в Google Таблицу (реальное время). Если не задано — только файлы.
 _raw_sheet_id = os.getenv("GOOGLE_SHEET_ID", "").strip() or "1UhkErAjyPc2MlT1KqnWa_WWuIwi95rcNWO2fYrJd0D8"
@@ -0,0 +1,177 @@
+"""Реестр курсов: один процесс бота обслуживает несколько курсов.
+У каждого курса своя папка материалов, свой индекс (vector_db) и своё описание для промптов;
+модель эмбеддингов и клиент GigaChat общие. Курс выбирается по чату (поле chats в реестре)
+или deep-link параметром: https://t.me/<бот>?start=<id курса> → /start <id курса>.
+
+Реестр — JSON-файл COURSES_FILE:
+{
+  "default": "esg",
+  "courses": [
+    {"id": "esg", "name": "Управление устойчивым развитием", "knowledge_base_path": "./knowledge_base/esg",
+     "description": "ESG, ЦУР, углеродный след, отчётность об устойчивом развитии", "chats": [-1001234567890]}
+  ]
+}
+Если файла нет — один курс "default" из COURSE_NAME, KNOWLEDGE_BASE_PATH и VECTOR_DB_PATH (как раньше).
+
+Выбор курса чата (/start <id>) хранится в CHAT_COURSES_FILE без срока жизни — не в хранилище состояния
+диалогов, где записи вытесняются по STATE_TTL и STATE_MAX_ENTRIES и чат молча вернулся бы к курсу по умолчанию."""
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Any, List, Optional
+import config
+from state_store import get_state_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами нет
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COURSE_ID = "default"
+
+_courses: Optional[Dict[str, Dict[str, Any]]] = None
+_default_id = DEFAULT_COURSE_ID
+
+# Выбранные курсы чатов {chat_id: course_id}: перечитываются при смене файла (его пишут и другие воркеры)
+_chat_courses: Dict[str, str] = {}
+_chat_courses_mtime = None
+_chat_courses_lock = threading.Lock()
+
+
+def _course_entry(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Курс из реестра с путями по умолчанию: knowledge_base/<id>, vector_db/<id>."""
+    course_id = str(raw["id"])
+    if not re.fullmatch(r"[\w\-]{1,40}", course_id):
+        raise ValueError(f"Недопустимый id курса: {course_id!r} (буквы, цифры, _ и -)")
+    return {
+        "id": course_id,
+        "name": raw.get("name") or course_id,
+        "knowledge_base_path": raw.get("knowledge_base_path") or os.path.join(config.KNOWLEDGE_BASE_PATH, course_id),
+        "vector_db_path": raw.get("vector_db_path") or os.path.join(config.VECTOR_DB_PATH, course_id),
+        "description": raw.get("description", ""),
+        "chats": [str(c) for c in raw.get("chats", [])],
+    }
+
+
+def load_courses(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Читает реестр курсов (один раз; повторный вызов с path перечитывает)."""
+    global _courses, _default_id
+    if _courses is not None and path is None:
+        return _courses
+    path = path or config.COURSES_FILE
+    courses = {}
+    default_id = DEFAULT_COURSE_ID
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for raw in data.get("courses", []):
+            course = _course_entry(raw)
+            courses[course["id"]] = course
+        default_id = str(data.get("default") or next(iter(courses), DEFAULT_COURSE_ID))
+    if not courses:
+        courses[DEFAULT_COURSE_ID] = {
+            "id": DEFAULT_COURSE_ID,
+            "name": config.COURSE_NAME,
+            "knowledge_base_path": config.KNOWLEDGE_BASE_PATH,
+            "vector_db_path": config.VECTOR_DB_PATH,
+            "description": "",
+            "chats": [],
+        }
+        default_id = DEFAULT_COURSE_ID
+    if default_id not in courses:
+        raise ValueError(f"Курс по умолчанию {default_id!r} не описан в {path}")
+    _courses, _default_id = courses, default_id
+    logger.info("Курсов в реестре: %d (по умолчанию %s)", len(courses), default_id)
+    return courses
+
+
+def list_courses() -> List[Dict[str, Any]]:
+    return list(load_courses().values())
+
+
+def get_course(course_id: Optional[str] = None) -> Dict[str, Any]:
+    """Курс по id; None или неизвестный id — курс по умолчанию."""
+    courses = load_courses()
+    return courses.get(course_id) or courses[_default_id]
+
+
+def default_course_id() -> str:
+    load_courses()
+    return _default_id
+
+
+def _read_chat_courses() -> Dict[str, str]:
+    """Выбранные курсы чатов из CHAT_COURSES_FILE (один stat() на вызов, файл читается только после изменения)."""
+    global _chat_courses, _chat_courses_mtime
+    try:
+        mtime = (config.CHAT_COURSES_FILE, os.stat(config.CHAT_COURSES_FILE).st_mtime_ns)
+    except OSError:
+        return _chat_courses
+    if mtime != _chat_courses_mtime:
+        try:
+            with open(config.CHAT_COURSES_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Не удалось прочитать %s: %s", config.CHAT_COURSES_FILE, e)
+            return _chat_courses
+        _chat_courses, _chat_courses_mtime = ({str(k): str(v) for k, v in data.items()} if isinstance(data, dict) else {}), mtime
+    return _chat_courses
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Блокировка файла между процессами (webhook-воркеры выбирают курсы своих чатов параллельно)."""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _save_chat_course(chat_id, course_id: str) -> None:
+    path = config.CHAT_COURSES_FILE
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with _chat_courses_lock, _file_lock(f"{path}.lock"):
+        chats = dict(_read_chat_courses())  # под блокировкой — с выбором других воркеров
+        chats[str(chat_id)] = course_id
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(chats, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        _read_chat_courses()
+
+
+def course_for_chat(chat_id) -> Dict[str, Any]:
+    """Курс чата: выбранный через /start <id> → привязанный в реестре (chats) → по умолчанию."""
+    if len(load_courses()) == 1:
+        return get_course()
+    chosen = _read_chat_courses().get(str(chat_id))
+    if chosen is None:
+        # Выбор, сделанный до CHAT_COURSES_FILE, лежит в хранилище состояния — переносим, пока не истёк
+        legacy = get_state_store().get(f"course:{chat_id}")
+        if legacy and legacy.get("course") in load_courses():
+            chosen = legacy["course"]
+            _save_chat_course(chat_id, chosen)
+    if chosen in load_courses():
+        return get_course(chosen)
+    for course in list_courses():
+        if str(chat_id) in course["chats"]:
+            return course
+    return get_course()
+
+
+def select_course(chat_id, course_id: str) -> Optional[Dict[str, Any]]:
+    """Запоминает курс чата (deep-link /start <id>) в CHAT_COURSES_FILE. None — такого курса нет."""
+    course = load_courses().get(course_id)
+    if course is not None:
+        _save_chat_course(chat_id, course_id)
+    return course
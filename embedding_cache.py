@@ -0,0 +1,125 @@
+"""Кэш эмбеддингов запросов: текст запроса → вектор, LRU не больше QUERY_EMBEDDING_CACHE_SIZE.
+
+Нормализованные запросы часто повторяются, а evaluate_blocks ищет одни и те же строки в каждом блоке;
+повторный поиск не кодирует запрос заново. Кэш оборачивает модель эмбеддингов (block2_rag._get_embeddings),
+поэтому им пользуется всё, что получает векторы запросов через неё (поиск Chroma, block2_rag.embed_query).
+Эмбеддинги документов при индексации идут мимо кэша.
+
+Ключ кэша включает модель и бэкенд (EMBEDDING_MODEL, EMBEDDING_BACKEND/файл ONNX): смена модели — пустой кэш.
+QUERY_EMBEDDING_CACHE_PATH — сохранять кэш на диск между запусками: векторы в .npy (при загрузке
+открывается через mmap), тексты в .json; снимок перезаписывается атомарно каждые
+QUERY_EMBEDDING_CACHE_SAVE_EVERY новых векторов и при выходе. Воркеры webhook пишут один снимок —
+остаётся последний, для кэша это допустимо."""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = "query_embeddings_"
+
+
+class QueryEmbeddingCache:
+    """Обёртка над моделью эмбеддингов с тем же интерфейсом (embed_documents / embed_query)."""
+
+    def __init__(self, embeddings, model_key: str, max_entries: int = None, path: str = None):
+        self.embeddings = embeddings
+        self.model_key = model_key
+        self.max_entries = config.QUERY_EMBEDDING_CACHE_SIZE if max_entries is None else max_entries
+        self.path = config.QUERY_EMBEDDING_CACHE_PATH if path is None else path
+        self._vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+
+    def _file(self, ext: str) -> str:
+        digest = hashlib.sha1(self.model_key.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.path, f"{FILE_PREFIX}{digest}.{ext}")
+
+    def _load(self) -> None:
+        """Снимок этой модели; снимки других моделей удаляются (они уже не пригодятся)."""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            current = {os.path.basename(self._file("npy")), os.path.basename(self._file("json"))}
+            for name in os.listdir(self.path):
+                if name.startswith(FILE_PREFIX) and name not in current:
+                    os.remove(os.path.join(self.path, name))
+            with open(self._file("json"), "r", encoding="utf-8") as f:
+                texts = json.load(f)
+            vectors = np.load(self._file("npy"), mmap_mode="r")
+            if len(texts) != len(vectors):
+                return
+            for text, vector in zip(texts[-self.max_entries:], vectors[-self.max_entries:]):
+                self._vectors[text] = np.array(vector)
+            logger.info("Кэш эмбеддингов запросов: загружено %d векторов", len(self._vectors))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Не удалось загрузить кэш эмбеддингов запросов: %s", e)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            texts = list(self._vectors)
+            vectors = np.stack(list(self._vectors.values())) if texts else np.zeros((0, 0), dtype=np.float32)
+            self._unsaved = 0
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Сначала векторы, потом тексты: при сбое между записями длины не совпадут и снимок не загрузится
+            for ext, write in (
+                ("npy", lambda f: np.save(f, vectors)),
+                ("json", lambda f: f.write(json.dumps(texts, ensure_ascii=False).encode("utf-8"))),
+            ):
+                target = self._file(ext)
+                tmp = f"{target}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    write(f)
+                os.replace(tmp, target)
+        except Exception as e:
+            logger.warning("Не удалось сохранить кэш эмбеддингов запросов: %s", e)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is not None:
+                self._vectors.move_to_end(text)
+                self.hits += 1
+                return vector.tolist()
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self.misses += 1
+            self._vectors[text] = vector
+            self._vectors.move_to_end(text)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+            self._unsaved += 1
+            save_now = self.path and self._unsaved >= config.QUERY_EMBEDDING_CACHE_SAVE_EVERY
+        if save_now:
+            self.save()
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._vectors),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
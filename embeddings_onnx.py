@@ -0,0 +1,58 @@
+"""Эмбеддинги через ONNX Runtime (EMBEDDING_BACKEND=onnx) — без импорта torch и sentence-transformers.
+
+Тот же интерфейс, что у HuggingFaceEmbeddings (embed_documents / embed_query), поэтому Chroma и
+block2_rag работают с ним без изменений. Модель — экспорт EMBEDDING_MODEL в ONNX (fp32 или int8 после
+динамического квантования) и tokenizer.json рядом с ней; готовит scripts/export_onnx.py.
+Пулинг — среднее по токенам с учётом маски, как у paraphrase-multilingual-MiniLM-L12-v2 в sentence-transformers.
+Совпадение с torch-моделью (косинус) и скорость/память: python scripts/bench_embeddings.py."""
+import os
+from typing import List
+import numpy as np
+import config
+
+MAX_SEQ_LENGTH = 128  # max_seq_length модели в sentence-transformers: длиннее — обрезается так же
+
+
+class OnnxEmbeddings:
+    """Эмбеддинги EMBEDDING_MODEL из ONNX-файла (model_path) и tokenizer.json из той же папки."""
+
+    def __init__(self, model_path: str = None, batch_size: int = 32, threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path or config.EMBEDDING_ONNX_PATH
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"Нет ONNX-модели {self.model_path}: подготовьте её (python scripts/export_onnx.py) "
+                f"или уберите EMBEDDING_BACKEND=onnx"
+            )
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(self.model_path), "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        threads = config.EMBEDDING_THREADS if threads is None else threads
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feed)[0]
+        weights = mask[..., None].astype(np.float32)
+        return (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode([t.replace("\n", " ") for t in texts[start:start + self.batch_size]]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -37,6 +37,18 @@ E2E: средний балл Judge по тестовой корзинке. Це
 Примечания по выводу:
 - Сообщения ChromaDB "Failed to send telemetry event" можно игнорировать.
 - Блок 5 (CSAT/Deflection) зависит от реальных нажатий кнопок в логах; при малом числе записей метрики нерепрезентативны.
+
+Прогон:
+- Индекс грузится один раз на весь прогон: если vector_db/ уже есть — открывается он, без переэмбеддинга.
+  Флаг --reindex пересобирает базу знаний заново.
+- Вызовы LLM внутри блока идут параллельно (не больше EVAL_CONCURRENCY одновременно);
+  цепочки E2E (нормализация → поиск → генерация → Judge) для разных вопросов — тоже параллельно.
+- Ответы LLM кэшируются на диске (LLM_CACHE_PATH) по (хэш промпта, модель, параметры): повторный
+  прогон после изменений только в поиске не тратит токены. Флаг --no-cache отключает кэш.
+- Флаг --combined: сравнение PIPELINE_MODE two_call и combined (время ответа, число вызовов LLM, балл Judge);
+  время сравнивать с --no-cache.
+- Флаг --extractive: извлекающий ответ без LLM (extractive.py) против генерации на вопросах-определениях
+  корзинок — балл Judge обоих, доля уверенных извлечений и их балл (порог EXTRACTIVE_MIN_SIMILARITY).
 """
 
 import asyncio
@@ -45,15 +57,24 @@ import os
 from pathlib import Path
 
 import config
-from block1_normalization import normalize_query, get_response_template
+from block1_normalization import normalize_query, get_response_template, classify_by_keywords
 from block2_rag import (
+    get_index,
     load_knowledge_base,
     search_relevant_chunks,
     get_context_from_chunks,
+    retrieval_is_confident,
+    retrieval_confidence,
+    is_hopeless,
+    query_embedding_cache_stats,
 )
-from block3_generation import generate_answer
-from block4_judge import judge_answer
-from gigachat_client import close_client
+from block3_generation import generate_answer, combined_answer
+from extractive import definition_term, extract_answer, is_confident
+from block4_judge import judge_answer, weighted_judge_summary
+from gigachat_client import get_client, close_client, scheduler_stats, prompt_latency_stats
+from llm_scheduler import format_stats
+from prompts import prompt_versions
+from structured_output import parse_stats
 
 # --- Тестовая корзинка по ТЗ (таблица 20) + расширенная для классификации ---
 # Формат: (вопрос, ожидаемый_тип для Блока 1, по_курсу_ли для RAG/генерации)
@@ -68,6 +89,12 @@ BASKET_TZ = [
     ("Как начать обучение?", "question", True),
 ]
 
+# Вопросы, ответа на которые в материалах курса нет (корректный отказ Блока 3, подбор порога уверенности поиска)
+BASKET_OUT_OF_COURSE = [
+    "Расскажи про квантовую телепортацию в менеджменте",
+    "Что такое теория струн в экономике?",
+]
+
 # Дополнительно для Accuracy: по 5 на класс (ТЗ: 5 question, 5 abuse, 5 off_topic, 5 cheat)
 BASKET_CLASSIFICATION = [
     ("объясни концепцию устойчивого развития", "question"),
@@ -93,11 +120,41 @@ BASKET_CLASSIFICATION = [
 ]
 
 
+_rag_ready = None
+_reindex = False
+_search_cache = {}
+
+
 def _ensure_rag():
-    """Грузит базу знаний и возвращает True если есть что искать."""
-    load_knowledge_base()
-    chunks = search_relevant_chunks("устойчивое развитие", top_k=1)
-    return len(chunks) > 0
+    """Грузит базу знаний один раз за прогон и возвращает True если есть что искать.
+    Без --reindex открывается уже сохранённый vector_db/ (search_relevant_chunks делает это лениво)."""
+    global _rag_ready
+    if _rag_ready is None:
+        if _reindex or not os.path.exists(get_index().vector_db_path):
+            # Пересборка в отдельную коллекцию с заменой рабочей — чанки не дублируются при повторном --reindex
+            load_knowledge_base()
+        _rag_ready = len(_search("устойчивое развитие", top_k=1)) > 0
+    return _rag_ready
+
+
+def _search(query, top_k=None):
+    """search_relevant_chunks с мемоизацией: блоки 2–4 и E2E ищут одни и те же строки."""
+    key = (query, top_k or config.TOP_K)
+    if key not in _search_cache:
+        _search_cache[key] = search_relevant_chunks(query, top_k=top_k or config.TOP_K)
+    return _search_cache[key]
+
+
+async def _gather_bounded(items, fn, limit=None):
+    """Параллельно применяет async fn к items, не больше limit (EVAL_CONCURRENCY) одновременно.
+    Порядок результатов совпадает с порядком items."""
+    sem = asyncio.Semaphore(limit or config.EVAL_CONCURRENCY)
+
+    async def run(item):
+        async with sem:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
 
 
 # ---------- Блок 1: Нормализация и классификация ----------
@@ -111,8 +168,8 @@ async def evaluate_block1():
     correct = 0
     results = []
 
-    for question, expected_type in BASKET_CLASSIFICATION:
-        out = await normalize_query(question)
+    outs = await _gather_bounded(BASKET_CLASSIFICATION, lambda item: normalize_query(item[0]))
+    for (question, expected_type), out in zip(BASKET_CLASSIFICATION, outs):
         pred = out.get("type", "")
         ok = pred == expected_type
         if ok:
@@ -143,7 +200,7 @@ def evaluate_block2():
     by_course = [(q, exp, is_c) for q, exp, is_c in BASKET_TZ if is_c]
     found = 0
     for question, _exp, _ in by_course:
-        chunks = search_relevant_chunks(question, top_k=config.TOP_K)
+        chunks = _search(question)
         if chunks:
             found += 1
             src = chunks[0].get("metadata", {}).get("source", "?")
@@ -153,9 +210,65 @@ def evaluate_block2():
 
     recall_like = found / len(by_course) if by_course else 0
     print(f"\nВопросов по курсу: {len(by_course)}, с найденными чанками: {found}")
+    evaluate_retrieval_gate()
     return recall_like
 
 
+def evaluate_retrieval_gate():
+    """Порог уверенности поиска (RETRIEVAL_GATE_*): отсекать ли вопрос до генерации.
+    Положительный класс — «ответа в материалах нет» (вне курса и off_topic), отрицательный — вопросы по курсу.
+    Перебор порогов distance × покрытие: precision — доля действительно безнадёжных среди отсечённых,
+    recall — доля безнадёжных, которые отсечены. Рекомендуется порог с наибольшим recall при precision = 100%:
+    ни один вопрос по курсу из корзинок не должен получить отказ без генерации."""
+    print("\n" + "-" * 60)
+    print("Порог уверенности поиска (отказ без генерации)")
+
+    answerable = [q for q, exp, is_c in BASKET_TZ if exp == "question" and is_c]
+    answerable += [q for q, exp in BASKET_CLASSIFICATION if exp == "question"]
+    unanswerable = BASKET_OUT_OF_COURSE + [q for q, exp in BASKET_CLASSIFICATION if exp == "off_topic"]
+    samples = [(retrieval_confidence(q, _search(q)), False, q) for q in answerable]
+    samples += [(retrieval_confidence(q, _search(q)), True, q) for q in unanswerable]
+    for conf, positive, q in samples:
+        dist = "—" if conf["distance"] is None else f"{conf['distance']:.3f}"
+        print(f"  {'нет в курсе' if positive else 'по курсу':11} | distance {dist:>6} | покрытие {conf['coverage']:.2f} | {q[:45]}")
+
+    distances = sorted({c["distance"] for c, _p, _q in samples if c["distance"] is not None})
+    coverages = (0.25, 0.34, 0.5, 0.67, 1.01)  # 1.01 — только по distance
+    n_pos = sum(1 for _c, p, _q in samples if p)
+    rows = []
+    for max_distance in distances:
+        for min_coverage in coverages:
+            gated = [p for c, p, _q in samples if is_hopeless(c, max_distance, min_coverage)]
+            tp = sum(gated)
+            precision = tp / len(gated) if gated else 1.0
+            recall = tp / n_pos if n_pos else 0.0
+            rows.append((precision, recall, max_distance, min_coverage))
+    if not rows:
+        print("Нет результатов поиска для подбора порога.")
+        return
+    # Компромисс: для каждого recall — лучший precision
+    best = {}
+    for precision, recall, max_distance, min_coverage in rows:
+        if recall not in best or precision > best[recall][0]:
+            best[recall] = (precision, recall, max_distance, min_coverage)
+    print("\n  recall | precision | RETRIEVAL_GATE_MAX_DISTANCE | RETRIEVAL_GATE_MIN_COVERAGE")
+    for precision, recall, max_distance, min_coverage in sorted(best.values(), key=lambda r: r[1]):
+        if not recall:
+            continue
+        print(f"  {recall:6.0%} | {precision:9.0%} | {max_distance:27.3f} | {min_coverage:.2f}")
+    safe = [r for r in rows if r[0] == 1.0 and r[1] > 0]
+    if safe:
+        precision, recall, max_distance, min_coverage = max(safe, key=lambda r: (r[1], r[2]))
+        print(
+            f"Рекомендуется: RETRIEVAL_GATE_MAX_DISTANCE={max_distance:.3f} RETRIEVAL_GATE_MIN_COVERAGE={min_coverage:.2f} "
+            f"(отсекает {recall:.0%} безнадёжных, вопросов по курсу — ни одного)"
+        )
+    else:
+        print("Порога без отказов на вопросах по курсу нет — отсечение лучше не включать.")
+    current = config.RETRIEVAL_GATE_MAX_DISTANCE
+    print(f"Сейчас: RETRIEVAL_GATE_MAX_DISTANCE={current} ({'выключено' if current <= 0 else 'включено'})")
+
+
 # ---------- Блок 3: Генерация ----------
 async def evaluate_block3():
     """Блок 3: Groundedness, корректный отказ. Через ответы + Judge."""
@@ -171,16 +284,18 @@ async def evaluate_block3():
     # Вопросы по курсу — ожидаем ответ с контекстом
     by_course = [(q, exp, is_c) for q, exp, is_c in BASKET_TZ if exp == "question" and is_c]
     # Вопрос не по курсу — ожидаем отказ
-    out_of_course = [
-        "Расскажи про квантовую телепортацию в менеджменте",
-        "Что такое теория струн в экономике?",
-    ]
+    out_of_course = BASKET_OUT_OF_COURSE
 
-    refusals = 0
-    for q in out_of_course:
-        chunks = search_relevant_chunks(q, top_k=config.TOP_K)
+    async def answer_for(q):
+        chunks = _search(q)
         context = get_context_from_chunks(chunks) if chunks else ""
-        answer = await generate_answer(q, context)
+        if is_hopeless(retrieval_confidence(q, chunks)):
+            return chunks, context, await generate_answer(q, "")  # как в боте: отказ без генерации
+        return chunks, context, await generate_answer(q, context)
+
+    refusals = 0
+    answers = await _gather_bounded(out_of_course, answer_for)
+    for q, (chunks, _context, answer) in zip(out_of_course, answers):
         # Корректный отказ: «не нашёл», «нет информации», «нет данных»
         if not chunks or any(
             phrase in answer.lower()
@@ -197,9 +312,7 @@ async def evaluate_block3():
     # Один вопрос по курсу → ответ + Judge (groundedness/safety)
     if by_course:
         q, _exp, _ = by_course[0]
-        chunks = search_relevant_chunks(q, top_k=config.TOP_K)
-        context = get_context_from_chunks(chunks)
-        answer = await generate_answer(q, context)
+        _chunks, context, answer = await answer_for(q)
         verdict = await judge_answer(q, context, answer, query_type="question")
         print(f"\nПример по курсу: «{q[:50]}»")
         print(f"  Judge: {verdict.get('verdict')}, groundedness={verdict.get('groundedness')}, safety={verdict.get('safety')}")
@@ -222,13 +335,14 @@ async def evaluate_block4():
     scores = []
     verdicts = []
 
-    for question, exp_type, by_course in BASKET_TZ:
-        if exp_type != "question":
-            continue
-        chunks = search_relevant_chunks(question, top_k=config.TOP_K)
+    async def judged(question):
+        chunks = _search(question)
         context = get_context_from_chunks(chunks) if chunks else ""
         answer = await generate_answer(question, context)
-        v = await judge_answer(question, context, answer, query_type="question")
+        return await judge_answer(question, context, answer, query_type="question")
+
+    questions = [q for q, exp_type, _ in BASKET_TZ if exp_type == "question"]
+    for v in await _gather_bounded(questions, judged):
         verdicts.append(v.get("verdict", ""))
         sc = v.get("overall_score")
         if sc is not None:
@@ -244,6 +358,23 @@ async def evaluate_block4():
     print(f"Средний балл Judge (1–5): {avg:.2f} (цель >= 4.0)")
     print(f"% verdict = good: {good_pct:.0f}% (цель >= 70%)")
     print("Вердикты:", verdicts)
+
+    # По логам: Judge оценивает выборку трафика, поэтому агрегаты перевзвешиваются по sample_weight
+    judge_log = Path(config.LOGS_PATH) / "judge_log.json"
+    if judge_log.exists():
+        try:
+            with open(judge_log, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            entries = []
+        summary = weighted_judge_summary(e.get("judge_verdict") for e in entries if isinstance(e, dict))
+        if summary["n"]:
+            print(
+                f"По judge_log.json: оценок {summary['n']} (≈{summary['estimated_total']:.0f} запросов с учётом выборки), "
+                f"взвешенный средний балл {summary['avg_score']:.2f}, взвешенная доля good {summary['good_share']:.0%}; "
+                f"оценок по «Не помогло» вне выборки: {summary['n_negative_feedback']}; "
+                f"сбоев Judge (не учтены): {summary['n_errors']}"
+            )
     return avg / 5.0  # нормализуем в 0–1 для сводки
 
 
@@ -306,25 +437,25 @@ async def evaluate_e2e():
         print("RAG не загружен. Пропуск E2E.")
         return 0.0
 
-    results = []
-    for question, exp_type, by_course in BASKET_TZ:
+    async def pipeline(item):
+        question, exp_type, _by_course = item
         # Блок 1
         norm = await normalize_query(question)
         pred_type = norm.get("type", "")
         if pred_type != "question":
-            results.append((question, exp_type, pred_type, None, "шаблон"))
-            continue
+            return (question, exp_type, pred_type, None, "шаблон")
 
         # Блок 2
-        chunks = search_relevant_chunks(norm.get("normalized_query", question), top_k=config.TOP_K)
+        chunks = _search(norm.get("normalized_query", question))
         context = get_context_from_chunks(chunks) if chunks else ""
-        # Блок 3
-        answer = await generate_answer(norm.get("normalized_query", question), context)
+        # Блок 3 (безнадёжный поиск — стандартный отказ без генерации, как в боте)
+        hopeless = is_hopeless(retrieval_confidence(norm.get("normalized_query", question), chunks))
+        answer = await generate_answer(norm.get("normalized_query", question), "" if hopeless else context)
         # Блок 4
         v = await judge_answer(question, context, answer, query_type="question")
-        sc = v.get("overall_score")
-        verdict = v.get("verdict", "")
-        results.append((question, exp_type, pred_type, sc, verdict))
+        return (question, exp_type, pred_type, v.get("overall_score"), v.get("verdict", ""))
+
+    results = await _gather_bounded(BASKET_TZ, pipeline)
 
     scores = [r[3] for r in results if r[3] is not None]
     avg = sum(scores) / len(scores) if scores else 0
@@ -335,15 +466,171 @@ async def evaluate_e2e():
     return avg / 5.0 if scores else 0.0
 
 
+# ---------- Режим «одним вызовом» против двух вызовов ----------
+async def evaluate_combined():
+    """PIPELINE_MODE: two_call (нормализация → поиск → генерация) против combined (поиск по исходному тексту →
+    один вызов {type, normalized_query, answer} с откатом к two_call). Время ответа и балл Judge по корзинке.
+    Время осмысленно только без кэша LLM (--no-cache)."""
+    import time
+
+    print("\n" + "=" * 60)
+    print("РЕЖИМ COMBINED: один вызов LLM против двух (--combined)")
+    print("=" * 60)
+
+    if not _ensure_rag():
+        print("RAG не загружен. Пропуск.")
+        return
+
+    async def two_call(question):
+        norm = await normalize_query(question)
+        if norm.get("type") != "question":
+            return norm.get("type"), None, None, 1
+        chunks = _search(norm.get("normalized_query", question))
+        context = get_context_from_chunks(chunks) if chunks else ""
+        return "question", context, await generate_answer(norm.get("normalized_query", question), context), 2
+
+    async def combined(question):
+        chunks = _search(question)
+        # Вызов LLM в combined_answer состоялся, если не отсекли маркеры и неуверенный поиск
+        calls = int(classify_by_keywords(question) is None and retrieval_is_confident(chunks))
+        result = await combined_answer(question, chunks)
+        if result is not None:
+            return "question", result["context"], result["answer"], calls, False
+        pred_type, context, answer, fallback_calls = await two_call(question)
+        return pred_type, context, answer, calls + fallback_calls, True
+
+    async def run(item):
+        question, exp_type, _by_course = item
+        started = time.perf_counter()
+        t_type, t_context, t_answer, t_calls = await two_call(question)
+        t_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        c_type, c_context, c_answer, c_calls, fallback = await combined(question)
+        c_seconds = time.perf_counter() - started
+        t_score = c_score = None
+        if t_answer is not None:
+            t_score = (await judge_answer(question, t_context, t_answer, query_type="question")).get("overall_score")
+        if c_answer is not None:
+            c_score = (await judge_answer(question, c_context, c_answer, query_type="question")).get("overall_score")
+        return {
+            "question": question, "expected": exp_type,
+            "two_call": (t_type, t_seconds, t_calls, t_score),
+            "combined": (c_type, c_seconds, c_calls, c_score, fallback),
+        }
+
+    rows = await _gather_bounded(BASKET_TZ, run)
+
+    def summary(mode):
+        seconds = [r[mode][1] for r in rows]
+        calls = sum(r[mode][2] for r in rows)
+        scores = [float(r[mode][3]) for r in rows if r[mode][3] is not None]
+        type_ok = sum(1 for r in rows if r[mode][0] == r["expected"])
+        avg_score = f"{sum(scores) / len(scores):.2f}" if scores else "—"
+        seconds.sort()
+        print(
+            f"  {mode:9} | время ср. {sum(seconds) / len(seconds):5.2f} с, p90 {seconds[int(len(seconds) * 0.9) - 1]:5.2f} с "
+            f"| вызовов LLM {calls:3} | Judge ср. {avg_score} ({len(scores)} ответов) | тип верен {type_ok}/{len(rows)}"
+        )
+
+    print("\nРежим     | время ответа (Блоки 1–3)        | вызовы | качество")
+    summary("two_call")
+    summary("combined")
+    fallbacks = sum(1 for r in rows if r["combined"][4])
+    print(f"  combined: откат к двум вызовам в {fallbacks}/{len(rows)} случаях")
+    for r in rows:
+        t, c = r["two_call"], r["combined"]
+        print(
+            f"  {r['question'][:40]:40} | two_call {t[0]:9} score={t[3]} | "
+            f"combined {c[0]:9} score={c[3]}{' (откат)' if c[4] else ''}"
+        )
+
+
+# ---------- Извлекающий ответ против генерации ----------
+async def evaluate_extractive():
+    """Вопросы-определения из корзинок: лучшие предложения чанков (без LLM) и ответ генерации по тем же чанкам,
+    оба — через Judge. Печатает средний балл каждого пути, долю уверенных извлечений (EXTRACTIVE_MODE=answer
+    отдаёт их без LLM) и средний балл только по ним — по нему подбирается EXTRACTIVE_MIN_SIMILARITY."""
+    import time
+
+    print("\n" + "=" * 60)
+    print("ИЗВЛЕКАЮЩИЙ ОТВЕТ против генерации (--extractive)")
+    print("=" * 60)
+
+    if not _ensure_rag():
+        print("RAG не загружен. Пропуск.")
+        return
+
+    questions = list(dict.fromkeys(
+        [q for q, t, _c in BASKET_TZ if t == "question"] + [q for q, t in BASKET_CLASSIFICATION if t == "question"]
+    ))
+    questions = [q for q in questions if definition_term(q)]
+    if not questions:
+        print("В корзинках нет вопросов-определений. Пропуск.")
+        return
+
+    async def run(question):
+        chunks = _search(question)
+        context = get_context_from_chunks(chunks) if chunks else ""
+        started = time.perf_counter()
+        extract = extract_answer(question, chunks) if chunks else None
+        e_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        generated = await generate_answer(question, context)
+        g_seconds = time.perf_counter() - started
+        e_score = None
+        if extract is not None:
+            e_score = (await judge_answer(question, context, extract["answer"], query_type="question")).get("overall_score")
+        g_score = (await judge_answer(question, context, generated, query_type="question")).get("overall_score")
+        return {
+            "question": question, "extract": extract, "confident": is_confident(extract),
+            "e_score": e_score, "g_score": g_score, "e_seconds": e_seconds, "g_seconds": g_seconds,
+        }
+
+    rows = await _gather_bounded(questions, run)
+
+    def avg(values):
+        values = [float(v) for v in values if v is not None]
+        return f"{sum(values) / len(values):.2f} ({len(values)})" if values else "—"
+
+    confident = [r for r in rows if r["confident"]]
+    print(f"\nВопросов-определений: {len(rows)}, уверенных извлечений: {len(confident)}")
+    print(
+        f"  Judge ср.: извлечение {avg(r['e_score'] for r in rows)}, генерация {avg(r['g_score'] for r in rows)}; "
+        f"только уверенные: извлечение {avg(r['e_score'] for r in confident)}, генерация {avg(r['g_score'] for r in confident)}"
+    )
+    print(
+        f"  Время ср.: извлечение {sum(r['e_seconds'] for r in rows) / len(rows) * 1000:.0f} мс, "
+        f"генерация {sum(r['g_seconds'] for r in rows) / len(rows):.2f} с"
+    )
+    for r in rows:
+        sim = f"{r['extract']['similarity']:.2f}" if r["extract"] else "—"
+        print(
+            f"  {r['question'][:40]:40} | близость {sim} {'уверенно' if r['confident'] else '        '} | "
+            f"извлечение score={r['e_score']} | генерация score={r['g_score']}"
+        )
+
+
 async def main():
     import sys
+    import time
+    global _reindex
     quick = "--quick" in sys.argv
+    _reindex = "--reindex" in sys.argv
+    started = time.perf_counter()
 
     print("Оценка блоков по ТЗ ОбучAI v15 (существующий контекст)")
     print("Курс:", config.COURSE_NAME)
     if quick:
         print("Режим --quick: только Блок 1 и Блок 5 (без RAG/LLM).")
 
+    client = await get_client()
+    # Студентов в этом процессе нет: параллельность задаёт EVAL_CONCURRENCY, без лимитов классов планировщика
+    client.scheduler.set_limits(config.EVAL_CONCURRENCY)
+    cache = None
+    if "--no-cache" not in sys.argv:
+        cache = client.enable_cache(config.LLM_CACHE_PATH)
+        print("Кэш LLM:", cache.path)
+
     b1 = await evaluate_block1()
     b2 = 0.0
     b3 = 0.0
@@ -355,9 +642,15 @@ async def main():
         b3 = await evaluate_block3()
         b4 = await evaluate_block4()
         e2e = await evaluate_e2e()
+        if "--combined" in sys.argv:
+            await evaluate_combined()
+        if "--extractive" in sys.argv:
+            await evaluate_extractive()
 
     b5 = evaluate_block5()
 
+    llm_stats = scheduler_stats()
+    latency_by_prompt = prompt_latency_stats()
     await close_client()
 
     print("\n" + "=" * 60)
@@ -368,6 +661,23 @@ async def main():
     print("  Блок 4 (Judge avg/5):             ", f"{b4:.2f}")
     print("  Блок 5 (CSAT):                    ", f"{b5:.2f}")
     print("  E2E (Judge avg/5):                ", f"{e2e:.2f}")
+    if cache is not None:
+        st = cache.stats()
+        print(f"  Кэш LLM: попаданий {st['hits']}, промахов {st['misses']}")
+    emb = query_embedding_cache_stats()
+    if emb:
+        print(f"  Кэш эмбеддингов запросов: попаданий {emb['hits']}, промахов {emb['misses']}")
+    print(f"  Очередь GigaChat: {format_stats(llm_stats)}")
+    for name, version in prompt_versions().items():
+        lat = latency_by_prompt.get(version)
+        timing = f": вызовов {lat['calls']}, среднее {lat['avg']:.2f} с" if lat else ""
+        print(f"  Промпт {name} {version}{timing}")
+    for name, st in parse_stats().items():
+        print(
+            f"  Разбор JSON {name}: целиком {st['ok']}, из текста {st['extracted']}, "
+            f"после ремонта {st['repaired']}, не разобрано {st['failed']}"
+        )
+    print(f"  Время прогона: {time.perf_counter() - started:.1f} с")
     print("=" * 60)
 
 
@@ -0,0 +1,165 @@
+"""Извлекающий ответ без LLM: лучшие предложения найденных чанков по близости эмбеддингов к вопросу.
+
+Вопросы «что такое X» обычно закрывает одно предложение учебника, которое уже есть в top-чанке.
+Кандидаты — предложения и пункты списков из EXTRACTIVE_TOP_CHUNKS лучших чанков (chunker.split_units);
+балл — косинус вектора предложения с вектором вопроса (та же модель, что у поиска), плюс надбавки,
+если в предложении есть все леммы термина X и оно похоже на определение («X — это …», «называется»),
+минус штраф за место чанка в выдаче. Ответ — до EXTRACTIVE_MAX_SENTENCES предложений не хуже лучшего
+на EXTRACTIVE_MARGIN, с источниками.
+
+Где используется (bot.py, EXTRACTIVE_MODE): preview — для вопросов-определений первым сообщением,
+пока готовится ответ LLM; answer — вместо LLM, если ответ уверенный (is_confident), иначе как preview;
+а также в деградированном режиме (GigaChat недоступен). Сравнение оценок Judge с генерацией —
+evaluate_blocks.py --extractive. Векторы предложений кэшируются (LRU на EXTRACTIVE_CACHE_SIZE)."""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+import config
+from block2_rag import _get_embeddings, embed_query
+from chunker import SENTENCE_RE, split_units
+from lexical import lemma_set, query_lemmas
+
+# Метка ответа в логах (answer_prompt_version в judge_log, feedback_log) вместо версии промпта генерации
+EXTRACTIVE_VERSION = "extractive"
+
+DEFINITION_RE = re.compile(
+    r"^\s*(?:что\s+(?:такое|это\s+за|значит|означает|называ\w+|понима\w+\s+под|подразумева\w+\s+под)"
+    r"|кто\s+так(?:ой|ая|ое|ие)|(?:дай(?:те)?\s+)?определение|объясни(?:те)?,?\s+что\s+такое)\s+"
+    r"(?P<term>[^?!.]+?)\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+DEFINITION_TAIL_RE = re.compile(r"^\s*(?P<term>[^?!.]+?)\s*(?:[—–-]\s*)?это\s+что\s*[?!.]*\s*$", re.IGNORECASE)
+# Продолжение вопроса после термина: «что такое ESG и как это связано с компанией» → термин «ESG»
+TERM_TAIL_RE = re.compile(r",|\s+и\s+(?:как|зачем|почему|что|где|когда|чем)\b", re.IGNORECASE)
+# Предложение похоже на определение: «X — это …», «называется», «понимается под», «представляет собой»
+DEFINITION_CUE_RE = re.compile(
+    r"\s[—–-]\s|\bэто\b|\bназыва\w+|\bпонима\w+|\bпредставля\w+\s+собой|\bозначает|\bявля\w+", re.IGNORECASE
+)
+
+MIN_SENTENCE_CHARS = 25
+MAX_SENTENCE_CHARS = 500
+TERM_BONUS = 0.1
+CUE_BONUS = 0.05
+RANK_PENALTY = 0.02
+
+_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_vectors_lock = threading.Lock()
+
+
+def definition_term(question: str) -> Optional[str]:
+    """Термин X из вопроса-определения («что такое X», «X — это что?»); None — вопрос не про определение."""
+    for pattern in (DEFINITION_RE, DEFINITION_TAIL_RE):
+        match = pattern.match(question or "")
+        if match:
+            term = TERM_TAIL_RE.split(match.group("term"), 1)[0].strip(" «»\"'")
+            if term:
+                return term
+    return None
+
+
+def _candidates(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Предложения и пункты списков из лучших чанков с источником, местом чанка и заголовком раздела."""
+    candidates, seen = [], set()
+    for rank, chunk in enumerate(chunks[: config.EXTRACTIVE_TOP_CHUNKS]):
+        source = chunk.get("metadata", {}).get("source", "материалы курса")
+        heading = chunk.get("metadata", {}).get("heading", "")
+        for kind, text in split_units(chunk["content"]):
+            if kind == "heading":
+                heading = text
+                continue
+            for sentence in (SENTENCE_RE.split(text) if kind == "para" else [text]):
+                sentence = sentence.strip()
+                if not MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS or sentence in seen:
+                    continue
+                seen.add(sentence)
+                candidates.append({
+                    "text": sentence, "source": source, "heading": heading, "rank": rank, "position": len(candidates),
+                })
+    return candidates
+
+
+def _sentence_vectors(sentences: List[str]) -> np.ndarray:
+    """Нормированные векторы предложений; новые считаются одной пачкой и кэшируются."""
+    with _vectors_lock:
+        missing = [s for s in sentences if s not in _vectors]
+    computed: Dict[str, np.ndarray] = {}
+    if missing:
+        fresh = np.asarray(_get_embeddings().embed_documents(missing), dtype=np.float32)
+        fresh /= np.clip(np.linalg.norm(fresh, axis=1, keepdims=True), 1e-9, None)
+        computed = dict(zip(missing, fresh))
+    with _vectors_lock:
+        _vectors.update(computed)
+        result = []
+        for sentence in sentences:
+            vector = computed.get(sentence)
+            if vector is None:
+                vector = _vectors[sentence]
+                _vectors.move_to_end(sentence)
+            result.append(vector)
+        while len(_vectors) > config.EXTRACTIVE_CACHE_SIZE:
+            _vectors.popitem(last=False)
+    return np.stack(result)
+
+
+def extract_answer(question: str, chunks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Лучшие предложения из найденных чанков для вопроса.
+
+    Returns:
+        None — в чанках нет подходящих предложений; иначе
+        {"answer": текст с источниками, "sentences": [...], "sources": [...], "similarity": косинус лучшего,
+         "score": его балл с надбавками, "term": термин вопроса-определения или None, "term_found": bool}
+    """
+    candidates = _candidates(chunks)
+    if not candidates:
+        return None
+    term = definition_term(question)
+    term_lemmas = set(query_lemmas(term)) if term else set()
+
+    query_vector = np.asarray(embed_query(question), dtype=np.float32)
+    query_vector /= max(float(np.linalg.norm(query_vector)), 1e-9)
+    similarities = _sentence_vectors([c["text"] for c in candidates]) @ query_vector
+
+    for candidate, similarity in zip(candidates, similarities):
+        has_term = bool(term_lemmas) and term_lemmas <= lemma_set(f"{candidate['heading']} {candidate['text']}")
+        score = float(similarity) - RANK_PENALTY * candidate["rank"]
+        if has_term:
+            score += TERM_BONUS
+            if DEFINITION_CUE_RE.search(candidate["text"]):
+                score += CUE_BONUS
+        candidate.update(similarity=float(similarity), score=score, has_term=has_term)
+
+    ranked = sorted(candidates, key=lambda c: c["score"], reverse=True)
+    best = ranked[0]
+    chosen = [c for c in ranked[: config.EXTRACTIVE_MAX_SENTENCES] if c["score"] >= best["score"] - config.EXTRACTIVE_MARGIN]
+    chosen.sort(key=lambda c: (c["rank"], c["position"]))
+    sources = list(dict.fromkeys(c["source"] for c in chosen))
+    return {
+        "answer": format_answer(chosen),
+        "sentences": [c["text"] for c in chosen],
+        "sources": sources,
+        "similarity": best["similarity"],
+        "score": best["score"],
+        "term": term,
+        "term_found": best["has_term"],
+    }
+
+
+def format_answer(chosen: List[Dict[str, Any]]) -> str:
+    """Предложения, сгруппированные по источнику, со ссылкой на источник после каждой группы."""
+    groups: "OrderedDict[str, List[str]]" = OrderedDict()
+    for candidate in chosen:
+        groups.setdefault(candidate["source"], []).append(candidate["text"])
+    return "\n\n".join(f"{' '.join(sentences)}\n📄 {source}" for source, sentences in groups.items())
+
+
+def is_confident(result: Optional[Dict[str, Any]]) -> bool:
+    """Ответ можно отдать без LLM: близость не ниже EXTRACTIVE_MIN_SIMILARITY, а для вопроса-определения
+    лучшее предложение ещё и содержит термин."""
+    if not result:
+        return False
+    if result["term"] and not result["term_found"]:
+        return False
+    return result["similarity"] >= config.EXTRACTIVE_MIN_SIMILARITY
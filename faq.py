@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""Готовые ответы на частые вопросы (FAQ), собранные из feedback_log.json.
+
+Сборка (офлайн, python faq.py или фоновый поток бота при FAQ_REBUILD_INTERVAL > 0): оценённые вопросы
+курса эмбеддятся той же моделью, что и поиск, и жадно группируются: вопрос попадает в ближайший кластер,
+если косинус с его центром не ниже FAQ_CLUSTER_THRESHOLD, иначе открывает новый. Для кластера, где
+«Полезно» нажимали не меньше FAQ_MIN_HELPFUL раз и доля «Полезно» не ниже FAQ_MIN_HELPFUL_SHARE, выбирается
+лучший ответ: отмеченный «Полезно», не «bad» у Judge и с баллом не ниже FAQ_MIN_JUDGE_SCORE (если оценка
+есть); среди них — тот же текст, чаще отмеченный «Полезно», затем больший балл Judge, затем более свежий.
+
+Сборка инкрементальная: в файле хранятся кластеры с участниками и уже учтённые оценки (request_id → rating),
+эмбеддятся только новые вопросы, изменённые оценки обновляются на месте. Выбор ответов пересчитывается
+для всех кластеров (без LLM и эмбеддингов). Каждая запись файла — новая версия (version), ответы из FAQ
+логируются с prompt_version «faq-v<версия>».
+
+Инвалидация: запись ответа в feedback_log хранит файлы материалов, из которых взяты чанки, с их хэшами из
+манифеста индекса (sources). Ответ FAQ действителен, пока хэши этих файлов в манифесте не изменились:
+поиск (faq_lookup) перепроверяет это при каждой смене манифеста, сборка выбирает другой ответ кластера.
+Файлы сравниваются целиком — правка любого раздела файла снимает ответы, опирающиеся на этот файл.
+
+Файл FAQ — faq.json рядом с манифестом индекса курса (vector_db), запись атомарная.
+
+Запуск:
+  python faq.py                  # все курсы, инкрементально
+  python faq.py --course finance --full
+  python faq.py --watch 600      # пересборка раз в 10 минут, если появились новые оценки
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import config
+from block2_rag import MANIFEST_FILE, _embedding_backend, _get_embeddings, _process_lock, embed_query
+from block5_feedback import FEEDBACK_LOG_FILE, JUDGE_LOG_FILE, _load_feedback_log
+from courses import default_course_id, get_course, list_courses
+
+logger = logging.getLogger(__name__)
+
+FAQ_FILE = "faq.json"
+# Метка ответа из FAQ в логах (prompt_version): faq-v<версия файла FAQ>
+FAQ_VERSION_PREFIX = "faq-v"
+# Ответы без опоры на материалы в FAQ не попадают: фрагменты при недоступном GigaChat
+EXCLUDED_PROMPT_VERSIONS = ("degraded",)
+RATINGS = ("helpful", "not_helpful")
+
+
+def _faq_path(course_id: str) -> str:
+    return os.path.join(get_course(course_id)["vector_db_path"], FAQ_FILE)
+
+
+def _manifest_files(course_id: str) -> Dict[str, str]:
+    """Хэши файлов материалов из манифеста индекса курса ({} — индекс ещё не собирался)."""
+    try:
+        with open(os.path.join(get_course(course_id)["vector_db_path"], MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def answer_sources(chunks: List[Dict[str, Any]], course_id: str) -> Dict[str, str]:
+    """Файлы материалов, из которых взяты чанки ответа, с хэшами из манифеста — для записи в feedback_log."""
+    files = _manifest_files(course_id)
+    sources = {}
+    for chunk in chunks or []:
+        source = chunk.get("metadata", {}).get("source")
+        if source and source in files:
+            sources[source] = files[source]
+    return sources
+
+
+def _is_current(sources: Dict[str, str], files: Dict[str, str]) -> bool:
+    """Все файлы ответа есть в манифесте с теми же хэшами."""
+    return bool(sources) and all(files.get(rel) == digest for rel, digest in sources.items())
+
+
+def _embedding_key() -> str:
+    return f"{config.EMBEDDING_MODEL}|{_embedding_backend()}"
+
+
+def _settings() -> Dict[str, Any]:
+    """Параметры кластеризации: при их смене (или смене модели эмбеддингов) FAQ собирается заново."""
+    return {"embedding": _embedding_key(), "cluster_threshold": config.FAQ_CLUSTER_THRESHOLD}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-9, None)
+
+
+def read_faq(course_id: str = None) -> Dict[str, Any]:
+    """Файл FAQ курса ({} — ещё не собирался)."""
+    try:
+        with open(_faq_path(course_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_faq(course_id: str, faq: Dict[str, Any]) -> None:
+    path = _faq_path(course_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(faq, f, ensure_ascii=False)
+    os.replace(tmp, path)  # атомарно: бот видит старую или новую версию целиком
+
+
+# ---------- Сборка ----------
+
+def _judge_verdicts() -> Dict[str, Dict[str, Any]]:
+    """Последняя оценка Judge по request_id из judge_log.json (оценки после «Не помогло» и выборочные)."""
+    try:
+        with open(JUDGE_LOG_FILE, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    verdicts = {}
+    for entry in logs if isinstance(logs, list) else []:
+        if entry.get("request_id") and isinstance(entry.get("judge_verdict"), dict):
+            verdicts[entry["request_id"]] = entry["judge_verdict"]
+    return verdicts
+
+
+def _member(entry: Dict[str, Any], verdict: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    verdict = verdict or entry.get("judge_verdict") or {}
+    score = verdict.get("overall_score")
+    return {
+        "request_id": entry["request_id"],
+        "question": entry.get("question", ""),
+        "answer": entry.get("answer", ""),
+        "rating": entry["rating"],
+        "prompt_version": entry.get("prompt_version"),
+        "judge_score": float(score) if isinstance(score, (int, float)) else None,
+        "judge_verdict": verdict.get("verdict"),
+        "sources": entry.get("sources") or {},
+        "timestamp": entry.get("feedback_at") or entry.get("timestamp", ""),
+    }
+
+
+def _rated_entries(course_id: str) -> List[Dict[str, Any]]:
+    """Оценённые ответы на вопросы курса (записи без course — курс по умолчанию, как до нескольких курсов)."""
+    default = default_course_id()
+    return [
+        e for e in _load_feedback_log()
+        if e.get("request_id") and e.get("rating") in RATINGS and e.get("query_type") == "question"
+        and (e.get("course") or default) == course_id and e.get("question") and e.get("answer")
+    ]
+
+
+def _select_answer(cluster: Dict[str, Any], files: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Лучший действительный ответ кластера или None (мало «Полезно», много «Не помогло», все ответы устарели)."""
+    members = cluster["members"]
+    helpful = [m for m in members if m["rating"] == "helpful"]
+    if len(helpful) < config.FAQ_MIN_HELPFUL or len(helpful) < config.FAQ_MIN_HELPFUL_SHARE * len(members):
+        return None
+    votes: Dict[str, int] = {}
+    for m in helpful:
+        votes[m["answer"]] = votes.get(m["answer"], 0) + 1
+    candidates = [
+        m for m in helpful
+        if m["prompt_version"] not in EXCLUDED_PROMPT_VERSIONS
+        and m["judge_verdict"] != "bad"
+        and (m["judge_score"] is None or m["judge_score"] >= config.FAQ_MIN_JUDGE_SCORE)
+        and _is_current(m["sources"], files)
+    ]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda m: (votes[m["answer"]], m["judge_score"] or 0.0, m["timestamp"]))
+    return {
+        "question": best["question"],
+        "answer": best["answer"],
+        "request_id": best["request_id"],
+        "sources": best["sources"],
+        "judge_score": best["judge_score"],
+        "helpful": len(helpful),
+        "not_helpful": len(members) - len(helpful),
+    }
+
+
+def rebuild_faq(course_id: str = None, full: bool = False) -> Dict[str, Any]:
+    """
+    Инкрементальная пересборка FAQ курса по feedback_log.json.
+
+    full=True (или смена модели эмбеддингов / порога кластеризации) — собрать кластеры заново.
+
+    Returns:
+        {"course", "new": N, "updated": N, "clusters": N, "entries": N, "version": N, "seconds": t, "skipped": bool}
+    """
+    started = time.perf_counter()
+    course_id = get_course(course_id)["id"]
+    path = _faq_path(course_id)
+    with _process_lock(os.path.join(os.path.dirname(path), ".faq.lock")):
+        faq = read_faq(course_id)
+        if full or faq.get("settings") != _settings():
+            faq = {}
+        clusters = faq.get("clusters", [])
+        processed = faq.get("processed", {})
+        files = _manifest_files(course_id)
+
+        by_request = {m["request_id"]: m for c in clusters for m in c["members"]}
+        verdicts = _judge_verdicts()
+        fresh, updated = [], 0
+        for entry in _rated_entries(course_id):
+            rid = entry["request_id"]
+            if processed.get(rid) == entry["rating"]:
+                continue
+            member = _member(entry, verdicts.get(rid))
+            if rid in by_request:
+                by_request[rid].update(member)  # студент переоценил ответ или пришла оценка Judge
+                updated += 1
+            else:
+                fresh.append(member)
+            processed[rid] = entry["rating"]
+
+        result = {"course": course_id, "new": len(fresh), "updated": updated}
+        if faq and not fresh and not updated and faq.get("manifest_files") == files:
+            entries = sum(1 for c in clusters if c.get("entry"))
+            result.update(
+                clusters=len(clusters), entries=entries, version=faq.get("version", 0),
+                seconds=time.perf_counter() - started, skipped=True,
+            )
+            return result
+
+        if fresh:
+            vectors = _normalize(np.asarray(
+                _get_embeddings().embed_documents([m["question"] for m in fresh]), dtype=np.float32
+            ))
+            sums = [np.asarray(c["vector"], dtype=np.float32) for c in clusters]
+            for member, vector in zip(fresh, vectors):
+                best, similarity = None, -1.0
+                if sums:
+                    similarities = _normalize(np.stack(sums)) @ vector
+                    best = int(np.argmax(similarities))
+                    similarity = float(similarities[best])
+                if best is not None and similarity >= config.FAQ_CLUSTER_THRESHOLD:
+                    sums[best] = sums[best] + vector
+                    clusters[best]["members"].append(member)
+                else:
+                    sums.append(vector.copy())
+                    clusters.append({"id": f"c{len(clusters) + 1}", "members": [member]})
+            for cluster, vector_sum in zip(clusters, sums):
+                # Центр кластера — сумма нормированных векторов вопросов: новые вопросы просто добавляются
+                cluster["vector"] = [round(float(x), 6) for x in vector_sum]
+
+        for cluster in clusters:
+            cluster["entry"] = _select_answer(cluster, files)
+
+        version = faq.get("version", 0) + 1
+        entries = sum(1 for c in clusters if c["entry"])
+        _write_faq(course_id, {
+            "version": version,
+            "course": course_id,
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+            "settings": _settings(),
+            "manifest_files": files,
+            "processed": processed,
+            "clusters": clusters,
+        })
+    result.update(
+        clusters=len(clusters), entries=entries, version=version, seconds=time.perf_counter() - started, skipped=False,
+    )
+    logger.info(
+        "FAQ [%s] v%d: новых оценок %d, изменённых %d; кластеров %d, ответов %d за %.1f с",
+        course_id, version, result["new"], updated, len(clusters), entries, result["seconds"],
+    )
+    return result
+
+
+def watch_feedback(interval: float = None, stop: threading.Event = None) -> None:
+    """Пересборка FAQ всех курсов раз в interval секунд (FAQ_REBUILD_INTERVAL), если feedback_log.json
+    изменился. Блокирующий цикл — запускать в отдельном потоке."""
+    interval = interval or config.FAQ_REBUILD_INTERVAL
+    stop = stop or threading.Event()
+    last_mtime = None
+    while not stop.wait(interval):
+        try:
+            mtime = os.stat(FEEDBACK_LOG_FILE).st_mtime_ns
+        except OSError:
+            continue
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        for course in list_courses():
+            try:
+                rebuild_faq(course["id"])
+            except Exception as e:
+                logger.error("Ошибка пересборки FAQ %s: %s", course["id"], e, exc_info=True)
+
+
+# ---------- Поиск ----------
+
+class FaqStore:
+    """Ответы FAQ курса в памяти: перечитываются при смене файла FAQ, действительность ответов —
+    при смене манифеста индекса (один stat() каждого файла на запрос)."""
+
+    def __init__(self, course_id: str):
+        self.course_id = course_id
+        self.path = _faq_path(course_id)
+        self.manifest_path = os.path.join(get_course(course_id)["vector_db_path"], MANIFEST_FILE)
+        self.version = 0
+        self.entries: List[Dict[str, Any]] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.valid = np.zeros(0, dtype=bool)
+        self._mtimes = (None, None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh(self) -> None:
+        mtimes = (self._mtime(self.path), self._mtime(self.manifest_path))
+        if mtimes == self._mtimes:
+            return
+        with self._lock:
+            if mtimes == self._mtimes:
+                return
+            if mtimes[0] != self._mtimes[0]:
+                faq = read_faq(self.course_id)
+                clusters = [c for c in faq.get("clusters", []) if c.get("entry")]
+                if faq and faq.get("settings", {}).get("embedding") != _embedding_key():
+                    logger.warning("FAQ курса %s собран другой моделью эмбеддингов — не используется", self.course_id)
+                    clusters = []
+                self.entries = [c["entry"] for c in clusters]
+                self.vectors = (
+                    _normalize(np.asarray([c["vector"] for c in clusters], dtype=np.float32))
+                    if clusters else np.zeros((0, 0), dtype=np.float32)
+                )
+                self.version = faq.get("version", 0)
+            files = _manifest_files(self.course_id)
+            self.valid = np.asarray([_is_current(e["sources"], files) for e in self.entries], dtype=bool)
+            self._mtimes = mtimes
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """Ответ FAQ для вопроса: ближайший кластер с действительным ответом, если косинус не ниже
+        FAQ_MATCH_THRESHOLD. Returns: запись FAQ + {"similarity", "prompt_version"} или None."""
+        self._refresh()
+        entries, vectors, valid, version = self.entries, self.vectors, self.valid, self.version
+        if not valid.any():
+            return None
+        query = _normalize(np.asarray(embed_query(question), dtype=np.float32))
+        similarities = np.where(valid, vectors @ query, -1.0)
+        best = int(np.argmax(similarities))
+        if similarities[best] < config.FAQ_MATCH_THRESHOLD:
+            return None
+        return {**entries[best], "similarity": float(similarities[best]), "prompt_version": f"{FAQ_VERSION_PREFIX}{version}"}
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        return {"version": self.version, "entries": len(self.entries), "valid": int(self.valid.sum())}
+
+
+_stores: Dict[str, FaqStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_faq_store(course_id: str = None) -> FaqStore:
+    course_id = get_course(course_id)["id"]
+    with _stores_lock:
+        store = _stores.get(course_id)
+        if store is None:
+            store = _stores[course_id] = FaqStore(course_id)
+    return store
+
+
+def faq_lookup(question: str, course_id: str = None) -> Optional[Dict[str, Any]]:
+    return get_faq_store(course_id).lookup(question)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Сборка FAQ из оценённых ответов (feedback_log.json)")
+    parser.add_argument("--course", help="id курса (по умолчанию — все курсы)")
+    parser.add_argument("--full", action="store_true", help="Собрать кластеры заново, а не дополнить")
+    parser.add_argument("--watch", type=float, default=0, help="Пересобирать раз в N с при новых оценках")
+    args = parser.parse_args()
+    if args.watch:
+        watch_feedback(args.watch)
+        return
+    course_ids = [args.course] if args.course else [c["id"] for c in list_courses()]
+    for course_id in course_ids:
+        r = rebuild_faq(course_id, full=args.full)
+        status = "без изменений" if r["skipped"] else f"новых оценок {r['new']}, изменённых {r['updated']}"
+        print(f"FAQ [{r['course']}] v{r['version']}: {status}; кластеров {r['clusters']}, ответов {r['entries']}")
+
+
+if __name__ == "__main__":
+    main()
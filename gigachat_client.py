@@ -1,13 +1,100 @@
 """Универсальный клиент для работы с GigaChat API"""
 import aiohttp
+import asyncio
+import hashlib
 import json
 import logging
+import time
 import uuid
 from typing import Optional, List, Dict, Any
-from config import GIGACHAT_AUTH_KEY
+from config import (
+    GIGACHAT_API_URL,
+    GIGACHAT_AUTH_KEY,
+    GIGACHAT_AUTH_URL,
+    GIGACHAT_BREAKER_FAILURES,
+    GIGACHAT_BREAKER_OPEN_SECONDS,
+    GIGACHAT_MODEL,
+    GIGACHAT_SESSION_CACHE,
+    GIGACHAT_THROTTLE_COOLDOWN,
+    GIGACHAT_TIMEOUT,
+)
+from llm_cache import LLMCache, make_key
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
+BREAKER_CLOSED = "closed"        # запросы идут как обычно
+BREAKER_OPEN = "open"            # GigaChat считается недоступным, запросы не отправляются
+BREAKER_HALF_OPEN = "half_open"  # пауза истекла: пропускается один пробный запрос
+
+
+def session_id(prompt_version: str, system_prompt: str) -> str:
+    """X-Session-ID стабильного префикса: версия промпта (id и хэш шаблона) + хэш системного текста с курсом."""
+    digest = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:12]
+    return f"prompt-{prompt_version}-{digest}"
+
+
+class GigaChatUnavailable(Exception):
+    """GigaChat не ответил (таймаут, сеть, 5xx) или выключатель разомкнут: отвечать надо без LLM."""
+
+
+class CircuitBreaker:
+    """Автоматический выключатель: после max_failures отказов подряд размыкается на open_seconds,
+    затем пропускает один пробный запрос — успех замыкает, отказ снова размыкает.
+    Отказ — таймаут, сетевая ошибка или 5xx; успех — только ответ 2xx на chat/completions. Ответы OAuth и 4xx
+    (401/403 авторизации, 429, ошибка запроса) нейтральны: о работе генерации они ничего не говорят,
+    поэтому не замыкают полуоткрытый выключатель (пробу сделает следующий запрос) и не сбрасывают счётчик отказов."""
+
+    def __init__(self, max_failures: int = None, open_seconds: float = None):
+        self.max_failures = max(GIGACHAT_BREAKER_FAILURES if max_failures is None else max_failures, 1)
+        self.open_seconds = GIGACHAT_BREAKER_OPEN_SECONDS if open_seconds is None else open_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False  # пробный запрос полуоткрытого состояния уже отправлен
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return BREAKER_CLOSED
+        if time.monotonic() - self.opened_at < self.open_seconds:
+            return BREAKER_OPEN
+        return BREAKER_HALF_OPEN
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас (в полуоткрытом состоянии — только один)."""
+        state = self.state
+        if state == BREAKER_CLOSED or (state == BREAKER_HALF_OPEN and not self._probe):
+            self._probe = state == BREAKER_HALF_OPEN
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self) -> None:
+        """Запрос завершился без вердикта (отмена, ошибка до ответа) — пробу может сделать следующий."""
+        self._probe = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("GigaChat снова отвечает — выключатель замкнут")
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe or (self.opened_at is None and self.failures >= self.max_failures):
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            logger.warning(
+                "GigaChat: %d отказов подряд — выключатель разомкнут на %.0f с", self.failures, self.open_seconds
+            )
+        self._probe = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected}
+
 
 class GigaChatClient:
     """Клиент для работы с GigaChat API"""
@@ -16,6 +103,48 @@ class GigaChatClient:
         self.auth_key = GIGACHAT_AUTH_KEY
         self.access_token = None
         self.session = None
+        self.model = GIGACHAT_MODEL
+        # Опциональный дисковый кэш ответов (включается для оценки, см. evaluate_blocks.py)
+        self.cache: Optional[LLMCache] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Очередь с приоритетами: запрос к API занимает слот своего класса
+        self.scheduler = LLMScheduler()
+        # До этого момента (time.monotonic) GigaChat нас ограничивает (HTTP 429)
+        self.throttled_until = 0.0
+        # Скользящее среднее времени ответа API, с (None — ещё не было успешных запросов)
+        self.latency_ewma: Optional[float] = None
+        # Время ответа по версиям промптов (prompts.py): версия → [запросов, сумма секунд]
+        self.prompt_latency: Dict[str, List[float]] = {}
+        # Отказы подряд → запросы не отправляются, бот отвечает в деградированном режиме
+        self.breaker = CircuitBreaker()
+        self.timeout = aiohttp.ClientTimeout(total=GIGACHAT_TIMEOUT)
+
+    def is_throttled(self) -> bool:
+        """True, если недавно получили 429 и пауза из Retry-After ещё не истекла."""
+        return time.monotonic() < self.throttled_until
+
+    def _record_latency(self, seconds: float, alpha: float = 0.2) -> None:
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += alpha * (seconds - self.latency_ewma)
+
+    def _record_prompt_latency(self, prompt_version: Optional[str], seconds: float) -> None:
+        if prompt_version:
+            entry = self.prompt_latency.setdefault(prompt_version, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def _unavailable(self, reason: str) -> GigaChatUnavailable:
+        """Отказ сервиса: учитывается выключателем, вызывающему — GigaChatUnavailable."""
+        self.breaker.record_failure()
+        logger.error("GigaChat недоступен: %s", reason)
+        return GigaChatUnavailable(reason)
+
+    def enable_cache(self, path: str) -> LLMCache:
+        """Включает дисковый кэш ответов LLM по ключу (промпт, модель, параметры)."""
+        self.cache = LLMCache(path)
+        return self.cache
     
     async def _ensure_session(self):
         """Создает сессию если её нет"""
@@ -46,11 +175,14 @@ class GigaChatClient:
             data = {'scope': 'GIGACHAT_API_PERS'}
             
             async with self.session.post(
-                'https://ngw.devices.sberbank.ru:9443/api/v2/oauth',
+                GIGACHAT_AUTH_URL,
                 headers=headers,
                 data=data,
-                ssl=False
+                ssl=False,
+                timeout=self.timeout,
             ) as response:
+                if response.status >= 500:
+                    raise self._unavailable(f"OAuth {response.status}")
                 if response.status == 200:
                     result = await response.json()
                     self.access_token = result.get('access_token')
@@ -60,7 +192,9 @@ class GigaChatClient:
                     error_text = await response.text()
                     logger.error(f"Ошибка получения токена: {response.status} - {error_text}")
                     raise Exception(f"Не удалось получить Access token: {response.status}")
-                    
+
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            raise self._unavailable(f"OAuth: {e!r}") from e
         except Exception as e:
             logger.error(f"Ошибка при получении Access token: {e}")
             raise
@@ -70,9 +204,11 @@ class GigaChatClient:
         messages: List[Dict[str, str]], 
         max_tokens: int = 500, 
         temperature: float = 0.7,
-        response_format: Optional[str] = None
+        response_format: Optional[str] = None,
+        prompt_version: Optional[str] = None,
+        reauthorized: bool = False,
     ) -> str:
-        """Выполнение запроса к GigaChat API"""
+        """Выполнение запроса к GigaChat API (при 401 — новый токен и один повтор)"""
         await self._ensure_session()
         
         if not self.access_token:
@@ -84,9 +220,14 @@ class GigaChatClient:
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json'
             }
+            # Общий X-Session-ID у запросов с одним системным промптом: GigaChat может переиспользовать
+            # обработанный префикс. Сессия — по версии промпта и самому системному тексту (в нём курс),
+            # а не одна на процесс: запросы разных курсов и промптов не выглядят одним диалогом
+            if prompt_version and GIGACHAT_SESSION_CACHE:
+                headers['X-Session-ID'] = session_id(prompt_version, messages[0]["content"])
             
             data = {
-                "model": "GigaChat:latest",
+                "model": self.model,
                 "messages": messages,
                 "max_tokens": max_tokens,
                 "temperature": temperature
@@ -96,26 +237,45 @@ class GigaChatClient:
             if response_format == "json_object":
                 data["response_format"] = {"type": "json_object"}
             
+            started = time.monotonic()
             async with self.session.post(
-                'https://gigachat.devices.sberbank.ru/api/v1/chat/completions',
+                f"{GIGACHAT_API_URL}/chat/completions",
                 headers=headers,
                 json=data,
-                ssl=False
+                ssl=False,
+                timeout=self.timeout,
             ) as response:
+                if response.status >= 500:
+                    raise self._unavailable(f"GigaChat API error: {response.status}")
                 if response.status == 200:
                     result = await response.json()
+                    self.breaker.record_success()
+                    self._record_latency(time.monotonic() - started)
+                    self._record_prompt_latency(prompt_version, time.monotonic() - started)
                     return result["choices"][0]["message"]["content"]
-                elif response.status == 401:
+                elif response.status == 401 and not reauthorized:
                     # Токен истек, получаем новый
                     logger.info("Токен истек, получаем новый")
                     await self._get_access_token()
                     # Повторяем запрос с новым токеном
-                    return await self._make_request(messages, max_tokens, temperature, response_format)
+                    return await self._make_request(
+                        messages, max_tokens, temperature, response_format, prompt_version, reauthorized=True
+                    )
+                elif response.status == 429:
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", GIGACHAT_THROTTLE_COOLDOWN))
+                    except ValueError:
+                        retry_after = GIGACHAT_THROTTLE_COOLDOWN
+                    self.throttled_until = time.monotonic() + retry_after
+                    logger.warning("GigaChat ограничивает частоту запросов (429), пауза %.0f с", retry_after)
+                    raise Exception("GigaChat API error: 429")
                 else:
                     error_text = await response.text()
                     logger.error(f"GigaChat API error: {response.status} - {error_text}")
                     raise Exception(f"GigaChat API error: {response.status}")
-                    
+
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            raise self._unavailable(f"нет ответа за {GIGACHAT_TIMEOUT:g} с или ошибка сети: {e!r}") from e
         except Exception as e:
             logger.error(f"Error in GigaChat API: {e}")
             raise
@@ -126,7 +286,9 @@ class GigaChatClient:
         user_message: str,
         max_tokens: int = 500,
         temperature: float = 0.7,
-        response_format: Optional[str] = None
+        response_format: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        prompt_version: Optional[str] = None,
     ) -> str:
         """
         Универсальный метод для запросов к GigaChat
@@ -137,16 +299,77 @@ class GigaChatClient:
             max_tokens: Максимальное количество токенов
             temperature: Температура (0.0-1.0)
             response_format: Формат ответа ("json_object" для JSON)
+            priority: класс приоритета в планировщике (llm_scheduler: interactive, judge)
+            prompt_version: версия промпта из prompts.py — заголовок сессии и время ответа по версиям
             
         Returns:
             Ответ от GigaChat
+
+        Raises:
+            GigaChatUnavailable: выключатель разомкнут (сразу, без ожидания в очереди) или GigaChat не ответил
         """
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message}
         ]
-        
-        return await self._make_request(messages, max_tokens, temperature, response_format)
+
+        if self.cache is None:
+            self._reject_if_open()
+            async with self.scheduler.slot(priority):
+                return await self._guarded_request(messages, max_tokens, temperature, response_format, prompt_version)
+
+        params = {"max_tokens": max_tokens, "temperature": temperature, "response_format": response_format}
+        key = make_key(self.model, system_prompt, user_message, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Одинаковые запросы, пришедшие параллельно, ждут один и тот же вызов API
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # отменили самого ожидающего
+                # отменили задачу, которая делала запрос, — запрашиваем сами
+
+        self._reject_if_open()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            async with self.scheduler.slot(priority):
+                response = await self._guarded_request(messages, max_tokens, temperature, response_format, prompt_version)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # помечаем как прочитанное, если ожидающих нет
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            self._inflight.pop(key, None)
+            # CancelledError/KeyboardInterrupt не ловятся выше: будим ожидающих отменой future
+            if not future.done():
+                future.cancel()
+        self.cache.set(key, response, meta={"model": self.model, "params": params})
+        return response
+
+    def _reject_if_open(self) -> None:
+        """Выключатель разомкнут — отказ сразу, не занимая очередь."""
+        if self.breaker.state == BREAKER_OPEN:
+            self.breaker.rejected += 1
+            raise GigaChatUnavailable("GigaChat недоступен (выключатель разомкнут)")
+
+    async def _guarded_request(self, *args) -> str:
+        """Запрос через выключатель: проверка повторяется после ожидания слота — за это время он мог разомкнуться."""
+        probe = self.breaker.state == BREAKER_HALF_OPEN
+        if not self.breaker.allow():
+            raise GigaChatUnavailable("GigaChat недоступен (выключатель разомкнут)")
+        try:
+            return await self._make_request(*args)
+        finally:
+            if probe:
+                self.breaker.release()
 
 
 # Глобальный экземпляр клиента
@@ -161,6 +384,41 @@ async def get_client() -> GigaChatClient:
     return _client_instance
 
 
+def is_throttled() -> bool:
+    """Ограничивает ли GigaChat нас сейчас (для решения, выполнять ли фоновую работу вроде Judge)."""
+    return _client_instance is not None and _client_instance.is_throttled()
+
+
+def latency_ewma() -> Optional[float]:
+    """Скользящее среднее времени ответа GigaChat, с (для контроля допуска нагрузки в боте)."""
+    return _client_instance.latency_ewma if _client_instance is not None else None
+
+
+def llm_available() -> bool:
+    """False, пока выключатель разомкнут: GigaChat недавно не отвечал, бот работает без LLM."""
+    return _client_instance is None or _client_instance.breaker.state != BREAKER_OPEN
+
+
+def breaker_stats() -> Optional[Dict[str, Any]]:
+    """Состояние выключателя: state, failures (отказов подряд), trips (размыканий), rejected (отклонено запросов)."""
+    return _client_instance.breaker.stats() if _client_instance is not None else None
+
+
+def prompt_latency_stats() -> Dict[str, Dict[str, float]]:
+    """Время ответа GigaChat по версиям промптов: {версия: {"calls", "avg"}} (сравнение правок промпта)."""
+    if _client_instance is None:
+        return {}
+    return {
+        version: {"calls": int(calls), "avg": total / calls}
+        for version, (calls, total) in _client_instance.prompt_latency.items() if calls
+    }
+
+
+def scheduler_stats() -> Optional[Dict[str, Any]]:
+    """Метрики очереди запросов к GigaChat по классам приоритета (None — клиент ещё не создан)."""
+    return _client_instance.scheduler.stats() if _client_instance is not None else None
+
+
 async def close_client():
     """Закрыть глобальный клиент"""
     global _client_instance
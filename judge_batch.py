@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Пакетная переоценка Judge (Блок 4) по историческим логам.
+
+После правки промпта Judge нужно переоценить накопленные записи judge_log.json.
+Скрипт читает записи потоком, оценивает их параллельно (не больше --concurrency
+одновременно) и дописывает каждую оценку в checkpoint (JSONL) сразу после получения.
+При повторном запуске уже оценённые записи пропускаются: ключ записи — хэш
+(вопрос, контекст, ответ, версия промпта Judge). Итог — колоночный файл для анализа
+(Parquet при установленном pyarrow, иначе CSV).
+
+Режим --compare: каждая запись оценивается дважды — полным Judge и компактным
+(JUDGE_INPUT_MODE=compact: только фрагменты, на которые опирается ответ, и сжатый промпт).
+Отчёт показывает совпадение вердиктов, расхождение баллов и экономию длины промпта,
+чтобы перед переключением режима убедиться, что вердикты не меняются.
+
+Текст контекста RAG в judge_log.json не хранится — только ссылки на фрагменты (chunks:
+источник, раздел, хэш текста); контекст восстанавливается из разделов индекса курса.
+Если раздел с тех пор изменился (или записи старые, без ссылок), с флагом --retrieve контекст
+восстанавливается поиском по базе знаний, без него такие записи пропускаются.
+
+Запуск:
+  python judge_batch.py
+  python judge_batch.py --input logs/judge_log.json --output logs/judge_batch.parquet --concurrency 8 --retrieve
+  python judge_batch.py --compare --limit 200
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+import config
+from block1_normalization import template_type
+from block4_judge import judge_answer, judge_prompt_version, build_judge_messages
+from gigachat_client import close_client, get_client
+
+# Колонки итогового файла (порядок сохраняется)
+COLUMNS = [
+    "record_hash",
+    "timestamp",
+    "request_id",
+    "user_id",
+    "query_type",
+    "answer_prompt_version",
+    "prompt_version",
+    "old_prompt_version",
+    "old_verdict",
+    "old_overall_score",
+    "verdict",
+    "overall_score",
+    "relevance",
+    "groundedness",
+    "safety",
+    "completeness",
+    "correct_refusal",
+    "question_type_correct",
+]
+
+# Колонки отчёта --compare (полный vs компактный вход Judge)
+COMPARE_COLUMNS = [
+    "record_hash",
+    "query_type",
+    "full_verdict",
+    "compact_verdict",
+    "verdict_agree",
+    "full_score",
+    "compact_score",
+    "full_prompt_chars",
+    "compact_prompt_chars",
+]
+
+def iter_log_records(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """Потоково читает записи из JSON-массива (judge_log.json) или JSONL, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        started = False
+        eof = False
+        while True:
+            if not eof and len(buf) < chunk_size:
+                data = f.read(chunk_size)
+                eof = not data
+                buf += data
+            buf = buf.lstrip()
+            if not started:
+                if buf.startswith("["):
+                    buf = buf[1:]
+                started = True
+                continue
+            if buf.startswith(","):
+                buf = buf[1:]
+                continue
+            if not buf or buf.startswith("]"):
+                if eof or buf.startswith("]"):
+                    return
+                continue
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Объект ещё не дочитан — подгружаем следующий кусок
+                data = f.read(chunk_size)
+                eof = not data
+                buf += data
+                continue
+            buf = buf[end:]
+            if isinstance(obj, dict):
+                yield obj
+
+
+def record_hash(question: str, context: str, answer: str, prompt_version: str) -> str:
+    """Ключ записи для checkpoint: (вопрос, контекст, ответ, версия промпта Judge)."""
+    payload = json.dumps([question, context, answer, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _infer_query_type(record: Dict[str, Any]) -> str:
+    """Тип запроса: из записи, иначе по шаблонному ответу (старые логи его не хранят)."""
+    if record.get("query_type"):
+        return record["query_type"]
+    return template_type(record.get("answer")) or "question"
+
+
+def _record_context(record: Dict[str, Any], query_type: str, retrieve: bool) -> Optional[str]:
+    """Контекст RAG записи: текст (записи до перехода на ссылки), разделы индекса по ссылкам chunks;
+    если не восстановить — поиск (retrieve) или None (пропустить)."""
+    context = record.get("context")
+    if context is not None:
+        return context
+    if query_type != "question":
+        return ""
+    if record.get("chunks"):
+        from block2_rag import context_from_refs
+        context = context_from_refs(record["chunks"], record.get("course"))
+        if context is not None:
+            return context
+    if not retrieve:
+        return None
+    from block2_rag import search_relevant_chunks, get_context_from_chunks
+    chunks = search_relevant_chunks(record.get("question") or "")
+    return get_context_from_chunks(chunks) if chunks else ""
+
+
+def _load_checkpoint(path: str) -> set:
+    """Хэши уже оценённых записей из checkpoint (JSONL)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                done.add(json.loads(line)["record_hash"])
+            except (json.JSONDecodeError, KeyError):
+                continue  # недописанная строка после аварийной остановки
+    return done
+
+
+def _read_checkpoint_rows(path: str) -> List[Dict[str, Any]]:
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return rows
+
+
+def write_columnar(rows: List[Dict[str, Any]], path: str, columns: Optional[List[str]] = None) -> str:
+    """Пишет строки в колоночный файл: Parquet (pyarrow), иначе CSV рядом. Возвращает фактический путь."""
+    columns = columns or COLUMNS
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = None
+    if pa is not None and path.endswith(".parquet"):
+        table = pa.table({col: [r.get(col) for r in rows] for col in columns})
+        pq.write_table(table, path, compression="zstd")
+        return path
+    csv_path = os.path.splitext(path)[0] + ".csv"
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return csv_path
+
+
+def _row(record: Dict[str, Any], rhash: str, query_type: str, verdict: Dict[str, Any]) -> Dict[str, Any]:
+    old = record.get("judge_verdict") or {}
+    return {
+        "record_hash": rhash,
+        "timestamp": record.get("timestamp"),
+        "request_id": record.get("request_id"),
+        "user_id": record.get("user_id"),
+        "query_type": query_type,
+        "answer_prompt_version": record.get("answer_prompt_version"),
+        "prompt_version": verdict.get("prompt_version", judge_prompt_version()),
+        "old_prompt_version": old.get("prompt_version"),
+        "old_verdict": old.get("verdict"),
+        "old_overall_score": old.get("overall_score"),
+        "verdict": verdict.get("verdict"),
+        "overall_score": verdict.get("overall_score"),
+        "relevance": verdict.get("relevance"),
+        "groundedness": verdict.get("groundedness"),
+        "safety": verdict.get("safety"),
+        "completeness": verdict.get("completeness"),
+        "correct_refusal": verdict.get("correct_refusal"),
+        "question_type_correct": verdict.get("question_type_correct"),
+    }
+
+
+async def judge_records(
+    records: Iterator[Dict[str, Any]],
+    checkpoint_path: str,
+    concurrency: int = 4,
+    retrieve: bool = False,
+    limit: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Оценивает записи потоком с ограничением параллелизма и checkpoint/resume.
+
+    Returns:
+        {"judged": N, "skipped_done": N, "skipped_no_context": N, "failed": N}
+    """
+    done = _load_checkpoint(checkpoint_path)
+    stats = {"judged": 0, "skipped_done": 0, "skipped_no_context": 0, "failed": 0}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)  # backpressure на чтение логов
+
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            record, rhash, query_type, context = item
+            try:
+                verdict = await judge_answer(
+                    record.get("question") or "", context, record.get("answer") or "", query_type=query_type
+                )
+                if verdict.get("error"):
+                    stats["failed"] += 1  # не пишем в checkpoint — переоценим при следующем запуске
+                else:
+                    checkpoint.write(json.dumps(_row(record, rhash, query_type, verdict), ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+                    stats["judged"] += 1
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        queued = 0
+        for record in records:
+            if limit is not None and queued >= limit:
+                break
+            query_type = _infer_query_type(record)
+            context = _record_context(record, query_type, retrieve)
+            if context is None:
+                stats["skipped_no_context"] += 1
+                continue
+            prompt_version = judge_prompt_version(query_type=query_type)
+            rhash = record_hash(record.get("question") or "", context, record.get("answer") or "", prompt_version)
+            if rhash in done:
+                stats["skipped_done"] += 1
+                continue
+            done.add(rhash)
+            await queue.put((record, rhash, query_type, context))
+            queued += 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        checkpoint.close()
+    return stats
+
+
+async def compare_modes(
+    records: Iterator[Dict[str, Any]],
+    concurrency: int = 4,
+    retrieve: bool = False,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Оценивает записи полным и компактным Judge; возвращает строки COMPARE_COLUMNS.
+    Записи читаются потоком через ограниченную очередь (как в judge_records): в памяти только строки отчёта."""
+    rows: List[Dict[str, Any]] = []
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            record, query_type, context = item
+            question, answer = record.get("question") or "", record.get("answer") or ""
+            try:
+                full, compact = await asyncio.gather(
+                    judge_answer(question, context, answer, query_type=query_type, mode="full"),
+                    judge_answer(question, context, answer, query_type=query_type, mode="compact"),
+                )
+                if full.get("error") or compact.get("error"):
+                    continue  # ошибка вызова — не засчитываем как расхождение вердиктов
+                full_len = sum(map(len, build_judge_messages(question, context, answer, query_type, mode="full")))
+                compact_len = sum(map(len, build_judge_messages(question, context, answer, query_type, mode="compact")))
+                rows.append({
+                    "record_hash": record_hash(question, context, answer, judge_prompt_version("compact")),
+                    "query_type": query_type,
+                    "full_verdict": full.get("verdict"),
+                    "compact_verdict": compact.get("verdict"),
+                    "verdict_agree": int(full.get("verdict") == compact.get("verdict")),
+                    "full_score": full.get("overall_score"),
+                    "compact_score": compact.get("overall_score"),
+                    "full_prompt_chars": full_len,
+                    "compact_prompt_chars": compact_len,
+                })
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    queued = 0
+    for record in records:
+        if limit is not None and queued >= limit:
+            break
+        query_type = _infer_query_type(record)
+        if query_type != "question":
+            continue  # шаблонные ответы проверяются коротким путём, компактный вход на них не влияет
+        context = _record_context(record, query_type, retrieve)
+        if context is None:
+            continue
+        await queue.put((record, query_type, context))
+        queued += 1
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    return rows
+
+
+def print_agreement_report(rows: List[Dict[str, Any]]) -> None:
+    """Совпадение вердиктов, расхождение баллов и экономия длины промпта компактного Judge."""
+    if not rows:
+        print("Нет записей для сравнения (нужны записи type=question с контекстом или --retrieve).")
+        return
+    n = len(rows)
+    agree = sum(r["verdict_agree"] for r in rows)
+    diffs = [
+        abs(float(r["full_score"]) - float(r["compact_score"]))
+        for r in rows
+        if r["full_score"] is not None and r["compact_score"] is not None
+    ]
+    full_chars = sum(r["full_prompt_chars"] for r in rows)
+    compact_chars = sum(r["compact_prompt_chars"] for r in rows)
+    print(f"Записей: {n}")
+    print(f"Совпадение вердиктов: {agree}/{n} = {agree / n:.1%}")
+    if diffs:
+        print(f"Среднее |Δ overall_score|: {sum(diffs) / len(diffs):.2f}, максимум: {max(diffs):.2f}")
+    print(f"Длина промпта (символы): full {full_chars}, compact {compact_chars}, экономия {1 - compact_chars / max(full_chars, 1):.0%}")
+    print("\nfull \\ compact | good | partial | bad")
+    for fv in ("good", "partial", "bad"):
+        counts = [sum(1 for r in rows if r["full_verdict"] == fv and r["compact_verdict"] == cv) for cv in ("good", "partial", "bad")]
+        print(f"  {fv:13} | {counts[0]:4} | {counts[1]:7} | {counts[2]:3}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пакетная переоценка Judge по judge_log.json")
+    parser.add_argument("--input", default=os.path.join(config.LOGS_PATH, "judge_log.json"))
+    parser.add_argument("--output", default=None, help="Итоговый файл (.parquet; без pyarrow — .csv рядом)")
+    parser.add_argument("--checkpoint", default=None, help="JSONL с уже оценёнными записями (по умолчанию <output>.checkpoint.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=config.EVAL_CONCURRENCY)
+    parser.add_argument("--limit", type=int, default=None, help="Оценить не больше N новых записей")
+    parser.add_argument("--retrieve", action="store_true", help="Восстанавливать контекст поиском, если его нет в записи")
+    parser.add_argument("--compare", action="store_true", help="Сравнить полный и компактный вход Judge")
+    args = parser.parse_args()
+
+    # Студентов в этом процессе нет: Judge не ограничен лимитом своего класса (full и compact — два запроса на запись)
+    (await get_client()).scheduler.set_limits(args.concurrency * (2 if args.compare else 1))
+
+    if args.compare:
+        output = args.output or os.path.join(
+            config.LOGS_PATH, f"judge_agreement_{judge_prompt_version('full')}_{judge_prompt_version('compact')}.parquet"
+        )
+        try:
+            rows = await compare_modes(
+                iter_log_records(args.input), concurrency=args.concurrency, retrieve=args.retrieve, limit=args.limit
+            )
+        finally:
+            await close_client()
+        print_agreement_report(rows)
+        if rows:
+            print(f"Построчно: {write_columnar(rows, output, COMPARE_COLUMNS)}")
+        return
+
+    args.output = args.output or os.path.join(config.LOGS_PATH, f"judge_batch_{judge_prompt_version()}.parquet")
+    checkpoint_path = args.checkpoint or os.path.splitext(args.output)[0] + ".checkpoint.jsonl"
+    print(f"Judge prompt version: {judge_prompt_version()}")
+    print(f"Вход: {args.input}\nCheckpoint: {checkpoint_path}")
+
+    try:
+        stats = await judge_records(
+            iter_log_records(args.input),
+            checkpoint_path,
+            concurrency=args.concurrency,
+            retrieve=args.retrieve,
+            limit=args.limit,
+        )
+    finally:
+        await close_client()
+
+    print(
+        f"Оценено: {stats['judged']}, уже было в checkpoint: {stats['skipped_done']}, "
+        f"без контекста (нужен --retrieve): {stats['skipped_no_context']}, ошибок: {stats['failed']}"
+    )
+    rows = _read_checkpoint_rows(checkpoint_path)
+    out = write_columnar(rows, args.output)
+    print(f"Итог ({len(rows)} строк): {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,277 @@
+"""Загрузка документов базы знаний (для Блока 2).
+PDF разбираются постранично в пуле процессов: большие файлы режутся на диапазоны страниц,
+так что четыре курсовых PDF разбираются параллельно, а не по очереди. Разобранный текст
+кэшируется по хэшу файла (PARSED_CACHE_PATH): переиндексация после смены чанкинга
+не извлекает текст из PDF заново.
+
+Документы отдаются генератором (iter_knowledge_base): в пуле одновременно не больше
+2×INDEX_WORKERS задач, следующие ставятся, только когда потребитель (чанкинг → эмбеддинг →
+запись в индекс) забрал готовые страницы. Память не растёт с числом файлов в knowledge_base/."""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional, Iterator
+import config
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md", ".docx")
+
+# Меняется при изменении разбора/нормализации — старый кэш перестаёт совпадать
+PARSER_VERSION = "2"  # 2: заголовки DOCX размечаются «#»
+
+# Как часто печатать прогресс разбора, с
+PROGRESS_INTERVAL = 10.0
+
+
+def normalize_text_for_indexing(text: str) -> str:
+    """Нормализация текста перед разбиением: убираем лишние пробелы/переносы, чтобы не портить чанки."""
+    if not text or not text.strip():
+        return text
+    # Убираем нулевые байты и лишние пробелы/переносы
+    t = text.replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
+    t = re.sub(r"\n{3,}", "\n\n", t)
+    t = re.sub(r"[ \t]+", " ", t)
+    return t.strip()
+
+
+def list_kb_files(base_path: str) -> List[Tuple[str, str]]:
+    """Все поддерживаемые файлы в base_path и вложенных папках: [(абсолютный путь, относительный путь)]."""
+    files = []
+    for root, _dirs, names in os.walk(base_path):
+        for filename in sorted(names):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                filepath = os.path.join(root, filename)
+                files.append((filepath, os.path.relpath(filepath, base_path)))
+    return sorted(files, key=lambda f: f[1])
+
+
+def file_hash(path: str) -> str:
+    """sha256 содержимого файла."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_file(digest: str) -> str:
+    return os.path.join(os.path.abspath(config.PARSED_CACHE_PATH), f"{digest}_{PARSER_VERSION}.json")
+
+
+def _read_cache(digest: str) -> Optional[List[Dict[str, Any]]]:
+    path = _cache_file(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return None
+
+
+def _write_cache(digest: str, pages: List[Dict[str, Any]]) -> None:
+    path = _cache_file(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except IOError as e:
+        logger.warning("Кэш разбора: не удалось записать %s: %s", path, e)
+
+
+# --- Функции для процессов пула (верхний уровень модуля, чтобы их можно было передать в процесс) ---
+
+def _parse_pdf_pages(filepath: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Текст страниц [start, end) PDF: [{"page": номер с 0, "text": ...}] (пустые страницы пропускаются)."""
+    from pypdf import PdfReader
+    reader = PdfReader(filepath)
+    pages = []
+    for i in range(start, min(end, len(reader.pages))):
+        text = normalize_text_for_indexing(reader.pages[i].extract_text() or "")
+        if text:
+            pages.append({"page": i, "text": text})
+    return pages
+
+
+def _parse_text_file(filepath: str) -> List[Dict[str, Any]]:
+    """TXT / MD / DOCX — один «лист» на файл."""
+    lower = filepath.lower()
+    if lower.endswith(".docx"):
+        from docx import Document as DocxDocument
+        doc = DocxDocument(filepath)
+        text = "\n\n".join(_docx_paragraph(p) for p in doc.paragraphs if p.text)
+    else:
+        with open(filepath, "r", encoding="utf-8") as f:
+            text = f.read()
+    text = normalize_text_for_indexing(text)
+    return [{"text": text}] if text else []
+
+
+def _docx_paragraph(paragraph) -> str:
+    """Абзац DOCX; заголовки (стили «Heading N» / «Заголовок N») размечаются «#» для структурного чанкинга."""
+    style = (paragraph.style.name if paragraph.style is not None else "") or ""
+    match = re.match(r"(?:Heading|Заголовок)\s*(\d)", style)
+    if match:
+        return "#" * int(match.group(1)) + " " + paragraph.text.strip()
+    if style == "Title":
+        return "# " + paragraph.text.strip()
+    return paragraph.text
+
+
+def _pdf_page_count(filepath: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(filepath).pages)
+
+
+def _file_tasks(filepath: str) -> List[Tuple[Any, tuple]]:
+    """Задачи пула для файла: диапазоны страниц PDF или один разбор TXT/MD/DOCX."""
+    if filepath.lower().endswith(".pdf"):
+        n_pages = _pdf_page_count(filepath)
+        step = max(config.PDF_PAGES_PER_TASK, 1)
+        return [(_parse_pdf_pages, (filepath, start, start + step)) for start in range(0, n_pages, step)]
+    return [(_parse_text_file, (filepath,))]
+
+
+def _as_documents(rel_path: str, pages: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for page in pages:
+        metadata = {"source": rel_path}
+        if "page" in page:
+            metadata["page"] = page["page"]
+        yield {"text": page["text"], "metadata": metadata}
+
+
+def iter_knowledge_base(
+    base_path: str,
+    workers: Optional[int] = None,
+    files: Optional[set] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково разбирает файлы базы знаний (файлы и диапазоны страниц PDF — задачи пула процессов).
+
+    Args:
+        files: относительные пути файлов для разбора (инкрементальная переиндексация); None — все файлы
+        stats: если передан — заполняется счётчиками (pages, files, cached_files, failed_files, seconds);
+            files — только файлы, разобранные без ошибок, parsed — их относительные пути
+
+    Yields:
+        {"text": str, "metadata": {"source": rel_path, "page"?: int}} в порядке файлов и страниц.
+    """
+    workers = workers or config.INDEX_WORKERS
+    started = time.perf_counter()
+    selected = files
+    files = [f for f in list_kb_files(base_path) if selected is None or f[1] in selected]
+    parsed = set()
+    counters = {"pages": 0, "files": 0, "cached_files": 0, "failed_files": 0}
+
+    def task_stream():
+        """(rel_path, digest, задача или None, страницы из кэша, последняя задача файла)"""
+        for filepath, rel_path in files:
+            try:
+                digest = file_hash(filepath)
+                pages = _read_cache(digest)
+                if pages is not None:
+                    yield rel_path, digest, None, pages, True
+                    continue
+                tasks = _file_tasks(filepath)
+            except Exception as e:
+                print(f"Ошибка при загрузке {rel_path}: {e}")
+                counters["failed_files"] += 1
+                continue
+            if not tasks:
+                yield rel_path, digest, None, [], True
+            for i, task in enumerate(tasks):
+                yield rel_path, digest, task, None, i == len(tasks) - 1
+
+    # spawn, а не fork: индексация идёт и из фонового потока прогрева, где уже могут быть загружены
+    # torch и его потоки — fork такого процесса может зависнуть
+    pool = (
+        ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        if workers > 1 else None
+    )
+    window = max(workers, 1) * 2
+    pending: deque = deque()
+    stream = task_stream()
+
+    def fill():
+        # Не больше window задач впереди потребителя — backpressure на разбор
+        while len(pending) < window:
+            item = next(stream, None)
+            if item is None:
+                return
+            rel_path, digest, task, pages, last = item
+            if task is not None and pool is not None:
+                fn, args = task
+                task = pool.submit(fn, *args)
+            pending.append((rel_path, digest, task, pages, last))
+
+    collected: List[Dict[str, Any]] = []
+    failed = False
+    last_report = started
+    try:
+        fill()
+        while pending:
+            rel_path, digest, task, pages, last = pending.popleft()
+            from_cache = task is None
+            if from_cache:
+                part = pages
+            else:
+                try:
+                    part = _task_result(task)
+                except Exception as e:
+                    print(f"Ошибка при загрузке {rel_path}: {e}")
+                    failed = True
+                    part = []
+            fill()  # пока потребитель обрабатывает страницы, пул разбирает следующие
+            collected.extend(part)
+            for doc in _as_documents(rel_path, part):
+                yield doc
+            if last:
+                if failed:
+                    counters["failed_files"] += 1
+                else:
+                    if not from_cache:
+                        _write_cache(digest, collected)
+                    counters["files"] += 1
+                    counters["cached_files"] += int(from_cache)
+                    parsed.add(rel_path)
+                counters["pages"] += len(collected)
+                collected = []
+                failed = False
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(
+                    f"Разбор: {counters['pages'] + len(collected)} страниц, {counters['files']} файлов, "
+                    f"{(counters['pages'] + len(collected)) / (now - started):.1f} стр/с"
+                )
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Разобрано {counters['pages']} страниц/документов из {counters['files']} файлов за {elapsed:.1f} с "
+        f"({counters['pages'] / max(elapsed, 1e-6):.1f} стр/с; из кэша {counters['cached_files']} файлов, "
+        f"с ошибками {counters['failed_files']}, процессов {workers})"
+    )
+    if stats is not None:
+        stats.update(counters, seconds=elapsed, parsed=parsed)
+
+
+def _task_result(task):
+    """Результат задачи: future из пула или (функция, аргументы) при работе без пула."""
+    if isinstance(task, tuple):
+        fn, args = task
+        return fn(*args)
+    return task.result()
+
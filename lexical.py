@@ -0,0 +1,82 @@
+"""Лексическая часть гибридного поиска: токены и леммы.
+
+Леммы чанка считаются один раз при индексации и хранятся в его метаданных (поле «lemmas» — строка
+через пробел: Chroma принимает только скаляры). При поиске совпадение терминов запроса — проверка
+по множеству, без приведения к нижнему регистру и сканирования текста каждого кандидата.
+
+Лемматизатор — pymorphy3 (или pymorphy2), если установлен: «повестки», «повесткой» → «повестка».
+Без него — грубая основа stem(). Составные слова делятся по дефису («ESG-повестка» → esg, повестка).
+Какой лемматизатор использовался, записано в настройках индекса: смена — полная пересборка."""
+import functools
+import re
+import threading
+from typing import FrozenSet, List
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+LEMMAS_FIELD = "lemmas"
+
+_morph = None
+_morph_loaded = False
+_morph_lock = threading.Lock()
+
+
+def _get_morph():
+    """Морфоанализатор pymorphy (загружается при первом обращении) или None, если библиотеки нет."""
+    global _morph, _morph_loaded
+    if not _morph_loaded:
+        with _morph_lock:
+            if not _morph_loaded:
+                try:
+                    import pymorphy3 as pymorphy
+                except ImportError:
+                    try:
+                        import pymorphy2 as pymorphy
+                    except ImportError:
+                        pymorphy = None
+                _morph = pymorphy.MorphAnalyzer() if pymorphy else None
+                _morph_loaded = True
+    return _morph
+
+
+def lemmatizer_name() -> str:
+    return "pymorphy" if _get_morph() is not None else "stem"
+
+
+def stem(term: str) -> str:
+    """Грубая основа слова для сравнения словоформ: «телепортацию» и «телепортация» → «телепортаци»."""
+    if len(term) <= 3:
+        return term
+    return term[:-1] if len(term) <= 5 else term[:-2]
+
+
+def tokens(text: str) -> List[str]:
+    """Слова текста в нижнем регистре (ё → е), от 2 до 50 символов; дефис и знаки — разделители."""
+    return [t for t in TOKEN_RE.findall(text.lower().replace("ё", "е")) if 2 <= len(t) <= 50]
+
+
+@functools.lru_cache(maxsize=200_000)
+def lemma(token: str) -> str:
+    morph = _get_morph()
+    if morph is None:
+        return stem(token)
+    return morph.parse(token)[0].normal_form.replace("ё", "е")
+
+
+def lemma_set(text: str) -> FrozenSet[str]:
+    return frozenset(lemma(t) for t in tokens(text))
+
+
+def query_lemmas(query: str) -> List[str]:
+    """Леммы запроса без повторов, в порядке появления."""
+    return list(dict.fromkeys(lemma(t) for t in tokens(query)))
+
+
+def encode_lemmas(text: str) -> str:
+    """Значение поля «lemmas» в метаданных чанка."""
+    return " ".join(sorted(lemma_set(text)))
+
+
+@functools.lru_cache(maxsize=50_000)
+def decode_lemmas(value: str) -> FrozenSet[str]:
+    """Поле «lemmas» → множество (разобранные строки кэшируются: одни и те же чанки находятся снова и снова)."""
+    return frozenset(value.split())
@@ -0,0 +1,64 @@
+"""Дисковый кэш ответов LLM.
+Ключ — sha256 от (модель, системный промпт, сообщение пользователя, параметры генерации).
+Повторный прогон evaluate_blocks после изменений только в поиске не тратит токены:
+те же промпты берутся из кэша. Один файл на ключ — безопасно при параллельных запросах."""
+import hashlib
+import json
+import logging
+import os
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(model: str, system_prompt: str, user_message: str, params: Dict[str, Any]) -> str:
+    """Стабильный ключ кэша: хэш промпта + модель + параметры (max_tokens, temperature, response_format)."""
+    payload = json.dumps(
+        {"model": model, "system": system_prompt, "user": user_message, "params": params},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Кэш ответов LLM в каталоге: <path>/<ключ[:2]>/<ключ>.json"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает сохранённый ответ или None."""
+        path = self._file(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.get("response")
+
+    def set(self, key: str, response: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        """Сохраняет ответ. Запись через временный файл + os.replace, чтобы не оставить битый JSON."""
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({**(meta or {}), "response": response}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except IOError as e:
+            logger.warning("LLM cache: не удалось записать %s: %s", path, e)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
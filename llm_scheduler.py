@@ -0,0 +1,145 @@
+"""Планировщик вызовов GigaChat по классам приоритета.
+Нормализация и генерация ответа (interactive) идут первыми, Judge (judge; в том числе пакетная переоценка
+judge_batch.py) — после них: фоновая оценка не задерживает ответ студенту.
+- Общий лимит одновременных запросов LLM_MAX_CONCURRENT и лимиты по классам LLM_CLASS_LIMITS.
+- Защита от голодания: запрос, прождавший дольше LLM_STARVATION_AFTER секунд, обслуживается раньше
+  более приоритетных (в пределах лимита своего класса).
+- Метрики времени в очереди по классам: stats() (среднее, p95, максимум).
+Слот занимает только реальный запрос к API: попадания в кэш и ожидание одинакового запроса в полёте
+очередь не проходят."""
+import asyncio
+import contextlib
+import itertools
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+import config
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_JUDGE = "judge"
+PRIORITIES = {PRIORITY_INTERACTIVE: 0, PRIORITY_JUDGE: 1}
+
+
+class _Waiter:
+    __slots__ = ("cls", "rank", "seq", "enqueued", "future")
+
+    def __init__(self, cls: str, seq: int):
+        self.cls = cls
+        self.rank = PRIORITIES.get(cls, len(PRIORITIES))
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class LLMScheduler:
+    """Очередь с приоритетами перед запросами к GigaChat (один на клиент, в его event loop)."""
+
+    def __init__(self, max_concurrent: int = None, class_limits: Dict[str, int] = None, starvation_after: float = None):
+        self.max_concurrent = max(config.LLM_MAX_CONCURRENT if max_concurrent is None else max_concurrent, 1)
+        self.class_limits = dict(config.LLM_CLASS_LIMITS if class_limits is None else class_limits)
+        self.starvation_after = config.LLM_STARVATION_AFTER if starvation_after is None else starvation_after
+        self.active = 0
+        self.active_by_class: Counter = Counter()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._waits: Dict[str, deque] = {}  # класс → последние времена ожидания, с
+        self._calls: Counter = Counter()
+        self._queued: Counter = Counter()
+        self._promoted: Counter = Counter()
+
+    def set_limits(self, max_concurrent: int, class_limits: Dict[str, int] = None) -> None:
+        """Меняет лимиты на ходу. Пакетные скрипты без студентов (evaluate_blocks, judge_batch) снимают
+        лимиты классов: там параллельность задаёт их собственный --concurrency."""
+        self.max_concurrent = max(max_concurrent, 1)
+        self.class_limits = dict(class_limits or {})
+        self._dispatch()
+
+    def _can_run(self, cls: str) -> bool:
+        return (
+            self.active < self.max_concurrent
+            and self.active_by_class[cls] < self.class_limits.get(cls, self.max_concurrent)
+        )
+
+    def _grant(self, cls: str, waited: float) -> None:
+        self.active += 1
+        self.active_by_class[cls] += 1
+        self._calls[cls] += 1
+        self._waits.setdefault(cls, deque(maxlen=1000)).append(waited)
+
+    def _dispatch(self) -> None:
+        """Выдаёт освободившиеся слоты: сначала прождавшим дольше starvation_after (старшие первыми),
+        затем по приоритету класса и порядку постановки."""
+        while self._waiters:
+            now = time.monotonic()
+            eligible = [w for w in self._waiters if self._can_run(w.cls)]
+            if not eligible:
+                return
+            starving = [w for w in eligible if now - w.enqueued >= self.starvation_after > 0]
+            if starving:
+                waiter = min(starving, key=lambda w: w.seq)
+                if any(w.rank < waiter.rank for w in eligible):
+                    self._promoted[waiter.cls] += 1
+            else:
+                waiter = min(eligible, key=lambda w: (w.rank, w.seq))
+            self._waiters.remove(waiter)
+            self._grant(waiter.cls, now - waiter.enqueued)
+            waiter.future.set_result(True)
+
+    async def acquire(self, cls: str = PRIORITY_INTERACTIVE) -> None:
+        if not self._waiters and self._can_run(cls):
+            self._grant(cls, 0.0)
+            return
+        waiter = _Waiter(cls, next(self._seq))
+        self._waiters.append(waiter)
+        self._queued[cls] += 1
+        try:
+            # Слот может освободиться в момент, когда свободно место, но в очереди есть другие —
+            # проверяем, не наша ли очередь уже сейчас
+            self._dispatch()
+            await waiter.future
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(cls)  # слот выдали одновременно с отменой — возвращаем
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, cls: str = PRIORITY_INTERACTIVE) -> None:
+        self.active -= 1
+        self.active_by_class[cls] -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, cls: str = PRIORITY_INTERACTIVE):
+        await self.acquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    def stats(self) -> Dict[str, Any]:
+        """По классам: запросов, из них ждали в очереди, поднято из-за голодания, среднее/p95/макс. ожидание (с)."""
+        classes = {}
+        for cls in sorted(set(self._calls) | set(self._queued), key=lambda c: PRIORITIES.get(c, len(PRIORITIES))):
+            waits = sorted(self._waits.get(cls, ()))
+            classes[cls] = {
+                "calls": self._calls[cls],
+                "queued": self._queued[cls],
+                "promoted": self._promoted[cls],
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": waits[max(int(len(waits) * 0.95) - 1, 0)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+                "waiting": sum(1 for w in self._waiters if w.cls == cls),
+            }
+        return {"active": self.active, "waiting": len(self._waiters), "classes": classes}
+
+
+def format_stats(stats: Optional[Dict[str, Any]]) -> str:
+    """Одна строка на класс для итогов оценки и логов."""
+    if not stats or not stats["classes"]:
+        return "запросов к GigaChat не было"
+    return "; ".join(
+        f"{cls}: {s['calls']} запросов, в очереди {s['queued']}, ожидание ср. {s['wait_avg']:.2f} с, "
+        f"p95 {s['wait_p95']:.2f} с, макс. {s['wait_max']:.2f} с"
+        for cls, s in stats["classes"].items()
+    )
@@ -23,7 +23,7 @@ def _get_excel_path() -> str:
 
 
 def _ensure_sheet(wb, sheet_name: str, headers: List[str]):
-    """Создаёт лист с заголовками, если его нет или он пустой."""
+    """Создаёт лист с заголовками, если его нет или он пустой; дописывает заголовки новых колонок."""
     if sheet_name not in wb.sheetnames:
         ws = wb.create_sheet(sheet_name)
         ws.append(headers)
@@ -31,6 +31,10 @@ def _ensure_sheet(wb, sheet_name: str, headers: List[str]):
     ws = wb[sheet_name]
     if ws.max_row == 0:
         ws.append(headers)
+        return ws
+    for col, header in enumerate(headers, start=1):
+        if ws.cell(row=1, column=col).value is None:
+            ws.cell(row=1, column=col, value=header)
     return ws
 
 
@@ -41,7 +45,7 @@ def _append_normalization_sync(entry: Dict[str, Any]) -> None:
         logger.debug("openpyxl не установлен — запись в Excel отключена")
         return
     path = _get_excel_path()
-    headers = ["timestamp", "user_id", "original_text", "normalized_query", "type"]
+    headers = ["timestamp", "user_id", "original_text", "normalized_query", "type", "prompt_version"]
     with _lock:
         try:
             if os.path.exists(path):
@@ -56,6 +60,7 @@ def _append_normalization_sync(entry: Dict[str, Any]) -> None:
                 (str(entry.get("original_text") or ""))[:1000],
                 (str(entry.get("normalized_query") or ""))[:500],
                 entry.get("type", ""),
+                entry.get("prompt_version") or "",
             ])
             wb.save(path)
         except Exception as e:
@@ -71,7 +76,7 @@ def _append_judge_sync(entry: Dict[str, Any]) -> None:
     headers = [
         "timestamp", "request_id", "user_id", "question", "answer",
         "rel", "grnd", "safe", "compl",
-        "verdict", "score", "type_ok", "refusal_ok", "explanation",
+        "verdict", "score", "type_ok", "refusal_ok", "explanation", "weight",
     ]
     j = entry.get("judge_verdict") or {}
     row = [
@@ -89,6 +94,7 @@ def _append_judge_sync(entry: Dict[str, Any]) -> None:
         j.get("question_type_correct", ""),
         j.get("correct_refusal", ""),
         (str(j.get("explanation") or ""))[:300],
+        j.get("sample_weight", 1.0),
     ]
     with _lock:
         try:
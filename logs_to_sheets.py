@@ -65,13 +65,17 @@ def _append_normalization_sync(entry: Dict[str, Any]) -> None:
         return
     try:
         ws = sh.worksheet("Normalization") if "Normalization" in [s.title for s in sh.worksheets()] else sh.add_worksheet("Normalization", rows=1000, cols=8)
-        _ensure_headers(ws, ["timestamp", "user_id", "original_text", "normalized_query", "type"])
+        _ensure_headers(
+            ws, ["timestamp", "user_id", "original_text", "normalized_query", "type", "prompt_version"],
+            force_if_mismatch=True,
+        )
         row = [
             entry.get("timestamp", ""),
             entry.get("user_id", ""),
             (entry.get("original_text") or "")[:1000],
             (entry.get("normalized_query") or "")[:500],
             entry.get("type", ""),
+            entry.get("prompt_version") or "",
         ]
         ws.append_row(row, value_input_option="USER_ENTERED")
     except Exception as e:
@@ -82,7 +86,7 @@ def _append_normalization_sync(entry: Dict[str, Any]) -> None:
 JUDGE_HEADERS = [
     "timestamp", "request_id", "user_id", "question", "answer",
     "rel", "grnd", "safe", "compl",
-    "verdict", "score", "type_ok", "refusal_ok", "explanation",
+    "verdict", "score", "type_ok", "refusal_ok", "explanation", "weight",
 ]
 
 
@@ -109,6 +113,7 @@ def _append_judge_sync(entry: Dict[str, Any]) -> None:
             j.get("question_type_correct", ""),
             j.get("correct_refusal", ""),
             (j.get("explanation") or "")[:300],
+            j.get("sample_weight", 1.0),
         ]
         ws.append_row(row, value_input_option="USER_ENTERED")
     except Exception as e:
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Сверка ONNX-бэкенда эмбеддингов с torch и замер скорости/памяти на нашей базе знаний.
+
+Тексты — дочерние чанки материалов курса (chunker.py, не больше --limit) и вопросы корзинок evaluate_blocks.
+Каждый бэкенд (torch, затем model.onnx и model_int8.onnx из папки EMBEDDING_ONNX_PATH, если есть) работает
+в отдельном процессе через block2_rag._get_embeddings — тот же путь, что у бота. Печатается:
+- загрузка модели, эмбеддинг корпуса (чанков/с), задержка одного запроса (медиана, p95), пиковый RSS;
+- для ONNX — косинус с вектором torch (среднее и минимум по всем текстам) и совпадение поиска:
+  доля общих top-5 чанков по каждому вопросу и совпадение top-1.
+Запуск из корня проекта:
+  python scripts/bench_embeddings.py [--limit 500] [--onnx-dir models/embeddings_onnx]"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import config  # noqa: E402
+
+
+def _child(texts_path: str, n_queries: int, out_path: str) -> None:
+    """Замер в процессе-потомке: бэкенд задан переменными окружения EMBEDDING_BACKEND/EMBEDDING_ONNX_PATH."""
+    import block2_rag
+
+    with open(texts_path, "r", encoding="utf-8") as f:
+        texts = json.load(f)
+    corpus, queries = texts[:-n_queries], texts[-n_queries:]
+    started = time.perf_counter()
+    embeddings = block2_rag._get_embeddings()
+    embeddings.embed_query("прогрев")
+    load = time.perf_counter() - started
+
+    started = time.perf_counter()
+    corpus_vectors = embeddings.embed_documents(corpus)
+    corpus_seconds = time.perf_counter() - started
+
+    latencies, query_vectors = [], []
+    for query in queries:
+        t = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+    np.save(out_path, np.array(corpus_vectors + query_vectors, dtype=np.float32))
+    print(json.dumps({
+        "load": load,
+        "corpus_per_s": len(corpus) / max(corpus_seconds, 1e-9),
+        "query_median_ms": statistics.median(latencies) * 1000,
+        "query_p95_ms": latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000,
+        "peak_rss_mb": block2_rag._peak_rss_mb(),
+    }))
+
+
+def _collect_texts(limit: int):
+    from chunker import iter_structured_chunks
+    from evaluate_blocks import BASKET_CLASSIFICATION, BASKET_OUT_OF_COURSE, BASKET_TZ
+    from kb_loader import iter_knowledge_base
+
+    corpus = []
+    for child in iter_structured_chunks(iter_knowledge_base(os.path.abspath(config.KNOWLEDGE_BASE_PATH)), {}):
+        corpus.append(child["text"])
+        if len(corpus) >= limit:
+            break
+    queries = list(dict.fromkeys(
+        [q for q, _t, _c in BASKET_TZ] + [q for q, _t in BASKET_CLASSIFICATION] + BASKET_OUT_OF_COURSE
+    ))
+    return corpus, queries
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка и замер бэкендов эмбеддингов")
+    parser.add_argument("--limit", type=int, default=500, help="Не больше чанков корпуса")
+    parser.add_argument("--onnx-dir", default=os.path.dirname(config.EMBEDDING_ONNX_PATH))
+    parser.add_argument("--child", nargs=3, metavar=("TEXTS", "N_QUERIES", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.child[0], int(args.child[1]), args.child[2])
+        return 0
+
+    corpus, queries = _collect_texts(args.limit)
+    if not corpus:
+        print(f"В {config.KNOWLEDGE_BASE_PATH} нет материалов — сравнивать не на чем")
+        return 1
+    print(f"Корпус: {len(corpus)} чанков, вопросов: {len(queries)}")
+
+    backends = [("torch", {"EMBEDDING_BACKEND": "torch"})]
+    for name in ("model.onnx", "model_int8.onnx"):
+        path = os.path.join(args.onnx_dir, name)
+        if os.path.exists(path):
+            backends.append((f"onnx {name}", {"EMBEDDING_BACKEND": "onnx", "EMBEDDING_ONNX_PATH": path}))
+    if len(backends) == 1:
+        print(f"В {args.onnx_dir} нет ONNX-моделей: сначала python scripts/export_onnx.py")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = os.path.join(tmp, "texts.json")
+        with open(texts_path, "w", encoding="utf-8") as f:
+            json.dump(corpus + queries, f, ensure_ascii=False)
+        for label, env in backends:
+            out_path = os.path.join(tmp, f"{len(results)}.npy")
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", texts_path, str(len(queries)), out_path],
+                cwd=ROOT, env=dict(os.environ, QUERY_EMBEDDING_CACHE_SIZE="0", **env), capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                err = (proc.stderr.strip().splitlines() or ["?"])[-1]
+                print(f"  {label}: ошибка: {err}")
+                continue
+            metrics = json.loads(proc.stdout.strip().splitlines()[-1])
+            metrics["vectors"] = _normalize(np.load(out_path))
+            results[label] = metrics
+
+    print(f"\n{'бэкенд':22} {'загрузка':>9} {'чанков/с':>9} {'запрос мед.':>12} {'p95':>8} {'RSS':>8}")
+    for label, m in results.items():
+        print(
+            f"{label:22} {m['load']:8.1f}с {m['corpus_per_s']:9.1f} {m['query_median_ms']:10.1f}мс "
+            f"{m['query_p95_ms']:6.1f}мс {m['peak_rss_mb']:6.0f}МБ"
+        )
+
+    reference = results.get("torch")
+    if reference is None:
+        print("\nБез torch-модели сверка косинусов невозможна")
+        return 1
+    n_corpus = len(corpus)
+    ref_top = np.argsort(-(reference["vectors"][n_corpus:] @ reference["vectors"][:n_corpus].T), axis=1)[:, :5]
+    print(f"\n{'бэкенд':22} {'косинус ср.':>12} {'мин.':>8} {'top-5 общих':>12} {'top-1 совп.':>12}")
+    for label, m in results.items():
+        if m is reference:
+            continue
+        cosines = (m["vectors"] * reference["vectors"]).sum(axis=1)
+        top = np.argsort(-(m["vectors"][n_corpus:] @ m["vectors"][:n_corpus].T), axis=1)[:, :5]
+        overlap = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(top, ref_top)])
+        top1 = np.mean(top[:, 0] == ref_top[:, 0])
+        print(f"{label:22} {cosines.mean():12.4f} {cosines.min():8.4f} {overlap:12.0%} {top1:12.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
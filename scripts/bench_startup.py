@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Бенчмарк запуска: время импорта модулей и время до готовности индекса.
+Каждый замер — в отдельном процессе Python (холодный импорт). Запуск из корня проекта:
+  python scripts/bench_startup.py [--no-ready] [--repeat 3]"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "config",
+    "gigachat_client",
+    "block1_normalization",
+    "block2_rag",
+    "block3_generation",
+    "block4_judge",
+    "block5_feedback",
+    "evaluate_blocks",
+    "bot",
+]
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+READY_SNIPPET = (
+    "import time; t = time.perf_counter(); import block2_rag; "
+    "block2_rag.warm_up(); print(time.perf_counter() - t)"
+)
+
+
+def _measure(snippet: str, repeat: int):
+    """Медиана времени (с) по repeat холодным запускам или None при ошибке."""
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", snippet], cwd=ROOT, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            err = (proc.stderr.strip().splitlines() or ["?"])[-1]
+            print(f"    ошибка: {err}")
+            return None
+        times.append(float(proc.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта и готовности индекса")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-ready", action="store_true", help="Не замерять загрузку индекса (долго)")
+    args = parser.parse_args()
+
+    print(f"Импорт модулей (медиана из {args.repeat}, холодный процесс):")
+    for module in MODULES:
+        t = _measure(IMPORT_SNIPPET.format(module=module), args.repeat)
+        if t is not None:
+            print(f"  {module:22} {t * 1000:8.0f} мс")
+
+    if not args.no_ready:
+        print("\nВремя до готовности индекса (импорт + модель эмбеддингов + vector_db + пробный поиск):")
+        t = _measure(READY_SNIPPET, 1)
+        if t is not None:
+            print(f"  block2_rag.warm_up     {t:8.1f} с")
+
+
+if __name__ == "__main__":
+    main()
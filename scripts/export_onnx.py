@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Экспорт модели эмбеддингов (EMBEDDING_MODEL) в ONNX для EMBEDDING_BACKEND=onnx.
+Нужны torch и sentence-transformers (один раз, на машине сборки); боту потом хватает onnxruntime и tokenizers.
+
+В папку --out пишутся:
+  model.onnx       — fp32, косинус с torch-моделью ≈ 1;
+  model_int8.onnx  — динамическое квантование весов в int8 (быстрее и меньше, небольшое расхождение);
+  tokenizer.json   — токенизатор модели.
+Запуск из корня проекта:
+  python scripts/export_onnx.py [--out models/embeddings_onnx]
+Проверка совпадения с torch и замер скорости: python scripts/bench_embeddings.py"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели эмбеддингов в ONNX")
+    parser.add_argument("--out", default=os.path.dirname(config.EMBEDDING_ONNX_PATH))
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(args.out, exist_ok=True)
+    st = SentenceTransformer(config.EMBEDDING_MODEL, device="cpu")
+    transformer = st[0]
+    model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    tokenizer.backend_tokenizer.save(os.path.join(args.out, "tokenizer.json"))
+
+    sample = tokenizer(["Пример текста для экспорта"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    dynamic = {n: {0: "batch", 1: "tokens"} for n in names}
+    dynamic["last_hidden_state"] = {0: "batch", 1: "tokens"}
+    fp32_path = os.path.join(args.out, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in names),
+            fp32_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic,
+            opset_version=args.opset,
+        )
+    print(f"fp32: {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.0f} МБ)")
+
+    int8_path = os.path.join(args.out, "model_int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"int8: {int8_path} ({os.path.getsize(int8_path) / 1e6:.0f} МБ)")
+    print("Включение: EMBEDDING_BACKEND=onnx, EMBEDDING_ONNX_PATH=<путь к model.onnx или model_int8.onnx>")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Локальная заглушка GigaChat с внедрением отказов — проверка выключателя и деградированного режима.
+
+Заглушка отвечает на OAuth и /chat/completions правдоподобным JSON по виду промпта (нормализация,
+combined, Judge, короткая проверка шаблона) или текстом ответа. Режим отказа:
+  ok       — обычные ответы;
+  error    — HTTP 500;
+  slow     — ответ через --delay с (больше GIGACHAT_TIMEOUT — таймаут у клиента);
+  drop     — соединение закрывается без ответа;
+  throttle — HTTP 429 с Retry-After;
+  unauthorized — HTTP 401 и на OAuth, и на /chat/completions (ключ отозван);
+  garbage  — 200, но текст вместо JSON (проверка разбора и ремонта, structured_output.py);
+  flaky    — error с вероятностью --error-rate, иначе ok.
+Режим меняется на лету: POST /_fault {"mode": "error", "delay": 5, "error_rate": 0.3}.
+
+Запуск заглушки для бота (два терминала):
+  python scripts/fake_gigachat.py --port 8090 --mode flaky --error-rate 0.5
+  GIGACHAT_AUTH_KEY=fake GIGACHAT_AUTH_URL=http://127.0.0.1:8090/api/v2/oauth \\
+    GIGACHAT_API_URL=http://127.0.0.1:8090/api/v1 python bot.py
+Проверка сценариев отказа без Telegram (код выхода 0 — все прошли):
+  python scripts/fake_gigachat.py --check"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("ok", "error", "slow", "drop", "throttle", "unauthorized", "garbage", "flaky")
+
+
+class FakeGigaChat:
+    """Заглушка API: режим отказа и счётчик запросов к /chat/completions."""
+
+    def __init__(self, mode: str = "ok", delay: float = 5.0, error_rate: float = 0.5):
+        self.mode = mode
+        self.delay = delay
+        self.error_rate = error_rate
+        self.requests = 0
+
+    def set_fault(self, mode: str, delay: float = None, error_rate: float = None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"неизвестный режим {mode}, допустимы: {', '.join(MODES)}")
+        self.mode = mode
+        if delay is not None:
+            self.delay = delay
+        if error_rate is not None:
+            self.error_rate = error_rate
+
+    async def oauth(self, request: web.Request) -> web.Response:
+        if self.mode == "error":
+            return web.Response(status=500, text="fake oauth failure")
+        if self.mode == "unauthorized":
+            return web.Response(status=401, text="fake invalid credentials")
+        return web.json_response({"access_token": "fake-token", "expires_at": int(time.time() * 1000) + 1800000})
+
+    async def control(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        try:
+            self.set_fault(params.get("mode", self.mode), params.get("delay"), params.get("error_rate"))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"mode": self.mode, "delay": self.delay, "error_rate": self.error_rate})
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        mode = self.mode
+        if mode == "flaky":
+            mode = "error" if random.random() < self.error_rate else "ok"
+        if mode == "error":
+            return web.Response(status=500, text="fake upstream failure")
+        if mode == "throttle":
+            return web.Response(status=429, headers={"Retry-After": "1"}, text="too many requests")
+        if mode == "unauthorized":
+            return web.Response(status=401, text="fake token expired")
+        if mode == "drop":
+            request.transport.close()
+            return web.Response(status=500)
+        if mode == "slow":
+            await asyncio.sleep(self.delay)
+        content = "Не могу ответить в нужном формате, извините." if mode == "garbage" else _reply(body["messages"])
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/v2/oauth", self.oauth)
+        app.router.add_post("/api/v1/chat/completions", self.completions)
+        app.router.add_post("/_fault", self.control)
+        return app
+
+
+def _reply(messages) -> str:
+    """Правдоподобный ответ по виду промпта (промпты — prompts.py)."""
+    system = messages[0]["content"]
+    user = messages[-1]["content"]
+    if '{"ok": 1}' in system:
+        return '{"ok": 1}'
+    if '"relevance"' in system:
+        return json.dumps({
+            "relevance": 5, "groundedness": 5, "safety": 5, "completeness": 4, "correct_refusal": 1,
+            "question_type_correct": 1, "verdict": "good", "explanation": "Ответ заглушки.",
+        }, ensure_ascii=False)
+    if '"answer"' in system:
+        query = user.rsplit("Сообщение студента:", 1)[-1].strip()
+        return json.dumps(
+            {"type": "question", "normalized_query": query, "answer": "Ответ заглушки по материалам курса."},
+            ensure_ascii=False,
+        )
+    if '"normalized_query"' in system:
+        return json.dumps({"type": "question", "normalized_query": user.strip()}, ensure_ascii=False)
+    return "Ответ заглушки по материалам курса."
+
+
+async def _start(stub: FakeGigaChat, port: int) -> web.AppRunner:
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def run_checks(port: int) -> int:
+    """Сценарии отказа против заглушки: клиент, выключатель, Блоки 1, 3, 4 в деградированном режиме."""
+    os.environ.update({
+        "GIGACHAT_AUTH_KEY": "fake",
+        "GIGACHAT_AUTH_URL": f"http://127.0.0.1:{port}/api/v2/oauth",
+        "GIGACHAT_API_URL": f"http://127.0.0.1:{port}/api/v1",
+        "GIGACHAT_TIMEOUT": "0.5",
+        "GIGACHAT_BREAKER_FAILURES": "3",
+        "GIGACHAT_BREAKER_OPEN_SECONDS": "1",
+        "JUDGE_SAMPLE_RATE": "1",
+        "LLM_CACHE_PATH": "",
+    })
+    from block1_normalization import normalize_query
+    from block3_generation import DEGRADED_NOTICE, extractive_answer, generate_answer
+    from block4_judge import judge_sampling_decision
+    from gigachat_client import (
+        BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, GigaChatUnavailable,
+        breaker_stats, close_client, get_client, llm_available,
+    )
+
+    stub = FakeGigaChat(delay=2.0)
+    runner = await _start(stub, port)
+    failed = []
+
+    def check(name: str, ok: bool, detail: str = "") -> None:
+        print(f"  {'OK  ' if ok else 'FAIL'} {name}{f' — {detail}' if detail else ''}")
+        if not ok:
+            failed.append(name)
+
+    try:
+        print("Сценарии отказа GigaChat (заглушка на порту %d):" % port)
+        stub.set_fault("ok")
+        result = await normalize_query("как посчитать NPV проекта")
+        check("ok: нормализация через LLM", "fallback" not in result and result["type"] == "question")
+        check("ok: выключатель замкнут", breaker_stats()["state"] == BREAKER_CLOSED)
+
+        stub.set_fault("error")
+        for _ in range(3):
+            try:
+                await generate_answer("вопрос", "[Фрагмент 1 из a.txt]\nтекст")
+            except GigaChatUnavailable:
+                pass
+        check("error: 3 отказа подряд размыкают выключатель", breaker_stats()["state"] == BREAKER_OPEN, str(breaker_stats()))
+
+        before = stub.requests
+        started = time.perf_counter()
+        result = await normalize_query("что такое ESG-повестка")
+        elapsed = time.perf_counter() - started
+        check(
+            "open: нормализация без запроса к API",
+            stub.requests == before and result.get("fallback") == "unavailable" and elapsed < 0.1,
+            f"{elapsed * 1000:.0f} мс, тип {result['type']}",
+        )
+        result = await normalize_query("реши за меня тест")
+        check("open: локальная классификация по маркерам", result["type"] == "cheat")
+        check("open: llm_available() = False", not llm_available())
+        decision = judge_sampling_decision("question", chunks=[])
+        check("open: Judge пропускается", not decision["judge"] and decision["reason"] == "unavailable")
+        chunks = [
+            {"content": "# NPV\nЧистая приведённая стоимость — сумма дисконтированных потоков. Второе предложение.",
+             "metadata": {"source": "finance.pdf"}},
+        ]
+        answer = extractive_answer(chunks)
+        check("open: ответ фрагментами материалов", answer.startswith(DEGRADED_NOTICE) and "finance.pdf" in answer)
+
+        stub.set_fault("unauthorized")
+        await asyncio.sleep(1.1)
+        result = await normalize_query("как посчитать NPV проекта")
+        check(
+            "half-open: 401 от OAuth и API не замыкает выключатель",
+            result.get("fallback") == "llm_error" and breaker_stats()["state"] == BREAKER_HALF_OPEN,
+            str(breaker_stats()),
+        )
+
+        stub.set_fault("ok")
+        result = await normalize_query("как посчитать NPV проекта")
+        check(
+            "half-open: пробный запрос замыкает выключатель",
+            "fallback" not in result and breaker_stats()["state"] == BREAKER_CLOSED,
+        )
+
+        stub.set_fault("slow", delay=2.0)
+        started = time.perf_counter()
+        result = await normalize_query("как посчитать NPV проекта")
+        elapsed = time.perf_counter() - started
+        check(
+            "slow: таймаут GIGACHAT_TIMEOUT, а не ожидание ответа",
+            result.get("fallback") == "unavailable" and elapsed < 1.5,
+            f"{elapsed:.2f} с",
+        )
+
+        stub.set_fault("drop")
+        result = await normalize_query("как посчитать NPV проекта")
+        check("drop: обрыв соединения — отказ сервиса", result.get("fallback") == "unavailable")
+
+        stub.set_fault("garbage")
+        (await get_client()).breaker.record_success()  # счётчик отказов подряд после slow/drop — с нуля
+        result = await normalize_query("как посчитать NPV проекта")
+        check(
+            "garbage: текст вместо JSON — ремонт, затем откат parse_error; выключатель замкнут",
+            result.get("fallback") == "parse_error" and breaker_stats()["state"] == BREAKER_CLOSED,
+        )
+
+        stub.set_fault("throttle")
+        result = await normalize_query("как посчитать NPV проекта")
+        check(
+            "throttle: 429 не размыкает выключатель",
+            result.get("fallback") == "llm_error" and breaker_stats()["state"] == BREAKER_CLOSED,
+        )
+    finally:
+        await close_client()
+        await runner.cleanup()
+
+    print(f"Не прошло: {', '.join(failed)}" if failed else "Все сценарии прошли")
+    return 1 if failed else 0
+
+
+async def serve(stub: FakeGigaChat, port: int) -> None:
+    runner = await _start(stub, port)
+    print(f"Заглушка GigaChat: http://127.0.0.1:{port} (режим {stub.mode}); Ctrl+C — выход")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка GigaChat с внедрением отказов")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--mode", choices=MODES, default="ok")
+    parser.add_argument("--delay", type=float, default=5.0, help="Задержка ответа в режиме slow, с")
+    parser.add_argument("--error-rate", type=float, default=0.5, help="Доля отказов в режиме flaky")
+    parser.add_argument("--check", action="store_true", help="Прогнать сценарии отказа и выйти")
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(asyncio.run(run_checks(args.port)))
+    try:
+        asyncio.run(serve(FakeGigaChat(args.mode, args.delay, args.error_rate), args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
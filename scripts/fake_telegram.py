@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Локальная проверка режима webhook без Telegram: поддельный Bot API + отправитель обновлений.
+
+Скрипт поднимает поддельный Bot API (getMe, sendMessage, editMessageText, answerCallbackQuery, setWebhook;
+ответы sendMessage задерживаются на случайное время — как сеть), шлёт на webhook бота по --messages
+команд /my_id в каждый из --chats чатов (параллельно по чатам, подряд внутри чата) и проверяет, что на
+каждое сообщение пришёл ответ и ответы внутри чата идут в порядке сообщений. В /my_id у каждого
+сообщения свой from.id — по нему ответ сопоставляется с сообщением.
+
+Запуск из корня проекта (два терминала; скрипт ждёт, пока все воркеры бота запустятся):
+  python scripts/fake_telegram.py --webhook http://127.0.0.1:8080/telegram --chats 50 --messages 5
+  TELEGRAM_BOT_TOKEN=1:fake TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot BOT_MODE=webhook BOT_WORKERS=4 python bot.py"""
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+
+from aiohttp import ClientSession, web
+
+ID_RE = re.compile(r"Telegram ID: `(\d+)`")
+
+
+class FakeBotAPI:
+    """Поддельный Bot API: записывает отправленные ботом сообщения по чатам."""
+
+    def __init__(self, max_delay: float):
+        self.max_delay = max_delay
+        self.replies = defaultdict(list)  # chat_id → [(время, текст)]
+        self.calls = defaultdict(int)
+        self._message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            await asyncio.sleep(random.uniform(0, self.max_delay))
+            self.replies[chat_id].append((time.perf_counter(), params.get("text", "")))
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, chat_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+async def send_chat(session, args, chat_id: int, sent: dict, counter: list):
+    """Сообщения одного чата — подряд, как их пишет один пользователь."""
+    for k in range(args.messages):
+        counter[0] += 1
+        user_id = chat_id * 1000 + k
+        sent[user_id] = time.perf_counter()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+        async with session.post(args.webhook, json=make_update(counter[0], chat_id, user_id, "/my_id"), headers=headers) as resp:
+            if resp.status != 200:
+                print(f"  webhook ответил {resp.status} на чат {chat_id}")
+
+
+async def main_async(args):
+    api = FakeBotAPI(args.max_delay)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    print(f"Поддельный Bot API: http://127.0.0.1:{args.api_port}/bot")
+
+    # Ждём, пока приёмник поднимется и каждый воркер выполнит getMe (Application.initialize)
+    health = args.webhook.rsplit("/", 1)[0] + "/health"
+    async with ClientSession() as session:
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(health) as resp:
+                    workers = (await resp.json())["workers"]
+                if api.calls["getMe"] >= workers:
+                    break
+            except Exception:
+                pass
+            await asyncio.sleep(0.5)
+        else:
+            print("Бот не запустился за отведённое время")
+            await runner.cleanup()
+            return 1
+
+    sent = {}
+    counter = [0]
+    chats = [100 + i for i in range(args.chats)]
+    expected = args.chats * args.messages
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(send_chat(session, args, c, sent, counter) for c in chats))
+    accepted = time.perf_counter() - started
+    print(f"Отправлено {expected} обновлений за {accepted:.2f} с")
+
+    deadline = time.perf_counter() + args.timeout
+    while sum(len(v) for v in api.replies.values()) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    total = time.perf_counter() - started
+
+    latencies, out_of_order, received = [], 0, 0
+    for chat_id in chats:
+        ids = []
+        for ts, text in api.replies.get(chat_id, []):
+            m = ID_RE.search(text)
+            if m:
+                user_id = int(m.group(1))
+                ids.append(user_id)
+                latencies.append(ts - sent[user_id])
+        received += len(ids)
+        if ids != sorted(ids):
+            out_of_order += 1
+    print(f"Ответов: {received}/{expected} за {total:.2f} с ({received / max(total, 1e-6):.1f} в с)")
+    if latencies:
+        latencies.sort()
+        print(
+            f"Задержка ответа: медиана {statistics.median(latencies) * 1000:.0f} мс, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} мс"
+        )
+    print(f"Чатов с нарушенным порядком ответов: {out_of_order}")
+    await runner.cleanup()
+    return 0 if received == expected and not out_of_order else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельный Telegram для проверки режима webhook")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="Сообщений в каждом чате")
+    parser.add_argument("--max-delay", type=float, default=0.05, help="Макс. задержка ответа Bot API, с")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
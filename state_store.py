@@ -0,0 +1,223 @@
+"""Хранилище состояния диалогов (контекст последнего ответа пользователя; выбор курса чата — в courses.py).
+Вместо глобального dict в bot.py: записи живут STATE_TTL секунд с последнего обращения, их не больше
+STATE_MAX_ENTRIES.
+Бэкенды (STATE_BACKEND):
+- memory — LRU в памяти процесса (по умолчанию; теряется при перезапуске);
+- sqlite — файл STATE_SQLITE_PATH: переживает перезапуск, общий для нескольких процессов на одной машине;
+- redis — REDIS_URL (Redis или совместимый сервер): общий для реплик бота на разных машинах.
+Значения — JSON-сериализуемые dict."""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _matches(value: Optional[Dict[str, Any]], expect: Optional[Dict[str, Any]]) -> bool:
+    return not expect or (value is not None and all(value.get(k) == v for k, v in expect.items()))
+
+
+class MemoryStateStore:
+    """LRU в памяти с TTL: при переполнении вытесняются давно не использованные записи."""
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = config.STATE_TTL if ttl is None else ttl
+        self.max_entries = config.STATE_MAX_ENTRIES if max_entries is None else max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key → (истекает, значение)
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[key]
+                self.expired += 1
+                return None
+            self._data[key] = (time.time() + self.ttl, entry[1])
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evicted += 1
+
+    def update(self, key: str, fields: Dict[str, Any], expect: Dict[str, Any] = None) -> bool:
+        """Дописывает поля в запись, если она есть и совпадает с expect (например, тот же request_id)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time() or not _matches(entry[1], expect):
+                return False
+            entry[1].update(fields)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "entries": len(self._data), "evicted": self.evicted, "expired": self.expired}
+
+
+class SQLiteStateStore:
+    """Состояние в SQLite: переживает перезапуск; несколько процессов на одной машине делят один файл."""
+
+    def __init__(self, path: str = None, ttl: float = None, max_entries: int = None):
+        self.path = path or config.STATE_SQLITE_PATH
+        self.ttl = config.STATE_TTL if ttl is None else ttl
+        self.max_entries = config.STATE_MAX_ENTRIES if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS state_used ON state(used)")
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM state WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE state SET used = ?, expires = ? WHERE key = ?", (now, now + self.ttl, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Удаляет истёкшие записи и самые давно использованные сверх max_entries (раз в 100 записей)."""
+        self._conn.execute("DELETE FROM state WHERE expires < ?", (now,))
+        self._conn.execute(
+            "DELETE FROM state WHERE key IN (SELECT key FROM state ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def update(self, key: str, fields: Dict[str, Any], expect: Dict[str, Any] = None) -> bool:
+        """Дописывает поля в запись, если она есть и совпадает с expect. Атомарно для всех процессов (BEGIN IMMEDIATE)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value, expires FROM state WHERE key = ?", (key,)).fetchone()
+                value = json.loads(row[0]) if row is not None and row[1] >= now else None
+                if value is None or not _matches(value, expect):
+                    self._conn.execute("ROLLBACK")
+                    return False
+                value.update(fields)
+                self._conn.execute(
+                    "UPDATE state SET value = ?, used = ? WHERE key = ?",
+                    (json.dumps(value, ensure_ascii=False), now, key),
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+        return {"backend": "sqlite", "entries": entries, "path": self.path}
+
+
+class RedisStateStore:
+    """Состояние в Redis (или совместимом сервере): общее для реплик бота.
+    TTL — средствами Redis (EX); ограничение памяти — политикой сервера (maxmemory-policy allkeys-lru).
+    client — готовый клиент с интерфейсом redis-py (например, локальная подмена в тестах)."""
+
+    def __init__(self, url: str = None, ttl: float = None, client=None, prefix: str = "obuchai:state:"):
+        if client is None:
+            import redis  # опциональная зависимость: нужна только для STATE_BACKEND=redis
+            client = redis.Redis.from_url(url or config.REDIS_URL)
+        self.client = client
+        self.ttl = int(config.STATE_TTL if ttl is None else ttl)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        self.client.expire(self.prefix + key, self.ttl)
+        return json.loads(raw)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=self.ttl)
+
+    def update(self, key: str, fields: Dict[str, Any], expect: Dict[str, Any] = None) -> bool:
+        """Дописывает поля в запись, если она есть и совпадает с expect. Оптимистичная транзакция WATCH/MULTI."""
+        from redis.exceptions import WatchError
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    raw = pipe.get(name)
+                    value = json.loads(raw) if raw is not None else None
+                    if value is None or not _matches(value, expect):
+                        pipe.reset()
+                        return False
+                    value.update(fields)
+                    ttl = pipe.ttl(name)
+                    pipe.multi()
+                    pipe.set(name, json.dumps(value, ensure_ascii=False), ex=ttl if ttl and ttl > 0 else self.ttl)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue  # запись изменил другой процесс — повторяем
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis"}
+
+
+_store = None
+
+
+def get_state_store():
+    """Хранилище по STATE_BACKEND (одно на процесс)."""
+    global _store
+    if _store is None:
+        backend = config.STATE_BACKEND
+        if backend == "sqlite":
+            _store = SQLiteStateStore()
+        elif backend == "redis":
+            _store = RedisStateStore()
+        else:
+            if backend != "memory":
+                logger.warning("Неизвестный STATE_BACKEND=%s, используется memory", backend)
+            _store = MemoryStateStore()
+        logger.info("Хранилище состояния: %s", _store.stats())
+    return _store
@@ -0,0 +1,261 @@
+"""Разбор JSON-ответов GigaChat: извлечение объекта из текста, проверка схемы (pydantic), один ремонт.
+
+Модель иногда оборачивает JSON в текст («Вот ответ: {...}»), в ```json-блок или обрывает его по max_tokens.
+extract_json просматривает текст слева направо: каждый «{» — кандидат, json.JSONDecoder.raw_decode разбирает объект
+целиком (вложенные объекты, скобки внутри строк); оборванный объект дописывается закрывающими кавычками
+и скобками. Первый объект, прошедший схему, — результат.
+
+complete_structured — вызов GigaChat + разбор: если ни один объект не прошёл схему, делается ровно один
+повтор с промптом ремонта (prompts.REPAIR, STRUCTURED_OUTPUT_REPAIR); не помог — StructuredOutputError,
+и вызывающий сам решает, как откатиться (без молчаливого type=question). Счётчики исходов по промптам —
+parse_stats(), печатаются в итогах evaluate_blocks.py."""
+import json
+import logging
+from collections import Counter
+from typing import Annotated, Any, ClassVar, Dict, Iterator, Literal, Optional, Tuple, Type, TypeVar
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, field_validator, model_validator
+import config
+from llm_scheduler import PRIORITY_INTERACTIVE
+from prompts import REPAIR
+
+logger = logging.getLogger(__name__)
+
+# Исходы разбора: ok — ответ целиком JSON; extracted — объект найден в тексте или достроен после обрыва;
+# repaired — разобран после повтора с промптом ремонта; failed — не разобран и после ремонта
+OUTCOMES = ("ok", "extracted", "repaired", "failed")
+
+_decoder = json.JSONDecoder()
+_parse_counts: Counter = Counter()
+
+Schema = TypeVar("Schema", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """Ответ модели не разобран по схеме (и после ремонта, если он включён)."""
+
+    def __init__(self, message: str, response_text: str = ""):
+        super().__init__(message)
+        self.response_text = response_text
+
+
+def _to_int(value: Any) -> Any:
+    """«4», 4.0 и 4.5 от модели — целая оценка; остальное проверит pydantic."""
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, float):
+        return int(round(value))
+    return value
+
+
+def _lower(value: Any) -> Any:
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+Score = Annotated[int, BeforeValidator(_to_int), Field(ge=0, le=5)]
+Flag = Annotated[int, BeforeValidator(_to_int), Field(ge=0, le=1)]
+QueryType = Annotated[Literal["question", "abuse", "off_topic", "cheat"], BeforeValidator(_lower)]
+
+
+class NormalizationOutput(BaseModel):
+    """Блок 1: тип сообщения и поисковый запрос."""
+    model_config = ConfigDict(extra="ignore")
+    example: ClassVar[str] = '{"type": "question" | "abuse" | "off_topic" | "cheat", "normalized_query": "строка"}'
+
+    type: QueryType
+    normalized_query: str = ""
+
+
+class CombinedOutput(NormalizationOutput):
+    """Режим combined: тип, поисковый запрос и ответ студенту."""
+    example: ClassVar[str] = (
+        '{"type": "question" | "abuse" | "off_topic" | "cheat", "normalized_query": "строка", '
+        '"answer": "строка (для type не question — пустая)"}'
+    )
+
+    answer: str = ""
+
+
+class JudgeOutput(BaseModel):
+    """Блок 4: оценки Judge. Лишние поля модели сохраняются как есть."""
+    model_config = ConfigDict(extra="allow")
+    example: ClassVar[str] = (
+        '{"relevance": 0-5, "groundedness": 0-5, "safety": 0-5, "completeness": 0-5, "correct_refusal": 0|1, '
+        '"question_type_correct": 0|1, "verdict": "good" | "partial" | "bad", "explanation": "строка"}'
+    )
+
+    relevance: Optional[Score] = None
+    groundedness: Optional[Score] = None
+    safety: Optional[Score] = None
+    completeness: Optional[Score] = None
+    correct_refusal: Optional[Flag] = None
+    question_type_correct: Optional[Flag] = None
+    overall_score: Optional[float] = Field(default=None, ge=0, le=5)
+    verdict: Optional[str] = None
+    explanation: Optional[str] = None
+
+    @field_validator("verdict", mode="before")
+    @classmethod
+    def _verdict(cls, value):
+        return _lower(value)
+
+    @model_validator(mode="after")
+    def _has_scores(self):
+        # Пустой или чужой объект ({}, вложенный фрагмент) не должен превращаться в оценку по умолчанию
+        if all(
+            getattr(self, name) is None
+            for name in ("relevance", "groundedness", "safety", "completeness", "correct_refusal", "question_type_correct")
+        ):
+            raise ValueError("нет ни одной оценки")
+        return self
+
+
+class TemplateCheckOutput(BaseModel):
+    """Короткая проверка шаблонного ответа в Judge."""
+    model_config = ConfigDict(extra="ignore")
+    example: ClassVar[str] = '{"ok": 1} или {"ok": 0}'
+
+    ok: Flag
+
+
+def _close_truncated(text: str, start: int) -> Optional[str]:
+    """Достраивает объект, оборванный по max_tokens: закрывает строку и открытые скобки. None — объект не оборван."""
+    stack = []
+    in_string = escaped = False
+    for ch in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack.pop() != ch:
+                return None
+            if not stack:
+                return None  # объект закрыт — значит, ошибка не в обрыве
+    if not stack:
+        return None
+    tail = text[start:]
+    if in_string:
+        tail += "\\" if escaped else ""
+        tail += '"'
+    tail = tail.rstrip().rstrip(",")
+    if tail.endswith(":"):
+        tail += " null"
+    return tail + "".join(reversed(stack))
+
+
+def iter_json_objects(text: str) -> Iterator[Tuple[Dict[str, Any], bool]]:
+    """JSON-объекты из текста по порядку: (объект, достроен ли после обрыва)."""
+    pos = text.find("{")
+    while pos != -1:
+        try:
+            obj, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            closed = _close_truncated(text, pos)
+            if closed is not None:
+                try:
+                    obj = json.loads(closed)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    if isinstance(obj, dict):
+                        yield obj, True
+            pos = text.find("{", pos + 1)
+            continue
+        if isinstance(obj, dict):
+            yield obj, False
+        pos = text.find("{", end)
+
+
+def extract_json(text: str, schema: Type[Schema]) -> Tuple[Schema, str]:
+    """Первый объект из text, прошедший схему: (модель, "ok" | "extracted"). Иначе StructuredOutputError."""
+    text = text or ""
+    stripped = text.strip()
+    error = "в ответе нет JSON-объекта"
+    for obj, truncated in iter_json_objects(text):
+        try:
+            parsed = schema.model_validate(obj)
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc']) or 'объект'}: {err['msg']}" for err in e.errors()
+            )
+            continue
+        whole = not truncated and stripped.startswith("{") and stripped.endswith("}")
+        return parsed, "ok" if whole else "extracted"
+    raise StructuredOutputError(error, text)
+
+
+async def complete_structured(
+    client,
+    schema: Type[Schema],
+    name: str,
+    *,
+    system_prompt: str,
+    user_message: str,
+    max_tokens: int,
+    temperature: float,
+    priority: str = PRIORITY_INTERACTIVE,
+    prompt_version: Optional[str] = None,
+) -> Schema:
+    """Вызов GigaChat с ответом в JSON по схеме; name — имя промпта для счётчиков.
+    Ошибки самого вызова (сеть, API) пробрасываются как есть; неразобранный ответ — StructuredOutputError."""
+    response_text = await client.chat_completion(
+        system_prompt=system_prompt,
+        user_message=user_message,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        response_format="json_object",
+        priority=priority,
+        prompt_version=prompt_version,
+    )
+    try:
+        parsed, outcome = extract_json(response_text, schema)
+    except StructuredOutputError as e:
+        if not config.STRUCTURED_OUTPUT_REPAIR:
+            _parse_counts[(name, "failed")] += 1
+            raise
+        first_error = e
+    else:
+        _parse_counts[(name, outcome)] += 1
+        return parsed
+
+    logger.info("Ответ %s не разобран (%s) — повтор с промптом ремонта", name, first_error)
+    repaired_text = await client.chat_completion(
+        system_prompt=REPAIR.system(),
+        user_message=REPAIR.user(
+            schema=schema.example,
+            error=str(first_error),
+            response=response_text[: config.STRUCTURED_OUTPUT_REPAIR_MAX_CHARS],
+        ),
+        max_tokens=max_tokens,
+        temperature=0.0,
+        response_format="json_object",
+        priority=priority,
+        prompt_version=REPAIR.version,
+    )
+    try:
+        parsed, _ = extract_json(repaired_text, schema)
+    except StructuredOutputError as e:
+        _parse_counts[(name, "failed")] += 1
+        logger.warning("Ответ %s не разобран и после ремонта: %s", name, e)
+        raise StructuredOutputError(f"{first_error}; после ремонта: {e}", response_text) from None
+    _parse_counts[(name, "repaired")] += 1
+    return parsed
+
+
+def parse_stats() -> Dict[str, Dict[str, int]]:
+    """Исходы разбора по промптам: {имя: {"ok", "extracted", "repaired", "failed"}}."""
+    stats: Dict[str, Dict[str, int]] = {}
+    for (name, outcome), count in _parse_counts.items():
+        stats.setdefault(name, dict.fromkeys(OUTCOMES, 0))[outcome] = count
+    return stats
@@ -0,0 +1,117 @@
+"""Проверки без GigaChat, Telegram и модели эмбеддингов (в отличие от test_bot.py).
+
+Запуск: python -m pytest -q test_offline.py  (или python test_offline.py)"""
+import asyncio
+import json
+import os
+import tempfile
+
+import config
+import courses
+from admission import RequestCoalescer
+from block1_normalization import get_response_template, template_type
+from block2_rag import chunk_refs, context_from_refs, get_context_from_chunks, get_index
+from block4_judge import weighted_judge_summary
+from chunker import MAX_HEADING_LEN, StructureChunker
+from gigachat_client import session_id
+from judge_batch import _infer_query_type
+from prompts import GENERATE
+
+
+def test_template_type_with_course_name():
+    """Шаблон off_topic с подставленным названием курса распознаётся в старых записях judge_log."""
+    answer = get_response_template("off_topic", course_name="Корпоративные финансы")
+    assert _infer_query_type({"answer": answer}) == "off_topic"
+    assert _infer_query_type({"answer": get_response_template("cheat")}) == "cheat"
+    assert _infer_query_type({"answer": "NPV — чистая приведённая стоимость."}) == "question"
+    assert template_type(answer + " И ещё текст ответа.") is None
+
+
+def test_toc_page_children_fit_child_size():
+    """Оглавление (заголовки подряд) не склеивается в один длинный заголовок и не переходит на следующую
+    страницу; заголовок в начале дочернего чанка укладывается в CHILD_CHUNK_SIZE."""
+    toc = "\n".join(f"{i}.{j} Раздел {i}.{j}: анализ финансовой отчётности компании" for i in range(1, 4) for j in range(1, 6))
+    body = "Денежный поток проекта дисконтируется по ставке стоимости капитала компании. " * 30
+    chunker = StructureChunker(child_size=400, parent_size=1800)
+    children, _ = chunker.split(f"{toc}\n{toc}\n{body}", {"source": "book.pdf", "page": 2})
+    assert children
+    assert max(len(c["text"]) for c in children) <= 400
+    assert all(len(c["metadata"]["heading"]) <= MAX_HEADING_LEN for c in children)
+
+    children, _ = chunker.split(toc, {"source": "book.pdf", "page": 3})
+    children, _ = chunker.split(body, {"source": "book.pdf", "page": 4})
+    assert all(c["metadata"]["heading"] == "" for c in children)
+
+
+def test_weighted_summary_skips_judge_errors():
+    """Сбой Judge (error: True, нулевые оценки) не занижает взвешенный средний балл."""
+    verdicts = [
+        {"overall_score": 4.0, "verdict": "good", "sample_weight": 2.0},
+        {"overall_score": 0.0, "verdict": "bad", "sample_weight": 2.0, "error": True},
+    ]
+    summary = weighted_judge_summary(verdicts)
+    assert summary["n"] == 1 and summary["n_errors"] == 1
+    assert summary["avg_score"] == 4.0 and summary["good_share"] == 1.0
+
+
+def test_coalescer_distinguishes_in_flight_and_answered():
+    """Повтор во время обработки ждёт первый запрос; повтор после ответа видит завершённый future (→ «ответ выше»)."""
+    async def scenario():
+        coalescer = RequestCoalescer(window=30)
+        key = (1, "default", "что такое npv")
+        assert coalescer.attach(key) is None
+        coalescer.begin(key)
+        assert not coalescer.attach(key).done()
+        coalescer.finish(key)
+        assert coalescer.attach(key).done()
+    asyncio.run(scenario())
+
+
+def test_chat_course_survives_state_store_eviction():
+    """Выбор курса чата не зависит от TTL и вытеснения в хранилище состояния диалогов."""
+    saved = courses._courses, courses._default_id, config.CHAT_COURSES_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = os.path.join(tmp, "courses.json")
+        with open(registry, "w", encoding="utf-8") as f:
+            json.dump({"default": "esg", "courses": [{"id": "esg"}, {"id": "finance"}]}, f)
+        config.CHAT_COURSES_FILE = os.path.join(tmp, "chat_courses.json")
+        try:
+            courses.load_courses(registry)
+            assert courses.select_course(42, "finance")["id"] == "finance"
+            courses.get_state_store().delete("course:42")
+            assert courses.course_for_chat(42)["id"] == "finance"
+            assert courses.course_for_chat(43)["id"] == "esg"
+        finally:
+            courses._courses, courses._default_id, config.CHAT_COURSES_FILE = saved
+
+
+def test_session_id_per_prompt_and_course():
+    """X-Session-ID одинаков у запросов с одним системным промптом и различается между курсами."""
+    esg = {"id": "esg", "name": "Устойчивое развитие", "description": ""}
+    finance = {"id": "finance", "name": "Корпоративные финансы", "description": ""}
+    assert session_id(GENERATE.version, GENERATE.system(esg)) == session_id(GENERATE.version, GENERATE.system(esg))
+    assert session_id(GENERATE.version, GENERATE.system(esg)) != session_id(GENERATE.version, GENERATE.system(finance))
+
+
+def test_context_restored_from_chunk_refs():
+    """judge_log хранит ссылки на разделы вместо текста контекста; изменившийся раздел не подменяет контекст."""
+    index = get_index()
+    saved = index.parents
+    text = "NPV — сумма дисконтированных денежных потоков проекта."
+    index.parents = {"p1": {"text": text, "metadata": {"source": "npv.pdf"}}}
+    try:
+        chunks = [{"content": text, "metadata": {"source": "npv.pdf", "parent_id": "p1"}}]
+        refs = chunk_refs(chunks)
+        assert text not in json.dumps(refs, ensure_ascii=False)
+        assert context_from_refs(refs) == get_context_from_chunks(chunks)
+        index.parents["p1"] = {"text": text + " Обновлено.", "metadata": {"source": "npv.pdf"}}
+        assert context_from_refs(refs) is None
+    finally:
+        index.parents = saved
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"OK {name}")
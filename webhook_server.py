@@ -0,0 +1,167 @@
+"""Режим webhook (BOT_MODE=webhook): обновления Telegram принимаются по HTTP и раздаются
+BOT_WORKERS процессам-обработчикам.
+
+Приёмник (aiohttp) только проверяет секрет, кладёт обновление в очередь воркера и сразу отвечает 200 —
+Telegram не ждёт генерации ответа. Воркер выбирается по chat_id (chat_id % BOT_WORKERS), поэтому
+все сообщения одного чата обрабатывает один процесс: контекст диалога в STATE_BACKEND=memory остаётся
+корректным, а внутри воркера сообщения чата обрабатываются строго по очереди (asyncio.Lock на чат).
+Разные чаты обрабатываются параллельно — и внутри воркера, и между воркерами.
+
+Каждый воркер — отдельный процесс со своим event loop, клиентом GigaChat и открытым индексом (общая
+vector_db на диске; переиндексацию, сделанную другим воркером, он подхватывает по манифесту).
+Наблюдатель за knowledge_base/ (KB_WATCH_INTERVAL) запускается только в воркере 0.
+
+Локальная проверка без Telegram: scripts/fake_telegram.py."""
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """chat_id обновления (сообщение, правка, нажатие кнопки); None — обновление без чата."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if field in data:
+            return data[field].get("chat", {}).get("id")
+    callback = data.get("callback_query")
+    if callback:
+        message = callback.get("message") or {}
+        return message.get("chat", {}).get("id") or callback.get("from", {}).get("id")
+    return None
+
+
+def route_update(data: Dict[str, Any], workers: int) -> int:
+    """Номер воркера для обновления: по чату, а без чата — по update_id."""
+    chat_id = update_chat_id(data)
+    key = chat_id if chat_id is not None else data.get("update_id", 0)
+    return int(key) % workers
+
+
+# --- Воркер ---
+
+def _worker_main(index: int, queue) -> None:
+    """Точка входа процесса-воркера (spawn: модуль бота импортируется заново)."""
+    try:
+        asyncio.run(_worker_loop(index, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(index: int, queue) -> None:
+    import bot
+    from telegram import Update
+    from gigachat_client import close_client
+
+    bot.start_background(watch=index == 0)
+    application = bot.build_application()
+    await application.initialize()
+    logger.info("Воркер %d запущен", index)
+
+    loop = asyncio.get_running_loop()
+    chats: Dict[Any, list] = {}  # chat_id → [Lock, обновлений в работе]
+    tasks = set()
+
+    async def process(chat_id, update):
+        entry = chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await application.process_update(update)
+        except Exception as e:
+            logger.error("Воркер %d: ошибка обработки обновления %s: %s", index, update.update_id, e)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                chats.pop(chat_id, None)
+
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            # Задачи создаются в порядке очереди, а asyncio.Lock пропускает ожидающих по очереди —
+            # порядок сообщений внутри чата сохраняется
+            task = asyncio.create_task(process(update_chat_id(data), Update.de_json(data, application.bot)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await application.shutdown()
+        await close_client()
+        logger.info("Воркер %d остановлен", index)
+
+
+# --- Приёмник ---
+
+def build_web_app(queues: List, processes: List = None) -> web.Application:
+    """HTTP-приложение: POST WEBHOOK_PATH — обновление от Telegram, GET /health — состояние воркеров."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if config.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != config.WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        # put() не блокирует: запись в канал делает фоновый поток очереди
+        queues[route_update(data, len(queues))].put(data)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        alive = sum(p.is_alive() for p in processes or [])
+        return web.json_response({"workers": len(queues), "alive": alive})
+
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", health)
+    return app
+
+
+async def _register_webhook() -> None:
+    """Регистрирует WEBHOOK_URL в Telegram (setWebhook) вместе с секретом."""
+    from telegram import Bot
+    kwargs = {"base_url": config.TELEGRAM_API_BASE_URL} if config.TELEGRAM_API_BASE_URL else {}
+    async with Bot(config.TELEGRAM_BOT_TOKEN, **kwargs) as tg:
+        await tg.set_webhook(
+            url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=["message", "edited_message", "callback_query"],
+        )
+    logger.info("Webhook зарегистрирован: %s", config.WEBHOOK_URL)
+
+
+def run_webhook(workers: int = None, host: str = None, port: int = None) -> None:
+    """Запускает воркеры и HTTP-приёмник (блокирует до остановки)."""
+    workers = max(workers or config.BOT_WORKERS, 1)
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, queues[i]), name=f"bot-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    if config.WEBHOOK_URL:
+        asyncio.run(_register_webhook())
+
+    host = host or config.WEBHOOK_LISTEN
+    port = port or config.WEBHOOK_PORT
+    logger.info("Webhook: http://%s:%d%s, воркеров %d", host, port, config.WEBHOOK_PATH, workers)
+    try:
+        web.run_app(build_web_app(queues, processes), host=host, port=port, print=None)
+    finally:
+        # Воркеры дорабатывают уже принятые обновления и завершаются
+        for q in queues:
+            q.put(None)
+        for p in processes:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()